@@ -2,19 +2,27 @@ import contextlib
 import logging as logger
 import time
 import uuid
+from collections import defaultdict
 
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
 from django.db import transaction
 from django.db.models import Manager
 from django.db.models import Q
 from django.db.utils import OperationalError
+from django.utils import timezone
 from django_cte import CTEQuerySet
 from le_utils.constants import content_kinds
+from le_utils.constants import roles
+from mptt.exceptions import InvalidMove
 from mptt.managers import TreeManager
 from mptt.signals import node_moved
 
 from contentcuration.constants.locking import TREE_LOCK
 from contentcuration.db.advisory_lock import advisory_lock
 from contentcuration.db.models.query import CustomTreeQuerySet
+from contentcuration.utils.cache import bump_tree_revisions
+from contentcuration.utils.cache import mark_files_modified
 from contentcuration.utils.cache import ResourceSizeCache
 
 
@@ -34,6 +42,166 @@ logging = logger.getLogger(__name__)
 # topology also, so these rudimentary tests are likely insufficient
 BATCH_SIZE = 100
 
+# Generates a new 32 character hex id from a text expression that is unique within the statement,
+# as gen_random_uuid is only built into Postgres 13 and up
+NEW_ID_SQL = "md5(random()::text || clock_timestamp()::text || {})"
+
+# Maps the nodes of a subtree to the ids of their copies, leaving out the excluded descendants and
+# the descendants of nodes that aren't topics. The lft and rght values of the copies are the ranks
+# of the lft and rght values of the copied nodes, so the gaps left by excluded nodes are closed.
+COPY_MAP_SQL = """
+CREATE TEMPORARY TABLE {copy_map} ON COMMIT DROP AS
+WITH subtree AS (
+    SELECT id, parent_id, node_id, kind_id, lft, rght, level
+    FROM {table}
+    WHERE tree_id = %(tree_id)s AND lft >= %(lft)s AND rght <= %(rght)s
+),
+pruned AS (
+    SELECT lft, rght, node_id = ANY(%(excluded)s) AS excluded
+    FROM subtree
+    WHERE node_id = ANY(%(excluded)s) OR (kind_id <> %(topic)s AND rght - lft > 1)
+),
+included AS (
+    SELECT * FROM subtree n
+    WHERE n.id = %(root_id)s OR NOT EXISTS (
+        SELECT 1 FROM pruned p
+        WHERE (n.lft > p.lft AND n.rght < p.rght) OR (p.excluded AND n.lft = p.lft)
+    )
+),
+ranks AS (
+    SELECT id, ROW_NUMBER() OVER (ORDER BY value) - 1 AS rank
+    FROM (
+        SELECT id, lft AS value FROM included
+        UNION ALL
+        SELECT id, rght AS value FROM included
+    ) AS boundaries
+)
+SELECT
+    n.id AS source_id,
+    CASE WHEN n.id = %(root_id)s THEN %(copy_id)s ELSE {new_id} END AS copy_id,
+    n.parent_id AS source_parent_id,
+    MIN(r.rank) AS lft,
+    MAX(r.rank) AS rght,
+    n.level - %(level)s AS level
+FROM included n
+JOIN ranks r ON r.id = n.id
+GROUP BY n.id, n.parent_id, n.level
+"""
+
+INSERT_NODE_COPIES_SQL = """
+INSERT INTO {table} ({columns})
+SELECT {selects}
+FROM {copy_map} m
+JOIN {table} s ON s.id = m.source_id
+LEFT JOIN {copy_map} pm ON pm.source_id = m.source_parent_id
+"""
+
+INSERT_FILE_COPIES_SQL = """
+INSERT INTO {file_table} (id, contentnode_id, modified, {columns})
+SELECT {new_id}, m.copy_id, %s, {selects}
+FROM {copy_map} m
+JOIN {file_table} s ON s.contentnode_id = m.source_id
+"""
+
+# An assessment_id is unique within a node, so it identifies the copy of each assessment item
+INSERT_ASSESSMENT_ITEM_COPIES_SQL = """
+WITH assessment_items AS (
+    INSERT INTO {assessment_item_table} (contentnode_id, {assessment_item_columns})
+    SELECT m.copy_id, {assessment_item_selects}
+    FROM {copy_map} m
+    JOIN {assessment_item_table} s ON s.contentnode_id = m.source_id
+    RETURNING id, contentnode_id, assessment_id
+)
+INSERT INTO {file_table} (id, assessment_item_id, modified, {file_columns})
+SELECT {new_id}, a.id, %s, {file_selects}
+FROM {copy_map} m
+JOIN {assessment_item_table} source_item ON source_item.contentnode_id = m.source_id
+JOIN assessment_items a ON a.contentnode_id = m.copy_id AND a.assessment_id = source_item.assessment_id
+JOIN {file_table} s ON s.assessment_item_id = source_item.id
+"""
+
+# Copies are tagged with channel-less tags, so create those for the channel tags that have none
+CREATE_TAG_COPIES_SQL = """
+INSERT INTO {tag_table} (id, tag_name, channel_id)
+SELECT {new_id}, names.tag_name, NULL
+FROM (
+    SELECT DISTINCT t.tag_name
+    FROM {copy_map} m
+    JOIN {through_table} nt ON nt.contentnode_id = m.source_id
+    JOIN {tag_table} t ON t.id = nt.contenttag_id
+    WHERE t.channel_id IS NOT NULL
+) AS names
+WHERE NOT EXISTS (
+    SELECT 1 FROM {tag_table} e WHERE e.tag_name = names.tag_name AND e.channel_id IS NULL
+)
+"""
+
+# Nodes that have both a channel tag and a channel-less tag with the same name get the tag once
+INSERT_TAG_COPIES_SQL = """
+INSERT INTO {through_table} (contentnode_id, contenttag_id)
+SELECT m.copy_id, COALESCE(channel_less.id, t.id)
+FROM {copy_map} m
+JOIN {through_table} nt ON nt.contentnode_id = m.source_id
+JOIN {tag_table} t ON t.id = nt.contenttag_id
+LEFT JOIN LATERAL (
+    SELECT e.id FROM {tag_table} e
+    WHERE t.channel_id IS NOT NULL AND e.tag_name = t.tag_name AND e.channel_id IS NULL
+    ORDER BY e.id
+    LIMIT 1
+) AS channel_less ON TRUE
+ON CONFLICT DO NOTHING
+"""
+
+# The conditions under which a node `n` is counted in each of the aggregates of its ancestors
+AGGREGATE_CONDITIONS_SQL = {
+    "resource_count": "n.kind_id IS DISTINCT FROM %(topic)s",
+    "coach_count": "n.kind_id IS DISTINCT FROM %(topic)s AND n.role_visibility = %(coach)s",
+    "error_count": "n.complete = FALSE",
+    "updated_count": "n.kind_id IS DISTINCT FROM %(topic)s AND n.changed AND n.published",
+    "new_count": "n.kind_id IS DISTINCT FROM %(topic)s AND n.changed AND NOT n.published",
+}
+
+AGGREGATE_FIELDS = tuple(AGGREGATE_CONDITIONS_SQL)
+
+# The fields of a node that decide which aggregates it is counted in
+AGGREGATED_NODE_FIELDS = ("kind_id", "role_visibility", "complete", "changed", "published")
+
+# Adds the counts of each node to the aggregates of its ancestors, creating the aggregates that don't exist yet.
+# The aggregates are updated in the order of their ids, so that concurrent updates lock them in the same order.
+UPDATE_ANCESTOR_AGGREGATES_SQL = """
+INSERT INTO {aggregate_table} AS existing (contentnode_id, {columns})
+SELECT a.id, {sums}
+FROM (VALUES {values}) AS d (id, {columns})
+JOIN {table} n ON n.id = d.id
+JOIN {table} a ON a.tree_id = n.tree_id AND a.lft < n.lft AND a.rght > n.rght
+GROUP BY a.id
+ORDER BY a.id
+ON CONFLICT (contentnode_id) DO UPDATE SET {updates}
+"""
+
+# The counts of each node and its descendants
+SUBTREE_AGGREGATES_SQL = """
+SELECT n.id, {totals}
+FROM {table} n
+LEFT JOIN {aggregate_table} a ON a.contentnode_id = n.id
+WHERE n.id = ANY(%(ids)s)
+"""
+
+DELETE_AGGREGATES_SQL = """
+DELETE FROM {aggregate_table} a
+USING {table} p
+WHERE a.contentnode_id = p.id AND {where}
+"""
+
+REBUILD_AGGREGATES_SQL = """
+INSERT INTO {aggregate_table} (contentnode_id, {columns})
+SELECT p.id, {counts}
+FROM {table} p
+JOIN {table} n ON n.tree_id = p.tree_id AND n.lft > p.lft AND n.rght < p.rght
+WHERE {where} AND p.rght - p.lft > 1
+GROUP BY p.id
+"""
+
 
 class CustomManager(Manager.from_queryset(CTEQuerySet)):
     """
@@ -43,6 +211,96 @@ class CustomManager(Manager.from_queryset(CTEQuerySet)):
     pass
 
 
+# Counts the files of nodes uploaded by users, for each tree, uploader, checksum, size and kind,
+# to add to or subtract from the references to them in the ledger
+CHECKSUM_REFERENCE_COUNTS_SQL = """
+SELECT n.tree_id, f.uploaded_by_id, f.checksum, COALESCE(f.file_size, 0), COALESCE(p.kind_id, ''), {sign}COUNT(*)
+FROM {file_table} f
+INNER JOIN {node_table} n ON n.id = f.contentnode_id
+LEFT OUTER JOIN {preset_table} p ON p.id = f.preset_id
+WHERE f.uploaded_by_id IS NOT NULL AND {condition}
+GROUP BY 1, 2, 3, 4, 5
+ORDER BY 1, 2, 3, 4, 5
+"""
+
+UPDATE_CHECKSUM_REFERENCES_SQL = """
+INSERT INTO {table} AS existing (tree_id, uploaded_by_id, checksum, file_size, kind, count)
+{counts}
+ON CONFLICT (tree_id, uploaded_by_id, checksum, file_size, kind)
+DO UPDATE SET count = existing.count + EXCLUDED.count
+RETURNING existing.id, existing.count
+"""
+
+REBUILD_CHECKSUM_REFERENCES_SQL = """
+INSERT INTO {table} (tree_id, uploaded_by_id, checksum, file_size, kind, count)
+{counts}
+"""
+
+
+class ChecksumReferenceManager(Manager):
+    """
+    Maintains the ledger of references to checksums by the files of the nodes of each tree
+    """
+
+    def _format_sql(self, sql, condition, subtract=False):
+        from contentcuration.models import ContentNode
+        from contentcuration.models import File
+        from contentcuration.models import FormatPreset
+
+        counts = CHECKSUM_REFERENCE_COUNTS_SQL.format(
+            sign="-" if subtract else "",
+            file_table=File._meta.db_table,
+            node_table=ContentNode._meta.db_table,
+            preset_table=FormatPreset._meta.db_table,
+            condition=condition,
+        )
+        return sql.format(table=self.model._meta.db_table, counts=counts)
+
+    def _update(self, condition, params, subtract=False):
+        with connection.cursor() as cursor:
+            cursor.execute(self._format_sql(UPDATE_CHECKSUM_REFERENCES_SQL, condition, subtract=subtract), params)
+            released_ids = [reference_id for reference_id, count in cursor.fetchall() if count <= 0]
+        if released_ids:
+            self.filter(id__in=released_ids, count__lte=0).delete()
+
+    def update_files(self, files, subtract=False):
+        """
+        Adds the references of the files in the `files` queryset to the ledger, or subtracts them,
+        deleting references that no files hold anymore
+        """
+        try:
+            files_sql, params = files.order_by().values("id").query.sql_with_params()
+        except EmptyResultSet:
+            # There are no files to update, such as when filtering on an empty list of ids
+            return
+        self._update("f.id IN ({})".format(files_sql), params, subtract=subtract)
+
+    def update_subtree(self, tree_id, lft, rght, subtract=False):
+        """
+        Adds the references of the files of the nodes of a subtree to the ledger, or subtracts them,
+        filtering on the nodes directly rather than on a queryset of their files
+        """
+        self._update("n.tree_id = %s AND n.lft >= %s AND n.rght <= %s", [tree_id, lft, rght], subtract=subtract)
+
+    @contextlib.contextmanager
+    def maintain_files(self, files):
+        """
+        Updates the ledger for changes made to the files in the `files` queryset within the context,
+        by subtracting their references before the changes and adding them after
+        """
+        self.update_files(files, subtract=True)
+        yield
+        self.update_files(files)
+
+    def rebuild(self, tree_id):
+        """
+        Replaces the references of the tree with ones counted from its files
+        """
+        self.filter(tree_id=tree_id).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(self._format_sql(REBUILD_CHECKSUM_REFERENCES_SQL, "n.tree_id = %s"), [tree_id])
+
+
 def log_lock_time_spent(timespent):
     logging.debug("Spent {} seconds inside an mptt lock".format(timespent))
 
@@ -115,6 +373,12 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             # and should help to minimize deadlocks
             for tree_id in tree_ids:
                 advisory_lock(TREE_LOCK, key2=tree_id, shared=tree_id in shared_tree_ids)
+            # The trees are locked to change them, so bump their revisions once the changes are committed,
+            # and as changes to the structure of a tree change which files count towards the sizes of its nodes,
+            # move their files modified watermarks too
+            changed_tree_ids = [tree_id for tree_id in tree_ids if tree_id not in shared_tree_ids]
+            bump_tree_revisions(*changed_tree_ids)
+            mark_files_modified(*changed_tree_ids)
             yield
             log_lock_time_spent(time.time() - start)
 
@@ -146,8 +410,143 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             yield
 
     def partial_rebuild(self, tree_id):
+        from contentcuration.models import ChecksumReference
+
         with self.lock_mptt(tree_id):
-            return super(CustomContentNodeTreeManager, self).partial_rebuild(tree_id)
+            result = super(CustomContentNodeTreeManager, self).partial_rebuild(tree_id)
+            # Aggregates aren't maintained while mptt updates are delayed, so rebuild them with the tree
+            self.rebuild_aggregates(tree_id)
+            ChecksumReference.objects.rebuild(tree_id)
+            return result
+
+    def maintains_aggregates(self):
+        """
+        Aggregates are looked up with the lft and rght values of the nodes, so they are only
+        maintained while mptt keeps those up to date
+        """
+        return self.model._mptt_updates_enabled and not self.model._mptt_is_tracking
+
+    def get_aggregate_counts(self, values):
+        """
+        Returns the counts that a node with the given values of AGGREGATED_NODE_FIELDS
+        adds to each of the aggregates of its ancestors
+        """
+        resource = values["kind_id"] != content_kinds.TOPIC
+        changed = resource and values["changed"]
+        return {
+            "resource_count": int(resource),
+            "coach_count": int(resource and values["role_visibility"] == roles.COACH),
+            "error_count": int(values["complete"] is False),
+            "updated_count": int(bool(changed and values["published"])),
+            "new_count": int(bool(changed and not values["published"])),
+        }
+
+    def _format_aggregate_sql(self, sql, **kwargs):
+        from contentcuration.models import ContentNodeAggregate
+
+        return sql.format(
+            table=self.model._meta.db_table,
+            aggregate_table=ContentNodeAggregate._meta.db_table,
+            columns=", ".join(AGGREGATE_FIELDS),
+            **kwargs
+        )
+
+    def update_ancestor_aggregates(self, counts, subtract=False):
+        """
+        Adds a dict of counts, by the id of the node they are for, to the aggregates of the ancestors of each node,
+        or subtracts them from the aggregates
+        """
+        sign = -1 if subtract else 1
+        counts = [(node_id, node_counts) for node_id, node_counts in counts.items() if any(node_counts.values())]
+        if not counts:
+            return
+        sql = self._format_aggregate_sql(
+            UPDATE_ANCESTOR_AGGREGATES_SQL,
+            sums=", ".join("SUM(d.{})".format(field) for field in AGGREGATE_FIELDS),
+            values=", ".join(["({})".format(", ".join(["%s"] * (len(AGGREGATE_FIELDS) + 1)))] * len(counts)),
+            updates=", ".join("{0} = existing.{0} + EXCLUDED.{0}".format(field) for field in AGGREGATE_FIELDS),
+        )
+        params = []
+        for node_id, node_counts in counts:
+            params.append(node_id)
+            params.extend(sign * node_counts[field] for field in AGGREGATE_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def get_subtree_aggregates(self, *node_ids):
+        """
+        Returns the counts of each of the nodes and its descendants, by the id of the node
+        """
+        totals = ", ".join(
+            "CASE WHEN {} THEN 1 ELSE 0 END + COALESCE(a.{}, 0)".format(AGGREGATE_CONDITIONS_SQL[field], field)
+            for field in AGGREGATE_FIELDS
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self._format_aggregate_sql(SUBTREE_AGGREGATES_SQL, totals=totals),
+                {"ids": list(node_ids), "topic": content_kinds.TOPIC, "coach": roles.COACH},
+            )
+            return {row[0]: dict(zip(AGGREGATE_FIELDS, row[1:])) for row in cursor.fetchall()}
+
+    def add_to_ancestor_aggregates(self, *node_ids):
+        """
+        Adds the counts of the nodes and their descendants to the aggregates of their ancestors,
+        once the nodes have been inserted into their tree
+        """
+        self.update_ancestor_aggregates(self.get_subtree_aggregates(*node_ids))
+
+    def remove_from_ancestor_aggregates(self, *node_ids):
+        """
+        Removes the counts of the nodes and their descendants from the aggregates of their ancestors,
+        before the nodes are removed from their tree
+        """
+        self.update_ancestor_aggregates(self.get_subtree_aggregates(*node_ids), subtract=True)
+
+    @contextlib.contextmanager
+    def maintain_aggregates(self, queryset):
+        """
+        Updates the aggregates of the ancestors of the nodes in `queryset` for the changes made to them
+        within the context, for updates that don't go through `ContentNode.save`
+        """
+        if not self.maintains_aggregates():
+            yield
+            return
+        before = {values["id"]: self.get_aggregate_counts(values) for values in queryset.values("id", *AGGREGATED_NODE_FIELDS)}
+        yield
+        counts = {}
+        for values in queryset.values("id", *AGGREGATED_NODE_FIELDS):
+            if values["id"] in before:
+                after = self.get_aggregate_counts(values)
+                counts[values["id"]] = {field: after[field] - before[values["id"]][field] for field in AGGREGATE_FIELDS}
+        self.update_ancestor_aggregates(counts)
+
+    def rebuild_aggregates(self, tree_id, lft=None, rght=None):
+        """
+        Recounts the aggregates of the nodes of a tree, or of the nodes with lft and rght values between `lft` and `rght`
+        """
+        where = "p.tree_id = %(tree_id)s"
+        if lft is not None:
+            where += " AND p.lft >= %(lft)s AND p.rght <= %(rght)s"
+        params = {"tree_id": tree_id, "lft": lft, "rght": rght, "topic": content_kinds.TOPIC, "coach": roles.COACH}
+        counts = ", ".join(
+            "COUNT(*) FILTER (WHERE {})".format(AGGREGATE_CONDITIONS_SQL[field]) for field in AGGREGATE_FIELDS
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(self._format_aggregate_sql(DELETE_AGGREGATES_SQL, where=where), params)
+            cursor.execute(self._format_aggregate_sql(REBUILD_AGGREGATES_SQL, where=where, counts=counts), params)
+
+    def _move_node(self, node, target, position="last-child", save=True, refresh_target=True):
+        if not self.maintains_aggregates():
+            return super(CustomContentNodeTreeManager, self)._move_node(
+                node, target, position=position, save=save, refresh_target=refresh_target
+            )
+        # The counts are looked up before the move, as the node may be saved with changes once it has moved
+        counts = self.get_subtree_aggregates(node.id)
+        self.update_ancestor_aggregates(counts, subtract=True)
+        super(CustomContentNodeTreeManager, self)._move_node(
+            node, target, position=position, save=save, refresh_target=refresh_target
+        )
+        self.update_ancestor_aggregates(counts)
 
     def _move_child_to_new_tree(self, node, target, position):
         from contentcuration.models import PrerequisiteContentRelationship
@@ -224,10 +623,16 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             # will remain fresh until the lock is released at the end
             # of the context manager.
             self._mptt_refresh(node, target)
+            # The files of the subtree reference their checksums from the tree it is moved to instead
+            update_checksum_references = node.tree_id != target.tree_id and self.maintains_aggregates()
+            if update_checksum_references:
+                self._update_subtree_checksum_references(node, subtract=True)
             # N.B. this only calls save if we are running inside a
             # delay MPTT updates context
             self._move_node(node, target, position=position)
             node.save(skip_lock=True)
+            if update_checksum_references:
+                self._update_subtree_checksum_references(node)
         node_moved.send(
             sender=node.__class__, instance=node, target=target, position=position,
         )
@@ -240,6 +645,205 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             ]:
                 size_cache.reset_modified(None)
 
+    def _update_subtree_checksum_references(self, node, subtract=False):
+        """
+        Adds the references of the files of the subtree of `node` to the ledger, or subtracts them
+        """
+        from contentcuration.models import ChecksumReference
+
+        opts = self.model._mptt_meta
+        ChecksumReference.objects.update_subtree(
+            getattr(node, opts.tree_id_attr),
+            getattr(node, opts.left_attr),
+            getattr(node, opts.right_attr),
+            subtract=subtract,
+        )
+
+    def _can_move_in_tree(self, node, target, position):
+        # Moves that change the tree of a node, or make it a root node, are made by move_node
+        if node.tree_id != target.tree_id or node.level == 0:
+            return False
+        return position in ("first-child", "last-child") or target.level > 0
+
+    def _get_move_subtree(self, moves):
+        """
+        Returns the smallest subtree that contains the old and new parents of the nodes,
+        the moves only rearrange the nodes within it
+        """
+        opts = self.model._mptt_meta
+        inner = [node for node, target, position in moves]
+        inner.extend(target for node, target, position in moves if position in ("left", "right"))
+        outer = [target for node, target, position in moves if position in ("first-child", "last-child")] or inner
+        return self.filter(**{
+            opts.tree_id_attr: moves[0][0].tree_id,
+            "{}__lt".format(opts.left_attr): min(node.lft for node in inner),
+            "{}__gt".format(opts.right_attr): max(node.rght for node in inner),
+            "{}__lte".format(opts.left_attr): min(node.lft for node in outer),
+            "{}__gte".format(opts.right_attr): max(node.rght for node in outer),
+        }).order_by("-{}".format(opts.left_attr)).values("id", opts.left_attr, opts.right_attr, opts.level_attr).first()
+
+    def _move_child(self, children, parents, subtree_id, node_id, target_id, position):
+        """
+        Moves a node in the lists of children of the nodes of a subtree, as _move_node would
+        """
+        relation = "child" if position.endswith("-child") else "sibling"
+        if node_id == target_id:
+            raise InvalidMove("A node may not be made a {} of itself.".format(relation))
+        parent_id = target_id if relation == "child" else parents[target_id]
+        ancestor_id = parent_id
+        while ancestor_id != subtree_id:
+            if ancestor_id == node_id:
+                raise InvalidMove("A node may not be made a {} of any of its descendants.".format(relation))
+            ancestor_id = parents[ancestor_id]
+
+        children[parents[node_id]].remove(node_id)
+        siblings = children[parent_id]
+        if position == "first-child":
+            siblings.insert(0, node_id)
+        elif position == "last-child":
+            siblings.append(node_id)
+        else:
+            siblings.insert(siblings.index(target_id) + (position == "right"), node_id)
+        parents[node_id] = parent_id
+
+    def _renumber_subtree(self, subtree, children):
+        """
+        Returns the lft, rght and level values of the nodes of a subtree, numbered in a single depth first pass
+        """
+        opts = self.model._mptt_meta
+        counter = subtree[opts.left_attr]
+        numbers = {subtree["id"]: [counter, None, subtree[opts.level_attr]]}
+        stack = [(subtree["id"], iter(children[subtree["id"]]))]
+        while stack:
+            node_id, remaining = stack[-1]
+            child_id = next(remaining, None)
+            counter += 1
+            if child_id is None:
+                numbers[node_id][1] = counter
+                stack.pop()
+            else:
+                numbers[child_id] = [counter, None, numbers[node_id][2] + 1]
+                stack.append((child_id, iter(children[child_id])))
+        return numbers
+
+    def _move_nodes_in_tree(self, moves):
+        """
+        Applies moves within a tree to the lists of children of the nodes of the subtree they rearrange,
+        then writes the lft, rght and level values that have changed
+        """
+        opts = self.model._mptt_meta
+        subtree = self._get_move_subtree(moves)
+        children = defaultdict(list)
+        parents = {}
+        original = {}
+        for values in self.filter(**{
+            opts.tree_id_attr: moves[0][0].tree_id,
+            "{}__gte".format(opts.left_attr): subtree[opts.left_attr],
+            "{}__lte".format(opts.right_attr): subtree[opts.right_attr],
+        }).order_by(opts.left_attr).values_list("id", "parent_id", opts.left_attr, opts.right_attr, opts.level_attr):
+            parents[values[0]] = values[1]
+            original[values[0]] = values[1:]
+            if values[0] != subtree["id"]:
+                children[values[1]].append(values[0])
+
+        errors = []
+        changed_ids = set()
+        for node, target, position in moves:
+            old_parent_id = parents[node.id]
+            try:
+                self._move_child(children, parents, subtree["id"], node.id, target.id, position)
+                errors.append(None)
+                changed_ids.update((node.id, old_parent_id, parents[node.id]))
+            except InvalidMove as e:
+                errors.append(e)
+
+        updated_nodes = []
+        for node_id, (lft, rght, level) in self._renumber_subtree(subtree, children).items():
+            if (parents[node_id], lft, rght, level) != original[node_id]:
+                updated_nodes.append(self.model(**{
+                    "id": node_id,
+                    "parent_id": parents[node_id],
+                    opts.left_attr: lft,
+                    opts.right_attr: rght,
+                    opts.level_attr: level,
+                }))
+        self.bulk_update(updated_nodes, ["parent_id", opts.left_attr, opts.right_attr, opts.level_attr], batch_size=BATCH_SIZE)
+        changed_nodes = self.filter(id__in=changed_ids)
+        with self.maintain_aggregates(changed_nodes):
+            changed_nodes.update(changed=True, modified=timezone.now())
+        # Besides marking the nodes changed, the moves don't change the aggregates of the root of the subtree or its ancestors
+        self.rebuild_aggregates(moves[0][0].tree_id, subtree[opts.left_attr] + 1, subtree[opts.right_attr] - 1)
+
+        for (node, target, position), error in zip(moves, errors):
+            if error is None:
+                node.parent_id = parents[node.id]
+        self._mptt_refresh(*[node for node, target, position in moves])
+        return errors
+
+    def move_nodes(self, moves):
+        """
+        Makes a list of (node, target, position) moves in order, as move_node would make each of them,
+        while holding the lock on the trees involved. Consecutive moves within a tree, such as reordering
+        the children of a topic, are applied to the lft and rght values of the nodes in a single pass,
+        rather than shifting the values of the tree for each of the moves.
+
+        Returns a list with the InvalidMove error of each move that could not be made, or None.
+        """
+        moves = list(moves)
+        errors = []
+        tree_ids = [node.tree_id for node, target, position in moves] + [target.tree_id for node, target, position in moves]
+        with self.lock_mptt(*tree_ids):
+            batch_moves = not self.model._mptt_is_tracking and self.model._mptt_updates_enabled
+            while len(errors) < len(moves):
+                remaining = moves[len(errors):]
+                # Earlier moves may have changed the mptt fields of the nodes that remain to be moved
+                self._mptt_refresh(*[node for move in remaining for node in move[:2]])
+                batch = []
+                for node, target, position in remaining:
+                    if not batch_moves or not self._can_move_in_tree(node, target, position) or (batch and node.tree_id != batch[0][0].tree_id):
+                        break
+                    batch.append((node, target, position))
+                if batch:
+                    errors.extend(self._move_nodes_in_tree(batch))
+                    for (node, target, position), error in zip(batch, errors[-len(batch):]):
+                        if error is None:
+                            node_moved.send(sender=node.__class__, instance=node, target=target, position=position)
+                    continue
+                node, target, position = remaining[0]
+                try:
+                    node.move_to(target, position)
+                    errors.append(None)
+                except InvalidMove as e:
+                    errors.append(e)
+        return errors
+
+    def insert_children(self, parent, nodes):
+        """
+        Inserts new nodes as the last children of `parent` with a single insert, after making
+        space for all of them in the tree at once, rather than inserting them one at a time.
+        """
+        nodes = list(nodes)
+        if not nodes:
+            return nodes
+        with self.lock_mptt(parent.tree_id):
+            self._mptt_refresh(parent)
+            self._create_space(2 * len(nodes), parent.rght - 1, parent.tree_id)
+            for i, node in enumerate(nodes):
+                node.parent = parent
+                node.tree_id = parent.tree_id
+                node.level = parent.level + 1
+                node.lft = parent.rght + 2 * i
+                node.rght = node.lft + 1
+            nodes = self.bulk_create(nodes)
+            self.update_ancestor_aggregates({
+                node.id: self.get_aggregate_counts({field: getattr(node, field) for field in AGGREGATED_NODE_FIELDS})
+                for node in nodes
+            })
+            parent.rght += 2 * len(nodes)
+            # As saving a child under the parent would
+            self.filter(pk=parent.pk).update(changed=True)
+        return nodes
+
     def get_source_attributes(self, source):
         """
         These attributes will be copied when the node is copied
@@ -290,12 +894,22 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
 
         copy.update(self.get_source_attributes(source))
 
-        if isinstance(mods, dict):
-            allowed_keys = EDIT_ALLOWED_OVERRIDES if can_edit_source_channel else ALLOWED_OVERRIDES
-            for key, value in mods.items():
-                if key in copy and key in allowed_keys:
-                    copy[key] = value
+        copy.update(self._get_copy_mods(mods, can_edit_source_channel, copy))
+
+        self._set_original_fields(copy, source)
+
+        return copy
 
+    def _get_copy_mods(self, mods, can_edit_source_channel, keys):
+        """
+        Returns the mods that are allowed to override the copied `keys`
+        """
+        if not isinstance(mods, dict):
+            return {}
+        allowed_keys = EDIT_ALLOWED_OVERRIDES if can_edit_source_channel else ALLOWED_OVERRIDES
+        return {key: value for key, value in mods.items() if key in keys and key in allowed_keys}
+
+    def _set_original_fields(self, copy, source):
         # There might be some legacy nodes that don't have these, so ensure they are added
         if (
             copy["original_channel_id"] is None
@@ -310,8 +924,6 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             if copy["original_source_node_id"] is None:
                 copy["original_source_node_id"] = original_node.node_id
 
-        return copy
-
     def _recurse_to_create_tree(
         self,
         source,
@@ -380,6 +992,19 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         if progress_tracker:
             progress_tracker.set_total(total_nodes)
 
+        if self._can_copy_in_database(target, position):
+            return self._copy_in_database(
+                node,
+                target,
+                position,
+                source_channel_id,
+                pk,
+                mods,
+                excluded_descendants,
+                can_edit_source_channel,
+                progress_tracker=progress_tracker,
+            )
+
         return self._copy(
             node,
             target,
@@ -547,6 +1172,7 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
         File.objects.bulk_create(node_assessmentitem_files)
 
     def _copy_files(self, source_copy_id_map):
+        from contentcuration.models import ChecksumReference
         from contentcuration.models import File
 
         node_files = list(
@@ -558,6 +1184,7 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
             file.contentnode_id = source_copy_id_map[file.contentnode_id]
 
         File.objects.bulk_create(node_files)
+        ChecksumReference.objects.update_files(File.objects.filter(contentnode_id__in=source_copy_id_map.values()))
 
     def _copy_associated_objects(self, source_copy_id_map):
         self._copy_files(source_copy_id_map)
@@ -639,9 +1266,271 @@ class CustomContentNodeTreeManager(TreeManager.from_queryset(CustomTreeQuerySet)
                 data, target=target, position=position
             )
             new_nodes = self.bulk_create(nodes_to_create)
+            if self.maintains_aggregates():
+                self._add_copy_to_aggregates(new_nodes[0])
         if target:
             self.filter(pk=target.pk).update(changed=True)
 
         self._copy_associated_objects(source_copy_id_map)
 
         return new_nodes
+
+    def _add_copy_to_aggregates(self, node_copy):
+        """
+        Counts the aggregates of the nodes of a copied subtree, then adds its counts to the aggregates of its ancestors
+        """
+        opts = self.model._mptt_meta
+        self.rebuild_aggregates(
+            getattr(node_copy, opts.tree_id_attr), getattr(node_copy, opts.left_attr), getattr(node_copy, opts.right_attr)
+        )
+        self.add_to_ancestor_aggregates(node_copy.id)
+
+    def _can_copy_in_database(self, target, position):
+        # The database copy positions the nodes itself, so it can only be used while mptt
+        # keeps the trees up to date, and it doesn't create new trees next to a root node
+        return (
+            self.model._mptt_updates_enabled
+            and not self.model._mptt_is_tracking
+            and not (target and target.is_root_node() and position in ["left", "right"])
+        )
+
+    def _get_copy_position(self, target, position):
+        """
+        Returns the tree_id, parent_id, lft and level of a copy inserted relative to `target`,
+        and the point after which space has to be created for it
+        """
+        if target is None:
+            return self._get_next_tree_id(), None, 1, 0, None
+        if position in ["last-child", "first-child"]:
+            space_target = target.rght - 1 if position == "last-child" else target.lft
+            return target.tree_id, target.id, space_target + 1, target.level + 1, space_target
+        if position in ["left", "right"]:
+            space_target = target.lft - 1 if position == "left" else target.rght
+            return target.tree_id, target.parent_id, space_target + 1, target.level, space_target
+        raise ValueError("An invalid position was given: {}.".format(position))
+
+    def _create_copy_map(self, cursor, copy_map, node, pk, excluded_descendants):
+        """
+        Creates a temporary table that maps the nodes to copy to the ids of their copies, with the
+        lft, rght and level of the copies relative to the root of the copy. Returns the number of nodes.
+        """
+        opts = self.model._meta
+        cursor.execute(
+            COPY_MAP_SQL.format(copy_map=copy_map, table=opts.db_table, new_id=NEW_ID_SQL.format("n.id")),
+            {
+                "tree_id": node.tree_id,
+                "lft": node.lft,
+                "rght": node.rght,
+                "level": node.level,
+                "root_id": node.id,
+                "copy_id": opts.pk.get_db_prep_save(pk or uuid.uuid4().hex, connection),
+                "excluded": list(excluded_descendants.keys()) if excluded_descendants else [],
+                "topic": content_kinds.TOPIC,
+            },
+        )
+        count = cursor.rowcount
+        # Temporary tables aren't analyzed automatically, so give the planner the size of the map
+        cursor.execute("ANALYZE {}".format(copy_map))
+        return count
+
+    def _insert_node_copies(
+        self,
+        cursor,
+        copy_map,
+        source_channel_id,
+        can_edit_source_channel,
+        tree_id,
+        parent_id,
+        left,
+        level,
+    ):
+        opts = self.model._meta
+
+        def column(name):
+            return connection.ops.quote_name(opts.get_field(name).column)
+
+        # The same values as `_clone_node` sets on a copy
+        expressions = {
+            name: ("s.{}".format(column(name)), [])
+            for name in self.get_source_attributes(self.model()).keys()
+        }
+        expressions.update({
+            "id": ("m.copy_id", []),
+            "node_id": (NEW_ID_SQL.format("s.id"), []),
+            "aggregator": ("s.aggregator", []),
+            "cloned_source_id": ("s.id", []),
+            "source_node_id": ("s.node_id", []),
+            "original_channel_id": ("s.original_channel_id", []),
+            "original_source_node_id": ("s.original_source_node_id", []),
+            "freeze_authoring_data": ("%s OR s.freeze_authoring_data", [not can_edit_source_channel]),
+            "parent_id": ("COALESCE(pm.copy_id, %s)", [parent_id]),
+            "complete": ("s.complete", []),
+            "lft": ("m.lft + %s", [left]),
+            "rght": ("m.rght + %s", [left]),
+            "level": ("m.level + %s", [level]),
+        })
+        values = {
+            "source_channel_id": source_channel_id,
+            "changed": True,
+            "published": False,
+            "tree_id": tree_id,
+        }
+        now = timezone.now()
+        columns = []
+        selects = []
+        params = []
+        for field in opts.concrete_fields:
+            columns.append(connection.ops.quote_name(field.column))
+            if field.attname in expressions:
+                select, select_params = expressions[field.attname]
+                selects.append(select)
+                params.extend(select_params)
+                continue
+            # Every other field takes its default, as on a new model instance
+            if field.attname in values:
+                value = values[field.attname]
+            elif getattr(field, "auto_now", False):
+                value = now
+            else:
+                value = field.get_default()
+            selects.append("%s")
+            params.append(field.get_db_prep_save(value, connection))
+
+        cursor.execute(
+            INSERT_NODE_COPIES_SQL.format(
+                table=opts.db_table,
+                columns=", ".join(columns),
+                selects=", ".join(selects),
+                copy_map=copy_map,
+            ),
+            params,
+        )
+
+    def _insert_associated_copies(self, cursor, copy_map):
+        from contentcuration.models import AssessmentItem
+        from contentcuration.models import ContentTag
+        from contentcuration.models import File
+
+        file_opts = File._meta
+        assessment_item_opts = AssessmentItem._meta
+        now = file_opts.get_field("modified").get_db_prep_save(timezone.now(), connection)
+
+        def copy_columns(opts, exclude):
+            columns = [
+                connection.ops.quote_name(field.column)
+                for field in opts.concrete_fields
+                if field.name not in exclude
+            ]
+            return ", ".join(columns), ", ".join("s.{}".format(c) for c in columns)
+
+        file_columns, file_selects = copy_columns(file_opts, ["id", "contentnode", "modified"])
+        assessment_item_file_columns, assessment_item_file_selects = copy_columns(file_opts, ["id", "assessment_item", "modified"])
+        assessment_item_columns, assessment_item_selects = copy_columns(assessment_item_opts, ["id", "contentnode"])
+        tag_through_opts = self.model.tags.through._meta
+
+        cursor.execute(
+            INSERT_FILE_COPIES_SQL.format(
+                file_table=file_opts.db_table,
+                columns=file_columns,
+                selects=file_selects,
+                new_id=NEW_ID_SQL.format("s.id"),
+                copy_map=copy_map,
+            ),
+            [now],
+        )
+        cursor.execute(
+            INSERT_ASSESSMENT_ITEM_COPIES_SQL.format(
+                assessment_item_table=assessment_item_opts.db_table,
+                assessment_item_columns=assessment_item_columns,
+                assessment_item_selects=assessment_item_selects,
+                file_table=file_opts.db_table,
+                file_columns=assessment_item_file_columns,
+                file_selects=assessment_item_file_selects,
+                new_id=NEW_ID_SQL.format("s.id"),
+                copy_map=copy_map,
+            ),
+            [now],
+        )
+        tag_tables = {
+            "tag_table": ContentTag._meta.db_table,
+            "through_table": tag_through_opts.db_table,
+            "new_id": NEW_ID_SQL.format("names.tag_name"),
+            "copy_map": copy_map,
+        }
+        cursor.execute(CREATE_TAG_COPIES_SQL.format(**tag_tables))
+        cursor.execute(INSERT_TAG_COPIES_SQL.format(**tag_tables))
+
+    def _set_copy_original_fields(self, copies):
+        copies = list(copies.filter(
+            Q(original_channel_id__isnull=True) | Q(original_source_node_id__isnull=True)
+        ).select_related("cloned_source"))
+        for copy in copies:
+            fields = {
+                "original_channel_id": copy.original_channel_id,
+                "original_source_node_id": copy.original_source_node_id,
+            }
+            self._set_original_fields(fields, copy.cloned_source)
+            for key, value in fields.items():
+                setattr(copy, key, value)
+        self.bulk_update(copies, ["original_channel_id", "original_source_node_id"])
+
+    def _copy_in_database(
+        self,
+        node,
+        target,
+        position,
+        source_channel_id,
+        pk,
+        mods,
+        excluded_descendants,
+        can_edit_source_channel,
+        progress_tracker=None,
+    ):
+        """
+        Copies the tree under `node` with a few statements that insert the copies of the nodes,
+        their files, assessment items and tags, from a temporary table that maps the source
+        nodes to their copies and the lft and rght values of the copies.
+
+        :type progress_tracker: contentcuration.utils.celery.ProgressTracker|None
+        """
+        copy_map = "copy_map_{}".format(uuid.uuid4().hex)
+        target_tree_id = target.tree_id if target else None
+        # lock mptt source tree with shared advisory lock, unless the copy goes in the same tree
+        shared_tree_ids = [node.tree_id] if node.tree_id != target_tree_id else []
+
+        with transaction.atomic(), self.lock_mptt(node.tree_id, target_tree_id, shared_tree_ids=shared_tree_ids):
+            self._mptt_refresh(*[n for n in (node, target) if n])
+            with connection.cursor() as cursor:
+                count = self._create_copy_map(cursor, copy_map, node, pk, excluded_descendants)
+                tree_id, parent_id, left, level, space_target = self._get_copy_position(target, position)
+                if space_target is not None:
+                    self._create_space(2 * count, space_target, tree_id)
+                self._insert_node_copies(
+                    cursor,
+                    copy_map,
+                    source_channel_id,
+                    can_edit_source_channel,
+                    tree_id,
+                    parent_id,
+                    left,
+                    level,
+                )
+                self._insert_associated_copies(cursor, copy_map)
+                cursor.execute("DROP TABLE {}".format(copy_map))
+
+            copies = self.filter(tree_id=tree_id, lft__gte=left, rght__lt=left + 2 * count)
+            self._set_copy_original_fields(copies)
+            node_copy = copies.get(lft=left)
+            copy_fields = {field.attname for field in self.model._meta.concrete_fields}
+            copy_mods = self._get_copy_mods(mods, can_edit_source_channel, copy_fields)
+            if copy_mods:
+                self.filter(pk=node_copy.pk).update(**copy_mods)
+                node_copy.refresh_from_db()
+            self._add_copy_to_aggregates(node_copy)
+            self._update_subtree_checksum_references(node_copy)
+            if target:
+                self.filter(pk=target.pk).update(changed=True)
+
+        if progress_tracker:
+            progress_tracker.increment(count)
+        return [node_copy]
@@ -183,6 +183,31 @@ describe('ServerSync tests', () => {
     }
   });
 
+  it('should keep pulling changes while there is a next_rev', async () => {
+    const response = {
+      disallowed: [],
+      allowed: [],
+      changes: [],
+      errors: [],
+      successes: [],
+      tasks: [],
+    };
+    client.post
+      .mockResolvedValueOnce({
+        data: {
+          ...response,
+          successes: [{ server_rev: 100, channel_id: 'test-123' }],
+          next_rev: 100,
+        },
+      })
+      .mockResolvedValueOnce({ data: { ...response, next_rev: null } });
+
+    await debouncedSyncChanges();
+
+    expect(client.post).toHaveBeenCalledTimes(2);
+    expect(client.post.mock.calls[1][1].channel_revs).toEqual({ 'test-123': 100 });
+  });
+
   it('should handle tasks responses', async () => {
     const tasks = [
       {
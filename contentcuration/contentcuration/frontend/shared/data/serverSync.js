@@ -201,6 +201,39 @@ function handleTasks(response) {
   return Task.setTasks(tasks);
 }
 
+function handleResponse(response, userId) {
+  return Promise.all([
+    handleDisallowed(response),
+    handleAllowed(response),
+    handleReturnedChanges(response),
+    handleErrors(response),
+    handleSuccesses(response),
+    handleMaxRevs(response, userId),
+    handleTasks(response),
+  ]);
+}
+
+/**
+ * @param {Object} user - The current session user
+ * @return {Promise<Object>} - Resolves with the revisions to get changes from the server after
+ */
+async function getRevsPayload(user) {
+  const channel_revs = {};
+  if (channelScope.id) {
+    channel_revs[channelScope.id] = get(user, [MAX_REV_KEY, channelScope.id], 0);
+  }
+
+  const unAppliedChanges = await db[CHANGES_TABLE].orderBy('server_rev')
+    .filter(c => c.synced && !c.errors && !c.disallowed)
+    .toArray();
+
+  return {
+    channel_revs,
+    user_rev: user.user_rev || 0,
+    unapplied_revs: unAppliedChanges.map(c => c.server_rev).filter(Boolean),
+  };
+}
+
 const noUserError = 'No user logged in';
 
 /**
@@ -233,20 +266,10 @@ function syncChanges(syncAllChanges) {
         throw new Error(noUserError);
       }
 
-      const channel_revs = {};
-      if (channelScope.id) {
-        channel_revs[channelScope.id] = get(user, [MAX_REV_KEY, channelScope.id], 0);
-      }
-
-      const unAppliedChanges = await db[CHANGES_TABLE].orderBy('server_rev')
-        .filter(c => c.synced && !c.errors && !c.disallowed)
-        .toArray();
-
+      const revsPayload = await getRevsPayload(user);
       const requestPayload = {
         changes: [],
-        channel_revs,
-        user_rev: user.user_rev || 0,
-        unapplied_revs: unAppliedChanges.map(c => c.server_rev).filter(Boolean),
+        ...revsPayload,
       };
 
       // Snapshot which revs we are syncing, so that we can
@@ -282,19 +305,19 @@ function syncChanges(syncAllChanges) {
       //   "changes": [],
       //   "errors": [],
       //   "successes": [],
+      //   "next_rev": null,
       // }
-      const response = await client.post(urls['sync'](), requestPayload);
+      let response = await client.post(urls['sync'](), requestPayload);
       // Clear out this many changes from changeRevs array, since we have now synced them.
       changeRevs.splice(0, revsToSync.length);
-      await Promise.all([
-        handleDisallowed(response),
-        handleAllowed(response),
-        handleReturnedChanges(response),
-        handleErrors(response),
-        handleSuccesses(response),
-        handleMaxRevs(response, user.id),
-        handleTasks(response),
-      ]);
+      await handleResponse(response, user.id);
+      // The server limits how many changes it returns at once, so keep pulling
+      // changes from the updated revisions until we are caught up.
+      while (get(response, ['data', 'next_rev'])) {
+        const revsPayload = await getRevsPayload(await Session.getSession());
+        response = await client.post(urls['sync'](), { changes: [], ...revsPayload });
+        await handleResponse(response, user.id);
+      }
     } catch (err) {
       // There was an error during syncing, log, but carry on
       if (err.message !== noUserError) {
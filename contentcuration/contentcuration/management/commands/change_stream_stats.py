@@ -0,0 +1,27 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from contentcuration.viewsets.sync.stream import get_change_stream_stats
+
+logger = logging.getLogger('command')
+
+
+class Command(BaseCommand):
+    """
+    Reports how many sync requests have been answered from the streams of recent changes,
+    and the revisions covered by the streams of the given channels and users
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--channel-id", action="append", dest="channel_ids", default=[])
+        parser.add_argument("--user-id", action="append", dest="user_ids", type=int, default=[])
+
+    def handle(self, *args, **options):
+        stats = get_change_stream_stats(channel_ids=options["channel_ids"], user_ids=options["user_ids"])
+        hit_rate = "{:.1%}".format(stats["hit_rate"]) if stats["hit_rate"] is not None else "n/a"
+        logger.info("Stream size {}: {} hits, {} misses, hit rate {}".format(stats["size"], stats["hits"], stats["misses"], hit_rate))
+        for key, stream in stats["streams"].items():
+            logger.info("{}: {} changes, revisions {} to {}, floor {}".format(
+                key, stream["length"], stream["min_rev"], stream["max_rev"], stream["floor"]
+            ))
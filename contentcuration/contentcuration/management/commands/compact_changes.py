@@ -0,0 +1,42 @@
+"""
+A management command that keeps the Change table small for the sync queries:
+
+- Folds runs of applied updates to the same object older than `--fold-after-days` into one update.
+- Deletes the changes of channels deleted more than `--deleted-channel-days` ago.
+- Moves changes older than `--archive-after-days` to the ArchivedChange table.
+"""
+import datetime
+import logging as logmodule
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from contentcuration.utils.garbage_collect import archive_changes
+from contentcuration.utils.garbage_collect import CHANGE_BATCH_SIZE
+from contentcuration.utils.garbage_collect import clean_up_deleted_channel_changes
+from contentcuration.utils.garbage_collect import fold_change_updates
+
+
+logging = logmodule.getLogger('command')
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=CHANGE_BATCH_SIZE)
+        parser.add_argument("--fold-after-days", type=int, default=30)
+        parser.add_argument("--deleted-channel-days", type=int, default=30)
+        parser.add_argument("--archive-after-days", type=int, default=90)
+
+    def run_step(self, description, func, days, batch_size):
+        start = time.time()
+        count = func(now() - datetime.timedelta(days=days), batch_size=batch_size)
+        elapsed = time.time() - start
+        logging.info("{} {} change(s) in {:.1f}s ({:.0f} changes/s)".format(description, count, elapsed, count / elapsed if elapsed else 0))
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        self.run_step("Folded", fold_change_updates, options["fold_after_days"], batch_size)
+        self.run_step("Deleted deleted channels'", clean_up_deleted_channel_changes, options["deleted_channel_days"], batch_size)
+        self.run_step("Archived", archive_changes, options["archive_after_days"], batch_size)
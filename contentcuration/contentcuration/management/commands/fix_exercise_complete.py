@@ -1,6 +1,7 @@
 import logging as logmodule
 import time
 
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.db.models import Q
 from le_utils.constants import content_kinds
@@ -104,4 +105,7 @@ class Command(BaseCommand):
             .order_by().update(complete=False)
         logging.info('Marked {} bad mastery model exercises (finished in {})'.format(count, time.time() - exercisestart))
 
+        # The nodes were updated in bulk, so recount the aggregates of their ancestors
+        call_command('rebuild_contentnode_aggregates')
+
         logging.info('Mark incomplete command completed in {}s'.format(time.time() - start))
@@ -0,0 +1,31 @@
+"""
+A management command that recounts the aggregates of the descendants of the nodes of each tree,
+for trees created before the aggregates were maintained, or changed without maintaining them.
+"""
+import logging as logmodule
+import time
+
+from django.core.management.base import BaseCommand
+
+from contentcuration.models import ContentNode
+
+
+logging = logmodule.getLogger('command')
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tree-id", type=int, action="append", dest="tree_ids", help="Only rebuild the aggregates of these trees")
+
+    def handle(self, *args, **options):
+        start = time.time()
+        tree_ids = options["tree_ids"] or ContentNode.objects.filter(parent__isnull=True).order_by("tree_id").values_list("tree_id", flat=True)
+        count = 0
+        for tree_id in tree_ids:
+            with ContentNode.objects.lock_mptt(tree_id):
+                ContentNode.objects.rebuild_aggregates(tree_id)
+            count += 1
+            if count % 1000 == 0:
+                logging.info("Rebuilt the aggregates of {} trees".format(count))
+        logging.info("Rebuilt the aggregates of {} trees in {:.1f}s".format(count, time.time() - start))
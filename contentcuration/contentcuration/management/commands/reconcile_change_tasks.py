@@ -5,6 +5,10 @@ from django.core.management.base import BaseCommand
 from contentcuration.celery import app
 from contentcuration.models import Change
 from contentcuration.models import User
+from contentcuration.viewsets.sync.scheduler import get_channel_lease_key
+from contentcuration.viewsets.sync.scheduler import get_user_lease_key
+from contentcuration.viewsets.sync.scheduler import release_stale_lease
+from contentcuration.viewsets.sync.scheduler import schedule_changes
 
 logger = logging.getLogger('command')
 
@@ -26,8 +30,12 @@ class Command(BaseCommand):
             .distinct()
         for channel_change in channel_changes:
             apply_channel_changes_task.revoke(exclude_task_ids=active_task_ids, channel_id=channel_change['channel_id'])
-            apply_channel_changes_task.fetch_or_enqueue(
+            lease_key = get_channel_lease_key(channel_change['channel_id'])
+            release_stale_lease(lease_key, active_task_ids)
+            schedule_changes(
+                apply_channel_changes_task,
                 User.objects.get(pk=channel_change['created_by_id']),
+                lease_key,
                 channel_id=channel_change['channel_id']
             )
 
@@ -37,7 +45,11 @@ class Command(BaseCommand):
             .distinct()
         for user_change in user_changes:
             apply_user_changes_task.revoke(exclude_task_ids=active_task_ids, user_id=user_change['user_id'])
-            apply_user_changes_task.fetch_or_enqueue(
+            lease_key = get_user_lease_key(user_change['user_id'])
+            release_stale_lease(lease_key, active_task_ids)
+            schedule_changes(
+                apply_user_changes_task,
                 User.objects.get(pk=user_change['created_by_id']),
+                lease_key,
                 user_id=user_change['user_id']
             )
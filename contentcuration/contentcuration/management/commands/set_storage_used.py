@@ -2,6 +2,8 @@ import logging
 
 from django.core.management.base import BaseCommand
 
+from contentcuration.models import ChecksumReference
+from contentcuration.models import ContentNode
 from contentcuration.models import User
 
 
@@ -11,9 +13,26 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--force", action="store_true", dest="force", default=False)
+        parser.add_argument(
+            "--reconcile",
+            action="store_true",
+            dest="reconcile",
+            default=False,
+            help="Rebuild the ledger of checksum references of every tree before updating the storage used by all users",
+        )
 
     def handle(self, *args, **options):
-        users = User.objects.all() if options["force"] else User.objects.filter(disk_space_used=0)
+        if options["reconcile"]:
+            self.reconcile()
+        users = User.objects.all() if options["force"] or options["reconcile"] else User.objects.filter(disk_space_used=0)
         for index, user in enumerate(users):
             user.set_space_used()
             logger.info("Updated storage used for {} user(s)".format(index + 1))
+
+    def reconcile(self):
+        tree_ids = ContentNode.objects.filter(parent__isnull=True).order_by("tree_id").values_list("tree_id", flat=True)
+        for index, tree_id in enumerate(tree_ids):
+            with ContentNode.objects.lock_mptt(tree_id):
+                ChecksumReference.objects.rebuild(tree_id)
+            if (index + 1) % 1000 == 0:
+                logger.info("Rebuilt checksum references for {} tree(s)".format(index + 1))
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.24 on 2026-10-18 10:54
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentcuration', '0148_flagfeedbackevent_recommendationsevent_recommendationsinteractionevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='archive_hash',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('archive_hash__isnull', False)), fields=['archive_hash'], name='file_archive_hash_idx'),
+        ),
+    ]
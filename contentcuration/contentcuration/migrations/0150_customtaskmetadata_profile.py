@@ -0,0 +1,18 @@
+# Generated by Django 3.2.24 on 2026-10-18 12:00
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentcuration', '0149_file_archive_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customtaskmetadata',
+            name='profile',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
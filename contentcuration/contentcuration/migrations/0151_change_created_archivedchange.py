@@ -0,0 +1,68 @@
+# Generated by Django 3.2.24 on 2026-10-18 05:21
+import django.db.models.deletion
+import django.utils.timezone
+import rest_framework.utils.encoders
+from django.conf import settings
+from django.db import migrations
+from django.db import models
+
+import contentcuration.models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('contentcuration', '0150_customtaskmetadata_profile'),
+    ]
+
+    operations = [
+        # Added without a default, so that existing changes are left without a creation time
+        # rather than stamped with the time of the migration
+        migrations.AddField(
+            model_name='change',
+            name='created',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='change',
+            name='created',
+            field=models.DateTimeField(blank=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='change',
+                    index=models.Index(fields=['created'], name='change_created_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    sql='CREATE INDEX CONCURRENTLY "{index_name}" ON "contentcuration_change" ("created");'.format(
+                        index_name=contentcuration.models.CHANGE_CREATED_INDEX_NAME
+                    ),
+                    reverse_sql='DROP INDEX "{index_name}"'.format(
+                        index_name=contentcuration.models.CHANGE_CREATED_INDEX_NAME
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedChange',
+            fields=[
+                ('server_rev', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('client_rev', models.IntegerField(blank=True, null=True)),
+                ('session_id', models.CharField(blank=True, max_length=40, null=True)),
+                ('table', models.CharField(max_length=32)),
+                ('change_type', models.IntegerField()),
+                ('kwargs', models.JSONField(encoder=rest_framework.utils.encoders.JSONEncoder)),
+                ('applied', models.BooleanField(default=False)),
+                ('errored', models.BooleanField(default=False)),
+                ('created', models.DateTimeField(blank=True, null=True)),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('channel', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contentcuration.channel')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.24 on 2026-10-18 06:50
+import django.db.models.deletion
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentcuration', '0151_change_created_archivedchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentNodeAggregate',
+            fields=[
+                ('contentnode', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='aggregate', serialize=False, to='contentcuration.contentnode')),
+                ('resource_count', models.IntegerField(default=0)),
+                ('coach_count', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('updated_count', models.IntegerField(default=0)),
+                ('new_count', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
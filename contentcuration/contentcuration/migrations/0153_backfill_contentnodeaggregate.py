@@ -0,0 +1,51 @@
+# Generated by Django 3.2.24 on 2026-10-18 12:10
+from django.db import migrations
+from django.db import transaction
+from le_utils.constants import content_kinds
+from le_utils.constants import roles
+
+
+# Counts the descendants of each node of a tree that has descendants, as the tree manager's rebuild_aggregates does
+BACKFILL_AGGREGATES_SQL = """
+DELETE FROM {aggregate_table} a
+USING {table} p
+WHERE a.contentnode_id = p.id AND p.tree_id = %(tree_id)s;
+INSERT INTO {aggregate_table} (contentnode_id, resource_count, coach_count, error_count, updated_count, new_count)
+SELECT
+    p.id,
+    COUNT(*) FILTER (WHERE n.kind_id IS DISTINCT FROM %(topic)s),
+    COUNT(*) FILTER (WHERE n.kind_id IS DISTINCT FROM %(topic)s AND n.role_visibility = %(coach)s),
+    COUNT(*) FILTER (WHERE n.complete = FALSE),
+    COUNT(*) FILTER (WHERE n.kind_id IS DISTINCT FROM %(topic)s AND n.changed AND n.published),
+    COUNT(*) FILTER (WHERE n.kind_id IS DISTINCT FROM %(topic)s AND n.changed AND NOT n.published)
+FROM {table} p
+JOIN {table} n ON n.tree_id = p.tree_id AND n.lft > p.lft AND n.rght < p.rght
+WHERE p.tree_id = %(tree_id)s AND p.rght - p.lft > 1
+GROUP BY p.id;
+"""
+
+
+def backfill_aggregates(apps, schema_editor):
+    ContentNode = apps.get_model('contentcuration', 'ContentNode')
+    ContentNodeAggregate = apps.get_model('contentcuration', 'ContentNodeAggregate')
+    sql = BACKFILL_AGGREGATES_SQL.format(
+        table=ContentNode._meta.db_table,
+        aggregate_table=ContentNodeAggregate._meta.db_table,
+    )
+    tree_ids = ContentNode.objects.filter(parent__isnull=True).order_by('tree_id').values_list('tree_id', flat=True)
+    # Each tree is counted in its own transaction, so that the migration doesn't hold locks on every tree at once
+    for tree_id in list(tree_ids):
+        with transaction.atomic(using=schema_editor.connection.alias), schema_editor.connection.cursor() as cursor:
+            cursor.execute(sql, {'tree_id': tree_id, 'topic': content_kinds.TOPIC, 'coach': roles.COACH})
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('contentcuration', '0152_contentnodeaggregate'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_aggregates, migrations.RunPython.noop),
+    ]
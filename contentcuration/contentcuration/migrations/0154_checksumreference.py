@@ -0,0 +1,35 @@
+# Generated by Django 3.2.24 on 2026-10-18 08:36
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations
+from django.db import models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentcuration', '0153_backfill_contentnodeaggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChecksumReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tree_id', models.IntegerField()),
+                ('checksum', models.CharField(max_length=400)),
+                ('file_size', models.IntegerField(default=0)),
+                ('kind', models.CharField(blank=True, max_length=200)),
+                ('count', models.IntegerField(default=0)),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checksum_references', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='checksumreference',
+            index=models.Index(fields=['uploaded_by', 'tree_id'], name='checksum_ref_uploaded_by_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='checksumreference',
+            constraint=models.UniqueConstraint(fields=('tree_id', 'uploaded_by', 'checksum', 'file_size', 'kind'), name='checksum_ref_unique'),
+        ),
+    ]
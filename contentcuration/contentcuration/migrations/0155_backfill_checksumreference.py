@@ -0,0 +1,46 @@
+# Generated by Django 3.2.24 on 2026-10-18 12:40
+from django.db import migrations
+from django.db import transaction
+
+
+# Counts the files of the nodes of a tree uploaded by users, as the ledger manager's rebuild does
+BACKFILL_CHECKSUM_REFERENCES_SQL = """
+DELETE FROM {table} WHERE tree_id = %(tree_id)s;
+INSERT INTO {table} (tree_id, uploaded_by_id, checksum, file_size, kind, count)
+SELECT n.tree_id, f.uploaded_by_id, f.checksum, COALESCE(f.file_size, 0), COALESCE(p.kind_id, ''), COUNT(*)
+FROM {file_table} f
+INNER JOIN {node_table} n ON n.id = f.contentnode_id
+LEFT OUTER JOIN {preset_table} p ON p.id = f.preset_id
+WHERE f.uploaded_by_id IS NOT NULL AND n.tree_id = %(tree_id)s
+GROUP BY 1, 2, 3, 4, 5;
+"""
+
+
+def backfill_checksum_references(apps, schema_editor):
+    ChecksumReference = apps.get_model('contentcuration', 'ChecksumReference')
+    ContentNode = apps.get_model('contentcuration', 'ContentNode')
+    File = apps.get_model('contentcuration', 'File')
+    FormatPreset = apps.get_model('contentcuration', 'FormatPreset')
+    sql = BACKFILL_CHECKSUM_REFERENCES_SQL.format(
+        table=ChecksumReference._meta.db_table,
+        file_table=File._meta.db_table,
+        node_table=ContentNode._meta.db_table,
+        preset_table=FormatPreset._meta.db_table,
+    )
+    tree_ids = ContentNode.objects.filter(parent__isnull=True).order_by('tree_id').values_list('tree_id', flat=True)
+    # Each tree is counted in its own transaction, so that the migration doesn't hold locks on every tree at once
+    for tree_id in list(tree_ids):
+        with transaction.atomic(using=schema_editor.connection.alias), schema_editor.connection.cursor() as cursor:
+            cursor.execute(sql, {'tree_id': tree_id})
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('contentcuration', '0154_checksumreference'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_checksum_references, migrations.RunPython.noop),
+    ]
@@ -31,6 +31,7 @@ from django.db.models import Index
 from django.db.models import JSONField
 from django.db.models import Max
 from django.db.models import OuterRef
+from django.db.models import prefetch_related_objects
 from django.db.models import Q
 from django.db.models import Subquery
 from django.db.models import Sum
@@ -71,12 +72,18 @@ from contentcuration.constants.contentnode import kind_activity_map
 from contentcuration.db.models.expressions import Array
 from contentcuration.db.models.functions import ArrayRemove
 from contentcuration.db.models.functions import Unnest
+from contentcuration.db.models.manager import AGGREGATED_NODE_FIELDS
+from contentcuration.db.models.manager import ChecksumReferenceManager
 from contentcuration.db.models.manager import CustomContentNodeTreeManager
 from contentcuration.db.models.manager import CustomManager
+from contentcuration.utils.cache import bump_tree_revisions
 from contentcuration.utils.cache import delete_public_channel_cache_keys
+from contentcuration.utils.cache import mark_files_modified
+from contentcuration.utils.cache import TreeRevisionCache
 from contentcuration.utils.parser import load_json_string
 from contentcuration.viewsets.sync.constants import ALL_CHANGES
 from contentcuration.viewsets.sync.constants import ALL_TABLES
+from contentcuration.viewsets.sync.stream import publish_changes
 
 
 EDIT_ACCESS = "edit"
@@ -295,8 +302,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     def check_channel_space(self, channel):
         active_files = self.get_user_active_files()
         staging_tree_id = channel.staging_tree.tree_id
-        channel_files = self.files\
-                            .filter(contentnode__tree_id=staging_tree_id)\
+        channel_files = self.checksum_references\
+                            .filter(tree_id=staging_tree_id)\
                             .values('checksum')\
                             .distinct()\
                             .exclude(checksum__in=active_files.values_list('checksum', flat=True))
@@ -324,10 +331,8 @@ class User(AbstractBaseUser, PermissionsMixin):
             .values(tree_id=F("main_tree__tree_id"))
 
     def get_user_active_files(self):
-        cte = With(self.get_user_active_trees().distinct())
-
-        return cte.join(self.files.get_queryset(), contentnode__tree_id=cte.col.tree_id)\
-            .with_cte(cte)\
+        return self.checksum_references\
+            .filter(tree_id__in=self.get_user_active_trees())\
             .values('checksum')\
             .distinct()
 
@@ -343,13 +348,12 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     def get_space_used_by_kind(self):
         active_files = self.get_user_active_files()
-        files = active_files.values('preset__kind_id')\
-                            .annotate(space=Sum('file_size'))\
-                            .order_by()
+        files = active_files.values('checksum', 'file_size', 'kind').order_by()
 
         kind_dict = {}
         for item in files:
-            kind_dict[item['preset__kind_id']] = item['space']
+            kind = item['kind'] or None
+            kind_dict[kind] = kind_dict.get(kind, 0) + item['file_size']
         return kind_dict
 
     def email_user(self, subject, message, from_email=None, **kwargs):
@@ -1188,6 +1192,19 @@ NODE_MODIFIED_INDEX_NAME = "node_modified_idx"
 NODE_MODIFIED_DESC_INDEX_NAME = "node_modified_desc_idx"
 CONTENTNODE_TREE_ID_CACHE_KEY = "contentnode_{pk}__tree_id"
 
+# Assessment items that make an exercise complete
+COMPLETE_ASSESSMENT_ITEM_FILTER = (
+    # Item with non-blank raw data
+    ~Q(raw_data="") | (
+        # A non-blank question
+        ~Q(question='')
+        # Non-blank answers
+        & ~Q(answers='[]')
+        # With either an input question or one answer marked as correct
+        & (Q(type=exercises.INPUT_QUESTION) | Q(answers__iregex=r'"correct":\s*true'))
+    )
+)
+
 
 class ContentNode(MPTTModel, models.Model):
     """
@@ -1522,6 +1539,10 @@ class ContentNode(MPTTModel, models.Model):
         from contentcuration.viewsets.common import SQSum
         from contentcuration.viewsets.common import SQJSONBKeyArrayAgg
 
+        # Read the revision of the tree before reading the nodes, so that changes made meanwhile invalidate the details
+        details_cache = TreeRevisionCache(self.tree_id)
+        details_cache.revision
+
         node = ContentNode.objects.filter(pk=self.id, tree_id=self.tree_id).order_by()
 
         descendants = (
@@ -1560,7 +1581,7 @@ class ContentNode(MPTTModel, models.Model):
             }
 
             # Set cache with latest data
-            cache.set("details_{}".format(self.node_id), json.dumps(data), None)
+            details_cache.set("details_{}".format(self.node_id), json.dumps(data))
             return data
 
         # Get resources
@@ -1784,7 +1805,7 @@ class ContentNode(MPTTModel, models.Model):
         }
 
         # Set cache with latest data
-        cache.set("details_{}".format(self.node_id), json.dumps(data), None)
+        details_cache.set("details_{}".format(self.node_id), json.dumps(data))
         return data
 
     def has_changes(self):
@@ -1807,7 +1828,29 @@ class ContentNode(MPTTModel, models.Model):
         for editor in self.files.values_list('uploaded_by_id', flat=True).distinct():
             calculate_user_storage(editor)
 
-    def mark_complete(self):  # noqa C901
+    @classmethod
+    def mark_nodes_complete(cls, nodes):
+        """
+        Marks each of the nodes complete or not as `mark_complete` does, looking up the licenses, default
+        files and complete assessment items of all the nodes with one query each. Returns the errors of each node.
+        """
+        prefetch_related_objects(nodes, "license")
+        node_ids = [node.id for node in nodes]
+        default_file_node_ids = set(
+            File.objects.filter(contentnode_id__in=node_ids, preset__supplementary=False).values_list("contentnode_id", flat=True)
+        )
+        complete_question_node_ids = set(
+            AssessmentItem.objects.filter(COMPLETE_ASSESSMENT_ITEM_FILTER, contentnode_id__in=node_ids).values_list("contentnode_id", flat=True)
+        )
+        return [
+            node.mark_complete(
+                has_default_file=node.id in default_file_node_ids,
+                has_complete_question=node.id in complete_question_node_ids,
+            )
+            for node in nodes
+        ]
+
+    def mark_complete(self, has_default_file=None, has_complete_question=None):  # noqa C901
         errors = []
         # Is complete if title is falsy but only if not a root node.
         if not (bool(self.title) or self.parent_id is None):
@@ -1819,21 +1862,16 @@ class ContentNode(MPTTModel, models.Model):
                 errors.append("Missing license description for custom license")
             if self.license and self.license.copyright_holder_required and not self.copyright_holder:
                 errors.append("Missing required copyright holder")
-            if self.kind_id != content_kinds.EXERCISE and not self.files.filter(preset__supplementary=False).exists():
-                errors.append("Missing default file")
+            if self.kind_id != content_kinds.EXERCISE:
+                if has_default_file is None:
+                    has_default_file = self.files.filter(preset__supplementary=False).exists()
+                if not has_default_file:
+                    errors.append("Missing default file")
             if self.kind_id == content_kinds.EXERCISE:
-                # Check to see if the exercise has at least one assessment item that has:
-                if not self.assessment_items.filter(
-                    # Item with non-blank raw data
-                    ~Q(raw_data="") | (
-                        # A non-blank question
-                        ~Q(question='')
-                        # Non-blank answers
-                        & ~Q(answers='[]')
-                        # With either an input question or one answer marked as correct
-                        & (Q(type=exercises.INPUT_QUESTION) | Q(answers__iregex=r'"correct":\s*true'))
-                    )
-                ).exists():
+                # Check to see if the exercise has at least one complete assessment item
+                if has_complete_question is None:
+                    has_complete_question = self.assessment_items.filter(COMPLETE_ASSESSMENT_ITEM_FILTER).exists()
+                if not has_complete_question:
                     errors.append("No questions with question text and complete answers")
                 # Check that it has a mastery model set
                 # Either check for the previous location for the mastery model, or rely on our completion criteria validation
@@ -1886,12 +1924,35 @@ class ContentNode(MPTTModel, models.Model):
                     kind_activity_map[self.kind]: True
                 }
 
+    def get_aggregate_counts_change(self):
+        """
+        Returns how the counts this node adds to the aggregates of its ancestors change when it is saved
+        """
+        if not ContentNode.objects.maintains_aggregates():
+            return None
+        values = {field: getattr(self, field) for field in AGGREGATED_NODE_FIELDS}
+        if self._state.adding:
+            return ContentNode.objects.get_aggregate_counts(values) if self.parent_id else None
+        old_values = {
+            field: value for field, value in self._field_updates.changed().items()
+            if field in AGGREGATED_NODE_FIELDS and value is not DeferredAttribute
+        }
+        if not old_values:
+            return None
+        counts = ContentNode.objects.get_aggregate_counts(values)
+        old_counts = ContentNode.objects.get_aggregate_counts(dict(values, **old_values))
+        return {field: counts[field] - old_counts[field] for field in counts}
+
     def save(self, skip_lock=False, *args, **kwargs):
         if self._state.adding:
             self.on_create()
         else:
             self.on_update()
 
+        aggregate_counts = self.get_aggregate_counts_change()
+        # Only the files of complete nodes count towards resource sizes
+        completed = not self._state.adding and "complete" in self._field_updates.changed()
+
         # Logic borrowed from mptt - do a simple check to see if we have changed
         # the parent of the node. We use the mptt specific cached fields here
         # because these get updated by the mptt move methods, and so will be up to
@@ -1921,21 +1982,25 @@ class ContentNode(MPTTModel, models.Model):
             with ContentNode.objects.lock_mptt(*ContentNode.objects
                                                .filter(id__in=[pid for pid in [old_parent_id, self.parent_id] if pid])
                                                .values_list('tree_id', flat=True).distinct()):
-                super(ContentNode, self).save(*args, **kwargs)
-                # Always write to the database for the parent change updates, as we have
-                # no persistent object references for the original and new parent to modify
-                if changed_ids:
-                    ContentNode.objects.filter(id__in=changed_ids).update(changed=True)
+                self._save(aggregate_counts, completed, changed_ids, *args, **kwargs)
         else:
-            super(ContentNode, self).save(*args, **kwargs)
-            # Always write to the database for the parent change updates, as we have
-            # no persistent object references for the original and new parent to modify
-            if changed_ids:
-                ContentNode.objects.filter(id__in=changed_ids).update(changed=True)
+            self._save(aggregate_counts, completed, changed_ids, *args, **kwargs)
 
     # Copied from MPTT
     save.alters_data = True
 
+    def _save(self, aggregate_counts, completed, changed_ids, *args, **kwargs):
+        super(ContentNode, self).save(*args, **kwargs)
+        bump_tree_revisions(self.tree_id)
+        if completed:
+            mark_files_modified(self.tree_id)
+        if aggregate_counts:
+            ContentNode.objects.update_ancestor_aggregates({self.id: aggregate_counts})
+        # Always write to the database for the parent change updates, as we have
+        # no persistent object references for the original and new parent to modify
+        if changed_ids:
+            ContentNode.objects.filter(id__in=changed_ids).update(changed=True)
+
     def delete(self, *args, **kwargs):
         parent = self.parent or self._field_updates.changed().get('parent')
         if parent:
@@ -1946,6 +2011,8 @@ class ContentNode(MPTTModel, models.Model):
 
         # Lock the mptt fields for the tree of this node
         with ContentNode.objects.lock_mptt(self.tree_id):
+            if ContentNode.objects.maintains_aggregates():
+                ContentNode.objects.remove_from_ancestor_aggregates(self.id)
             return super(ContentNode, self).delete(*args, **kwargs)
 
     # Copied from MPTT
@@ -1981,6 +2048,25 @@ class ContentNode(MPTTModel, models.Model):
         ]
 
 
+class ContentNodeAggregate(models.Model):
+    """
+    Counts of the descendants of a node, kept up to date by the tree manager as nodes are created, copied,
+    moved, deleted and updated, so that they don't have to be counted whenever nodes are listed.
+    Nodes without descendants have no row.
+    """
+    contentnode = models.OneToOneField(ContentNode, primary_key=True, on_delete=models.CASCADE, related_name="aggregate")
+    # Descendants that aren't topics
+    resource_count = models.IntegerField(default=0)
+    # Resources only visible to coaches
+    coach_count = models.IntegerField(default=0)
+    # Incomplete descendants
+    error_count = models.IntegerField(default=0)
+    # Changed resources that have been published
+    updated_count = models.IntegerField(default=0)
+    # Changed resources that haven't been published
+    new_count = models.IntegerField(default=0)
+
+
 class ContentKind(models.Model):
     kind = models.CharField(primary_key=True, max_length=200, choices=content_kinds.choices)
 
@@ -2150,12 +2236,27 @@ class AssessmentItem(models.Model):
         """
         self.contentnode.make_content_id_unique()
 
+    def _bump_tree_revision(self):
+        if not self.contentnode_id:
+            return
+        if AssessmentItem.contentnode.is_cached(self):
+            tree_id = self.contentnode.tree_id
+        else:
+            # Rather than loading the whole node for each item saved
+            tree_id = ContentNode.objects.filter(pk=self.contentnode_id).values_list("tree_id", flat=True).first()
+        bump_tree_revisions(tree_id)
+
+    def save(self, *args, **kwargs):
+        super(AssessmentItem, self).save(*args, **kwargs)
+        self._bump_tree_revision()
+
     def delete(self, *args, **kwargs):
         """
         When an exercise is deleted from a contentnode, update its content_id
         if it's a copied contentnode.
         """
         self.contentnode.make_content_id_unique()
+        self._bump_tree_revision()
         return super(AssessmentItem, self).delete(*args, **kwargs)
 
 
@@ -2178,6 +2279,9 @@ class StagedFile(models.Model):
 FILE_DISTINCT_INDEX_NAME = "file_checksum_file_size_idx"
 FILE_MODIFIED_DESC_INDEX_NAME = "file_modified_desc_idx"
 FILE_DURATION_CONSTRAINT = "file_media_duration_int"
+FILE_ARCHIVE_HASH_INDEX_NAME = "file_archive_hash_idx"
+CHECKSUM_REFERENCE_UPLOADED_BY_INDEX_NAME = "checksum_ref_uploaded_by_idx"
+CHECKSUM_REFERENCE_UNIQUE_CONSTRAINT = "checksum_ref_unique"
 MEDIA_PRESETS = [
     format_presets.AUDIO,
     format_presets.AUDIO_DEPENDENCY,
@@ -2209,6 +2313,8 @@ class File(models.Model):
 
     modified = models.DateTimeField(auto_now=True, verbose_name="modified", null=True)
     duration = models.IntegerField(blank=True, null=True)
+    # Hash of the inputs the Perseus archive of an exercise was built from, so publish can reuse the archive
+    archive_hash = models.CharField(max_length=32, blank=True, null=True)
 
     objects = CustomManager()
 
@@ -2295,6 +2401,22 @@ class File(models.Model):
         self.modified = timezone.now()
         self.update_contentnode_content_id()
 
+    def mark_tree_changed(self):
+        """
+        Bumps the revision of the tree of the node the file belongs to, directly or through its assessment item,
+        and for the files of nodes, which count towards resource sizes, its files modified watermark
+        """
+        if self.contentnode_id:
+            nodes = ContentNode.objects.filter(pk=self.contentnode_id)
+        elif self.assessment_item_id:
+            nodes = ContentNode.objects.filter(assessment_items__id=self.assessment_item_id)
+        else:
+            return
+        tree_ids = list(nodes.values_list("tree_id", flat=True))
+        bump_tree_revisions(*tree_ids)
+        if self.contentnode_id:
+            mark_files_modified(*tree_ids)
+
     def save(self, set_by_file_on_disk=True, *args, **kwargs):
         """
         Overrider the default save method.
@@ -2325,15 +2447,28 @@ class File(models.Model):
                 else:
                     raise ValueError("Files of type `{}` are not supported.".format(ext))
 
-        super(File, self).save(*args, **kwargs)
+        self._save(*args, **kwargs)
+        self.mark_tree_changed()
 
         if self.uploaded_by_id:
             calculate_user_storage(self.uploaded_by_id)
 
+    def _save(self, *args, **kwargs):
+        """
+        Saves the file while maintaining the ledger of checksum references
+        """
+        if self._state.adding:
+            super(File, self).save(*args, **kwargs)
+            ChecksumReference.objects.update_files(File.objects.filter(pk=self.pk))
+        else:
+            with ChecksumReference.objects.maintain_files(File.objects.filter(pk=self.pk)):
+                super(File, self).save(*args, **kwargs)
+
     class Meta:
         indexes = [
             models.Index(fields=['checksum', 'file_size'], name=FILE_DISTINCT_INDEX_NAME),
             models.Index(fields=["-modified"], name=FILE_MODIFIED_DESC_INDEX_NAME),
+            models.Index(fields=["archive_hash"], name=FILE_ARCHIVE_HASH_INDEX_NAME, condition=Q(archive_hash__isnull=False)),
         ]
         constraints = [
             # enforces that duration is null when not a media preset, but the duration may be null for media presets
@@ -2345,6 +2480,42 @@ class File(models.Model):
         ]
 
 
+class ChecksumReference(models.Model):
+    """
+    A ledger of the number of files of the nodes of a tree, uploaded by a user, that reference each checksum,
+    maintained as files are created, changed, moved and deleted, so that the storage used by a user
+    can be summed from it rather than from the files of their channels.
+    """
+    tree_id = models.IntegerField()
+    uploaded_by = models.ForeignKey(User, related_name="checksum_references", on_delete=models.CASCADE)
+    checksum = models.CharField(max_length=400)
+    file_size = models.IntegerField(default=0)
+    # The kind of the format preset of the files, or an empty string
+    kind = models.CharField(max_length=200, blank=True)
+    count = models.IntegerField(default=0)
+
+    objects = ChecksumReferenceManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["uploaded_by", "tree_id"], name=CHECKSUM_REFERENCE_UPLOADED_BY_INDEX_NAME),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tree_id", "uploaded_by", "checksum", "file_size", "kind"],
+                name=CHECKSUM_REFERENCE_UNIQUE_CONSTRAINT,
+            ),
+        ]
+
+
+@receiver(models.signals.pre_delete, sender=File)
+def remove_checksum_reference_on_delete(sender, instance, **kwargs):
+    """
+    Subtracts the file from the ledger of checksum references while it can still be counted
+    """
+    ChecksumReference.objects.update_files(File.objects.filter(pk=instance.pk), subtract=True)
+
+
 @receiver(models.signals.post_delete, sender=File)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     """
@@ -2356,6 +2527,7 @@ def auto_delete_file_on_delete(sender, instance, **kwargs):
     from contentcuration.utils.user import calculate_user_storage
     if instance.uploaded_by_id:
         calculate_user_storage(instance.uploaded_by_id)
+    instance.mark_tree_changed()
 
 
 def delete_empty_file_reference(checksum, extension):
@@ -2480,6 +2652,9 @@ class Invitation(models.Model):
         ).distinct()
 
 
+CHANGE_CREATED_INDEX_NAME = "change_created_idx"
+
+
 class Change(models.Model):
     server_rev = models.BigAutoField(primary_key=True)
     # We need to store the user who is applying this change
@@ -2510,6 +2685,9 @@ class Change(models.Model):
     kwargs = JSONField(encoder=JSONEncoder)
     applied = models.BooleanField(default=False)
     errored = models.BooleanField(default=False)
+    # When the change was made, so that old changes can be compacted and archived,
+    # changes made before this was recorded have none and are treated as old
+    created = models.DateTimeField(default=timezone.now, null=True, blank=True)
 
     @classmethod
     def _create_from_change(cls, created_by_id=None, channel_id=None, user_id=None, session_key=None, applied=False, table=None, rev=None, **data):
@@ -2537,12 +2715,16 @@ class Change(models.Model):
             change_models.append(cls._create_from_change(created_by_id=created_by_id, session_key=session_key, applied=applied, **change))
 
         cls.objects.bulk_create(change_models)
+        if applied:
+            publish_changes(change_models)
         return change_models
 
     @classmethod
     def create_change(cls, change, created_by_id=None, session_key=None, applied=False):
         obj = cls._create_from_change(created_by_id=created_by_id, session_key=session_key, applied=applied, **change)
         obj.save()
+        if applied:
+            publish_changes([obj])
         return obj
 
     @classmethod
@@ -2561,6 +2743,32 @@ class Change(models.Model):
     def serialize_to_change_dict(self):
         return self.serialize(self)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created"], name=CHANGE_CREATED_INDEX_NAME),
+        ]
+
+
+class ArchivedChange(models.Model):
+    """
+    Changes that are old enough not to be synced to clients anymore are moved here from the Change table,
+    so that the queries for recent changes only have to deal with a small table
+    """
+    server_rev = models.BigIntegerField(primary_key=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    channel = models.ForeignKey(Channel, null=True, blank=True, on_delete=models.CASCADE, related_name="+")
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name="+")
+    client_rev = models.IntegerField(null=True, blank=True)
+    # Sessions expire, so only the key is kept
+    session_id = models.CharField(max_length=40, null=True, blank=True)
+    table = models.CharField(max_length=32)
+    change_type = models.IntegerField()
+    kwargs = JSONField(encoder=JSONEncoder)
+    applied = models.BooleanField(default=False)
+    errored = models.BooleanField(default=False)
+    created = models.DateTimeField(null=True, blank=True)
+    archived = models.DateTimeField(default=timezone.now)
+
 
 class CustomTaskMetadata(models.Model):
     # Task_id for reference
@@ -2574,6 +2782,8 @@ class CustomTaskMetadata(models.Model):
     progress = models.IntegerField(null=True, blank=True, validators=[MinValueValidator(0), MaxValueValidator(100)])
     # a hash of the task name and kwargs for identifying repeat tasks
     signature = models.CharField(null=True, blank=False, max_length=32)
+    # time spent in each stage of the task, for tasks that profile themselves such as publishing
+    profile = JSONField(null=True, blank=True)
     date_created = models.DateTimeField(
         auto_now_add=True,
         verbose_name=_('Created DateTime'),
@@ -409,6 +409,36 @@ DELETED_CHEFS_ROOT_ID = "11111111111111111111111111111111"
 # How long we should cache any APIs that return public channel list details, which change infrequently
 PUBLIC_CHANNELS_CACHE_DURATION = 300
 
+# Number of threads used to build the Perseus archives of exercises when publishing a channel
+PUBLISH_EXERCISE_WORKERS = int(os.getenv("PUBLISH_EXERCISE_WORKERS") or 4)
+
+# Maximum number of exercise images downloaded from storage at once when building Perseus archives
+PUBLISH_EXERCISE_IMAGE_WORKERS = int(os.getenv("PUBLISH_EXERCISE_IMAGE_WORKERS") or 8)
+
+# The number of recent changes kept in Redis for each channel and user to answer sync requests from, 0 disables it
+SYNC_CHANGE_STREAM_SIZE = int(os.getenv("SYNC_CHANGE_STREAM_SIZE") or 200)
+
+# The most changes, and roughly the most bytes of changes, returned by a sync request, clients that are
+# further behind are given a next_rev to continue from
+SYNC_MAX_CHANGES_PER_RESPONSE = int(os.getenv("SYNC_MAX_CHANGES_PER_RESPONSE") or 1000)
+SYNC_MAX_RESPONSE_BYTES = int(os.getenv("SYNC_MAX_RESPONSE_BYTES") or 1024 * 1024)
+
+# Changes are applied in batches of this many changes, each in one transaction where possible
+SYNC_APPLY_BATCH_SIZE = int(os.getenv("SYNC_APPLY_BATCH_SIZE") or 500)
+# How long in seconds a task applies the changes of a channel before handing over to a new task
+SYNC_APPLY_TIME_SLICE = int(os.getenv("SYNC_APPLY_TIME_SLICE") or 30)
+# How long in seconds the lease of a task on applying changes lasts without being extended,
+# it is extended before each run of changes, so it has to outlast the longest run of changes
+SYNC_APPLY_LEASE_TIMEOUT = int(os.getenv("SYNC_APPLY_LEASE_TIMEOUT") or 5 * 60)
+# How long in seconds the lease is extended by before applying a change that can take long, such as publishing
+SYNC_APPLY_LONG_LEASE_TIMEOUT = int(os.getenv("SYNC_APPLY_LONG_LEASE_TIMEOUT") or 60 * 60)
+# How long in seconds the cached task statuses of a channel are kept after they were last updated,
+# before they are read from the database again, 0 to always read them from the database
+SYNC_TASK_STATUS_TIMEOUT = int(os.getenv("SYNC_TASK_STATUS_TIMEOUT") or 5 * 60)
+
+# Build the export database of a channel in memory when publishing, and write it to disk once it is complete
+PUBLISH_EXPORT_DATABASE_IN_MEMORY = not os.getenv("PUBLISH_EXPORT_DATABASE_ON_DISK")
+
 # Override in catalog_settings to limit Studio to public catalog page
 LIBRARY_MODE = False
 
@@ -28,30 +28,28 @@ from contentcuration.viewsets.user import AdminUserFilter
 logger = get_task_logger(__name__)
 
 
-@app.task(bind=True, name="apply_user_changes")
+@app.task(bind=True, name="apply_user_changes", cache_status=False)
 def apply_user_changes_task(self, user_id):
     """
     :type self: contentcuration.utils.celery.tasks.CeleryTask
     :param user_id: The user ID for which to process changes
     """
-    from contentcuration.viewsets.sync.base import apply_changes
+    from contentcuration.viewsets.sync.scheduler import drain_changes
+    from contentcuration.viewsets.sync.scheduler import get_user_lease_key
     changes_qs = Change.objects.filter(applied=False, errored=False, user_id=user_id, channel__isnull=True)
-    apply_changes(changes_qs)
-    if changes_qs.exists():
-        self.requeue()
+    drain_changes(self, changes_qs, get_user_lease_key(user_id))
 
 
-@app.task(bind=True, name="apply_channel_changes")
+@app.task(bind=True, name="apply_channel_changes", cache_status=False)
 def apply_channel_changes_task(self, channel_id):
     """
     :type self: contentcuration.utils.celery.tasks.CeleryTask
     :param channel_id: The channel ID for which to process changes
     """
-    from contentcuration.viewsets.sync.base import apply_changes
+    from contentcuration.viewsets.sync.scheduler import drain_changes
+    from contentcuration.viewsets.sync.scheduler import get_channel_lease_key
     changes_qs = Change.objects.filter(applied=False, errored=False, channel_id=channel_id)
-    apply_changes(changes_qs)
-    if changes_qs.exists():
-        self.requeue()
+    drain_changes(self, changes_qs, get_channel_lease_key(channel_id))
 
 
 class CustomEmailMessage(EmailMessage):
@@ -101,12 +99,6 @@ def deletetree_task(tree_id):
     ContentNode.objects.filter(tree_id=tree_id).delete()
 
 
-@app.task(name="getnodedetails_task")
-def getnodedetails_task(node_id):
-    node = ContentNode.objects.get(pk=node_id)
-    return node.get_details()
-
-
 @app.task(name="generatenodediff_task")
 def generatenodediff_task(updated_id, original_id):
     return generate_diff(updated_id, original_id)
@@ -6,6 +6,8 @@ from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
 from django.db import connection
+from django.db import connections
+from django.db import DEFAULT_DB_ALIAS
 from django.db.migrations.executor import MigrationExecutor
 from django.test import TestCase
 from django.test import TransactionTestCase
@@ -58,7 +60,19 @@ class BucketTestMixin:
             self.delete_bucket()
 
 
-class StudioTestCase(TestCase, BucketTestMixin):
+class RevisionsTestMixin(object):
+    """
+    Revision bumps are collected for each transaction and the transaction of a test case never commits, so
+    those collected before capturing the commit callbacks in a test are forgotten to be captured again
+    """
+
+    @classmethod
+    def captureOnCommitCallbacks(cls, using=DEFAULT_DB_ALIAS, execute=False):
+        connections[using].pending_revisions = None
+        return super(RevisionsTestMixin, cls).captureOnCommitCallbacks(using=using, execute=execute)
+
+
+class StudioTestCase(RevisionsTestMixin, TestCase, BucketTestMixin):
     @classmethod
     def setUpClass(cls):
         super(StudioTestCase, cls).setUpClass()
@@ -115,7 +129,7 @@ class StudioTestCase(TestCase, BucketTestMixin):
         )
 
 
-class StudioAPITestCase(APITestCase, BucketTestMixin):
+class StudioAPITestCase(RevisionsTestMixin, APITestCase, BucketTestMixin):
     @classmethod
     def setUpClass(cls):
         super(StudioAPITestCase, cls).setUpClass()
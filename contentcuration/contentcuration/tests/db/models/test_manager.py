@@ -1,3 +1,11 @@
+import random
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from mptt.exceptions import InvalidMove
+
 from contentcuration.db.models.manager import CustomContentNodeTreeManager
 from contentcuration.models import ContentNode
 from contentcuration.tests import testdata
@@ -14,3 +22,97 @@ class CustomContentNodeTreeManagerTest(StudioTestCase):
         node_a = testdata.node({"kind_id": "topic", "title": "Node A"})
         node_b = ContentNode(id="abc123", title="Node B")
         self.manager._mptt_refresh(node_a, node_b)
+
+
+POSITIONS = ("first-child", "last-child", "left", "right")
+
+
+class MoveNodesTest(StudioTestCase):
+    def setUp(self):
+        super(MoveNodesTest, self).setUp()
+        self.channel = testdata.channel()
+        self.other_channel = testdata.channel()
+
+    def get_nodes(self, channel):
+        return list(channel.main_tree.get_descendants(include_self=True).order_by("lft"))
+
+    def get_structure(self, channel):
+        return [(node.title, node.lft, node.rght, node.level) for node in self.get_nodes(channel)]
+
+    def get_moves(self, count):
+        # Moves by index of nodes in the tree ordered by lft, which match in both channels
+        rng = random.Random(count)
+        size = len(self.get_nodes(self.channel))
+        moves = []
+        for _i in range(count):
+            position = rng.choice(POSITIONS)
+            # Nodes made siblings of the root would become the roots of new trees
+            target_index = rng.randrange(size) if position.endswith("-child") else rng.randrange(1, size)
+            moves.append((rng.randrange(1, size), target_index, position))
+        return moves
+
+    def test_move_nodes_matches_move_to(self):
+        moves = self.get_moves(40)
+        expected_errors = []
+        ids = [node.id for node in self.get_nodes(self.other_channel)]
+        for node_index, target_index, position in moves:
+            node = ContentNode.objects.get(id=ids[node_index])
+            try:
+                node.move_to(ContentNode.objects.get(id=ids[target_index]), position)
+                expected_errors.append(False)
+            except InvalidMove:
+                expected_errors.append(True)
+
+        nodes = self.get_nodes(self.channel)
+        errors = ContentNode.objects.move_nodes([
+            (nodes[node_index], nodes[target_index], position)
+            for node_index, target_index, position in moves
+        ])
+
+        self.assertEqual(expected_errors, [isinstance(error, InvalidMove) for error in errors])
+        self.assertEqual(self.get_structure(self.other_channel), self.get_structure(self.channel))
+        self.assertEqual(nodes[moves[-1][0]].lft, ContentNode.objects.get(id=nodes[moves[-1][0]].id).lft)
+
+    def test_move_nodes_marks_changed(self):
+        nodes = self.get_nodes(self.channel)
+        node = nodes[-1]
+        old_parent_id = node.parent_id
+        modified = timezone.now() - timedelta(days=1)
+        ContentNode.objects.filter(tree_id=self.channel.main_tree.tree_id).update(changed=False, modified=modified)
+
+        ContentNode.objects.move_nodes([(node, nodes[0], "first-child")])
+
+        changed = ContentNode.objects.filter(tree_id=self.channel.main_tree.tree_id, changed=True)
+        self.assertEqual({node.id, old_parent_id, nodes[0].id}, set(changed.values_list("id", flat=True)))
+        moved = ContentNode.objects.get(id=node.id)
+        self.assertEqual(nodes[0].id, moved.parent_id)
+        # As when the node is saved by move_to
+        self.assertGreater(moved.modified, modified)
+
+    def test_move_nodes_across_trees(self):
+        nodes = self.get_nodes(self.channel)
+        other_root = self.other_channel.main_tree
+        child = nodes[0].get_children().first()
+
+        errors = ContentNode.objects.move_nodes([
+            (child, nodes[0], "last-child"),
+            (child, other_root, "first-child"),
+            (nodes[-1], nodes[0], "first-child"),
+        ])
+
+        self.assertEqual([None, None, None], errors)
+        self.assertEqual(other_root.tree_id, ContentNode.objects.get(id=child.id).tree_id)
+        self.assertEqual(other_root.get_children().first().id, child.id)
+        self.assertEqual(nodes[0].get_children().first().id, nodes[-1].id)
+        tree = self.get_nodes(self.channel)
+        self.assertEqual(len(tree) * 2, tree[0].rght)
+
+    def test_move_nodes_queries(self):
+        def count_queries(count):
+            nodes = self.get_nodes(self.channel)
+            children = [node for node in nodes if node.parent_id == nodes[0].id]
+            with CaptureQueriesContext(connection) as queries:
+                ContentNode.objects.move_nodes([(children[-1], children[0], "left") for _i in range(count)])
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(8))
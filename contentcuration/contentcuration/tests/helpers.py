@@ -26,6 +26,19 @@ def clear_tasks(except_task_id=None):
     qs.update(status=states.REVOKED)
 
 
+def clear_change_streams():
+    """
+    Removes the streams of changes of the sync endpoint, as Redis outlives the test database,
+    so that changes from earlier tests and runs aren't served for the revisions of later ones
+    """
+    from django_redis import get_redis_connection
+
+    redis = get_redis_connection("default")
+    keys = list(redis.scan_iter("sync:stream:*"))
+    if keys:
+        redis.delete(*keys)
+
+
 def mock_class_instance(target):
     """
     Helper that returns a Mocked instance of the `target` class
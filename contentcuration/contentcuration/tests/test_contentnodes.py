@@ -8,14 +8,18 @@ import uuid
 from builtins import range
 from builtins import str
 from builtins import zip
+from importlib import import_module
 
 import pytest
+from django.apps import apps
+from django.db import connection
 from django.db import IntegrityError
 from django.db.utils import DataError
 from le_utils.constants import completion_criteria
 from le_utils.constants import content_kinds
 from le_utils.constants import exercises
 from le_utils.constants import format_presets
+from le_utils.constants import roles
 from mixer.backend.django import mixer
 from mock import patch
 from past.utils import old_div
@@ -27,6 +31,7 @@ from contentcuration.models import AssessmentItem
 from contentcuration.models import Channel
 from contentcuration.models import ContentKind
 from contentcuration.models import ContentNode
+from contentcuration.models import ContentNodeAggregate
 from contentcuration.models import ContentTag
 from contentcuration.models import File
 from contentcuration.models import FormatPreset
@@ -635,6 +640,94 @@ class NodeOperationsTestCase(StudioTestCase):
             channel=new_channel,
         )
 
+    def _get_copied_values(self, root):
+        nodes = list(root.get_descendants(include_self=True).order_by("lft"))
+        index_by_id = {node.id: i for i, node in enumerate(nodes)}
+        return [
+            (
+                index_by_id.get(node.parent_id),
+                node.level - root.level,
+                node.title,
+                node.kind_id,
+                node.content_id,
+                node.license_id,
+                node.freeze_authoring_data,
+                node.source_node_id,
+                node.original_channel_id,
+                node.original_source_node_id,
+                sorted(node.tags.values_list("tag_name", "channel_id")),
+                sorted(node.files.values_list("checksum", "preset_id")),
+                sorted(
+                    (ai.assessment_id, ai.question, sorted(ai.files.values_list("checksum", flat=True)))
+                    for ai in node.assessment_items.all()
+                ),
+            )
+            for node in nodes
+        ]
+
+    def _assert_valid_tree(self, tree_id):
+        nodes = {node.id: node for node in ContentNode.objects.filter(tree_id=tree_id)}
+        self.assertEqual(
+            list(range(1, 2 * len(nodes) + 1)),
+            sorted([node.lft for node in nodes.values()] + [node.rght for node in nodes.values()]),
+        )
+        for node in nodes.values():
+            if node.parent_id:
+                parent = nodes[node.parent_id]
+                self.assertTrue(parent.lft < node.lft < node.rght < parent.rght)
+                self.assertEqual(parent.level + 1, node.level)
+
+    def test_duplicate_nodes_in_database_matches_model_copy(self):
+        """
+        Ensures that the copy made in the database is the same as the copy made from model instances
+        """
+        tree = TreeBuilder(tags=True)
+        self.channel.main_tree = tree.root
+        self.channel.save()
+
+        exercise = self.channel.main_tree.get_descendants().filter(kind_id=content_kinds.EXERCISE).first()
+        file = testdata.fileobj_exercise_image()
+        file.assessment_item = exercise.assessment_items.first()
+        file.save()
+        exercise.tags.add(ContentTag.objects.create(tag_name="channel tag", channel=self.channel))
+        excluded_descendants = {
+            self.channel.main_tree.get_children().first().get_children().last().node_id: True
+        }
+
+        database_channel = testdata.channel()
+        database_copy = self.channel.main_tree.copy_to(
+            database_channel.main_tree, excluded_descendants=excluded_descendants
+        )
+        model_channel = testdata.channel()
+        model_copy = ContentNode.objects._copy(
+            self.channel.main_tree,
+            model_channel.main_tree,
+            "last-child",
+            self.channel.id,
+            None,
+            None,
+            excluded_descendants,
+            None,
+            1000,
+        )[0]
+
+        model_copy.refresh_from_db()
+        self.assertEqual(self._get_copied_values(model_copy), self._get_copied_values(database_copy))
+        self._assert_valid_tree(database_channel.main_tree.tree_id)
+
+    def test_duplicate_nodes_in_same_tree(self):
+        """
+        Ensures that copying nodes next to themselves keeps the tree valid
+        """
+        source = self.channel.main_tree.get_children().first()
+
+        copy = source.copy_to(source, position="right")
+
+        source.refresh_from_db()
+        self.assertEqual(source.rght + 1, copy.lft)
+        self.assertEqual(source.get_descendant_count(), copy.get_descendant_count())
+        self._assert_valid_tree(self.channel.main_tree.tree_id)
+
     def test_multiple_copy_channel_ids(self):
         """
         This test ensures that as we copy nodes across various channels, that their original_channel_id and
@@ -1144,3 +1237,114 @@ class NodeCompletionTestCase(StudioTestCase):
         AssessmentItem.objects.create(contentnode=new_obj, question="This is a question", answers="[{\"correct\": true, \"text\": \"answer\"}]")
         new_obj.mark_complete()
         self.assertFalse(new_obj.complete)
+
+    def test_mark_nodes_complete(self):
+        licenses = list(License.objects.filter(copyright_holder_required=False, is_custom=False).values_list("pk", flat=True))
+        channel = testdata.channel()
+        video = ContentNode.objects.create(title="yes", kind_id=content_kinds.VIDEO, parent=channel.main_tree, license_id=licenses[0])
+        File.objects.create(contentnode=video, preset_id=format_presets.VIDEO_HIGH_RES, checksum=uuid.uuid4().hex)
+        video_no_file = ContentNode.objects.create(title="yes", kind_id=content_kinds.VIDEO, parent=channel.main_tree, license_id=licenses[0])
+        exercise = ContentNode.objects.create(
+            title="yes", kind_id=content_kinds.EXERCISE, parent=channel.main_tree, license_id=licenses[0], extra_fields=self.new_extra_fields
+        )
+        AssessmentItem.objects.create(contentnode=exercise, question="This is a question", answers="[{\"correct\": true, \"text\": \"answer\"}]")
+        exercise_no_question = ContentNode.objects.create(
+            title="yes", kind_id=content_kinds.EXERCISE, parent=channel.main_tree, license_id=licenses[0], extra_fields=self.new_extra_fields
+        )
+        nodes = [video, video_no_file, exercise, exercise_no_question]
+
+        with self.assertNumQueries(3):
+            errors = ContentNode.mark_nodes_complete(nodes)
+
+        self.assertEqual([node.mark_complete() for node in nodes], errors)
+        self.assertEqual([True, False, True, False], [node.complete for node in nodes])
+
+
+class NodeAggregatesTestCase(StudioTestCase):
+    def setUp(self):
+        super(NodeAggregatesTestCase, self).setUpBase()
+        self.channel = testdata.channel()
+        self.tree_id = self.channel.main_tree.tree_id
+
+    def _get_aggregates(self, tree_id):
+        return {
+            values[0]: values[1:]
+            for values in ContentNodeAggregate.objects.filter(contentnode__tree_id=tree_id).values_list(
+                "contentnode_id", "resource_count", "coach_count", "error_count", "updated_count", "new_count"
+            )
+            if any(values[1:])
+        }
+
+    def assertAggregatesMaintained(self, tree_id):
+        aggregates = self._get_aggregates(tree_id)
+        ContentNode.objects.rebuild_aggregates(tree_id)
+        self.assertEqual(self._get_aggregates(tree_id), aggregates)
+
+    def test_created_nodes(self):
+        root = self.channel.main_tree
+        resources = root.get_descendants().exclude(kind_id=content_kinds.TOPIC)
+        aggregate = ContentNodeAggregate.objects.get(contentnode=root)
+        self.assertEqual(aggregate.resource_count, resources.count())
+        self.assertEqual(aggregate.error_count, root.get_descendants().filter(complete=False).count())
+        self.assertEqual(aggregate.new_count, resources.filter(changed=True, published=False).count())
+        self.assertAggregatesMaintained(self.tree_id)
+
+    def test_move(self):
+        # Moved nodes are marked changed
+        ContentNode.objects.filter(tree_id=self.tree_id).update(changed=False, published=True)
+        ContentNode.objects.rebuild_aggregates(self.tree_id)
+        topic = self.channel.main_tree.get_children().filter(kind_id=content_kinds.TOPIC).first()
+        target = self.channel.main_tree.get_children().filter(kind_id=content_kinds.TOPIC).last()
+        topic.move_to(target, "first-child")
+        self.assertAggregatesMaintained(self.tree_id)
+
+        ContentNode.objects.move_nodes([(child, target, "first-child") for child in topic.get_children()])
+        self.assertAggregatesMaintained(self.tree_id)
+
+    def test_move_to_another_tree(self):
+        other_channel = testdata.channel()
+        topic = self.channel.main_tree.get_children().filter(kind_id=content_kinds.TOPIC).first()
+        topic.move_to(other_channel.main_tree)
+        self.assertAggregatesMaintained(self.tree_id)
+        self.assertAggregatesMaintained(other_channel.main_tree.tree_id)
+
+    def test_copy(self):
+        topic = self.channel.main_tree.get_children().filter(kind_id=content_kinds.TOPIC).first()
+        topic.copy_to(self.channel.main_tree)
+        self.assertAggregatesMaintained(self.tree_id)
+
+        with patch("contentcuration.db.models.manager.CustomContentNodeTreeManager._can_copy_in_database", return_value=False):
+            topic.copy_to(self.channel.main_tree)
+        self.assertAggregatesMaintained(self.tree_id)
+
+    def test_delete(self):
+        topic = self.channel.main_tree.get_children().filter(kind_id=content_kinds.TOPIC).first()
+        topic.delete()
+        self.assertAggregatesMaintained(self.tree_id)
+
+    def test_save_changes(self):
+        resource = self.channel.main_tree.get_descendants().exclude(kind_id=content_kinds.TOPIC).first()
+        resource.complete = not resource.complete
+        resource.role_visibility = roles.COACH
+        resource.save()
+        self.assertAggregatesMaintained(self.tree_id)
+
+        resource.kind_id = content_kinds.TOPIC
+        resource.save()
+        self.assertAggregatesMaintained(self.tree_id)
+
+    def test_maintain_aggregates(self):
+        nodes = self.channel.main_tree.get_descendants()
+        with ContentNode.objects.maintain_aggregates(nodes):
+            nodes.update(complete=False, published=True)
+        self.assertAggregatesMaintained(self.tree_id)
+
+    def test_backfill_migration(self):
+        aggregates = self._get_aggregates(self.tree_id)
+        ContentNodeAggregate.objects.filter(contentnode__tree_id=self.tree_id).delete()
+
+        migration = import_module("contentcuration.migrations.0153_backfill_contentnodeaggregate")
+        with connection.schema_editor() as schema_editor:
+            migration.backfill_aggregates(apps, schema_editor)
+
+        self.assertEqual(self._get_aggregates(self.tree_id), aggregates)
@@ -1,18 +1,36 @@
 from __future__ import absolute_import
 
+import json
 import os
 import random
+import sqlite3
 import string
 import tempfile
+import uuid
+import zipfile
+from contextlib import closing
 
 import pytest
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage as storage
 from django.core.management import call_command
 from django.db import connections
+from django.db.models import Count
+from django.db.models import Prefetch
+from django.db.models import Sum
 from kolibri_content import models as kolibri_models
 from kolibri_content.router import cleanup_content_database_connection
 from kolibri_content.router import get_active_content_database
 from kolibri_content.router import set_active_content_database
+from kolibri_content.router import using_content_database
+from kolibri_content.utils import copy_template_database
+from kolibri_content.utils import get_template_database
+from kolibri_content.utils import migrate_content_database
+from le_utils.constants import content_kinds
 from le_utils.constants import exercises
+from le_utils.constants import format_presets
 from le_utils.constants.labels import accessibility_categories
 from le_utils.constants.labels import learning_activities
 from le_utils.constants.labels import levels
@@ -29,14 +47,32 @@ from .testdata import node as create_node
 from .testdata import slideshow
 from .testdata import thumbnail_bytes
 from contentcuration import models as cc
+from contentcuration.utils.celery.tasks import ProgressTracker
+from contentcuration.utils.publish import build_perseus_zip
 from contentcuration.utils.publish import ChannelIncompleteError
+from contentcuration.utils.publish import check_export_database
 from contentcuration.utils.publish import convert_channel_thumbnail
+from contentcuration.utils.publish import copy_previous_export_database
 from contentcuration.utils.publish import create_content_database
 from contentcuration.utils.publish import create_slideshow_manifest
+from contentcuration.utils.publish import ExerciseAssetLoader
 from contentcuration.utils.publish import fill_published_fields
+from contentcuration.utils.publish import get_export_database_manifest
+from contentcuration.utils.publish import get_export_database_manifest_location
+from contentcuration.utils.publish import get_perseus_archive_hash
+from contentcuration.utils.publish import get_published_stats
+from contentcuration.utils.publish import IncrementalTreeMapper
 from contentcuration.utils.publish import map_prerequisites
+from contentcuration.utils.publish import mark_all_nodes_as_published
 from contentcuration.utils.publish import MIN_SCHEMA_VERSION
+from contentcuration.utils.publish import process_assessment_metadata
+from contentcuration.utils.publish import PROFILE_SLOWEST_EXERCISES
+from contentcuration.utils.publish import publish_channel
+from contentcuration.utils.publish import PublishProfiler
+from contentcuration.utils.publish import read_storage_file
+from contentcuration.utils.publish import save_export_database
 from contentcuration.utils.publish import set_channel_icon_encoding
+from contentcuration.utils.publish import TreeMapper
 
 pytestmark = pytest.mark.django_db
 
@@ -311,6 +347,20 @@ class ExportChannelTestCase(StudioTestCase):
         for file in files.prefetch_related('local_file'):
             self.assertEqual(file.file_size, file.local_file.file_size)
 
+    def test_contentnode_mptt_data(self):
+        nodes = {node.id: node for node in kolibri_models.ContentNode.objects.all()}
+        root = kolibri_models.ContentNode.objects.get(parent=None)
+        self.assertEqual(root.lft, 1)
+        self.assertEqual(root.rght, 2 * len(nodes))
+        for node in nodes.values():
+            self.assertEqual(node.tree_id, root.tree_id)
+            if node.parent_id:
+                parent = nodes[node.parent_id]
+                self.assertEqual(node.level, parent.level + 1)
+                self.assertGreater(node.lft, parent.lft)
+                self.assertLess(node.rght, parent.rght)
+            self.assertEqual(node.get_descendant_count(), node.get_descendants().count())
+
     def test_channel_icon_encoding(self):
         self.assertIsNotNone(self.content_channel.icon_encoding)
 
@@ -324,6 +374,14 @@ class ExportChannelTestCase(StudioTestCase):
             self.assertEqual(mastery["m"], 3 if i == 0 else 1)
             self.assertEqual(mastery["n"], 3 if i == 0 else 2)
 
+    def test_exercise_perseus_files(self):
+        exercises_qs = kolibri_models.ContentNode.objects.filter(kind="exercise")
+        assert exercises_qs.count() > 0
+        for exercise in exercises_qs:
+            perseus_file = exercise.files.get(preset=format_presets.EXERCISE)
+            ccnode = cc.ContentNode.objects.get(node_id=exercise.id)
+            self.assertEqual(perseus_file.local_file_id, ccnode.files.get(preset_id=format_presets.EXERCISE).checksum)
+
     def test_inherited_language(self):
         first_topic_node_id = self.content_channel.main_tree.get_descendants().first().node_id
         for child in kolibri_models.ContentNode.objects.filter(parent_id=first_topic_node_id)[1:]:
@@ -430,6 +488,119 @@ class ExportChannelTestCase(StudioTestCase):
         })
 
 
+class ExportChannelSmallBatchTestCase(ExportChannelTestCase):
+    """
+    Runs the export tests with chunks smaller than the tree, so that topics span several chunks
+    """
+
+    def setUp(self):
+        with patch("contentcuration.utils.publish.BATCH_SIZE", 3):
+            super(ExportChannelSmallBatchTestCase, self).setUp()
+
+
+class IncrementalExportChannelTestCase(StudioTestCase):
+    """
+    Checks that publishing a channel incrementally from its previous export database gives
+    the same export database as publishing it in full
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(IncrementalExportChannelTestCase, cls).setUpClass()
+        cls.patch_copy_db = patch('contentcuration.utils.publish.save_export_database')
+        cls.patch_copy_db.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(IncrementalExportChannelTestCase, cls).tearDownClass()
+        cls.patch_copy_db.stop()
+
+    def setUp(self):
+        super(IncrementalExportChannelTestCase, self).setUp()
+        self.content_channel = channel()
+        set_channel_icon_encoding(self.content_channel)
+        self.tempdbs = []
+
+        # Publish the channel, and store its export database as the currently published version
+        tempdb = self._create_content_database(force=True)
+        self.content_channel.version = 1
+        self.content_channel.save()
+        self.previous_export_db = os.path.join(settings.DB_ROOT, "{}-1.sqlite3".format(self.content_channel.id))
+        with open(tempdb, "rb") as f:
+            storage.save(self.previous_export_db, f)
+        mark_all_nodes_as_published(self.content_channel)
+
+        self.topic_a = self.content_channel.main_tree.get_children().get(title="Topic A")
+        self.topic_b = self.content_channel.main_tree.get_children().get(title="Topic B")
+
+    def tearDown(self):
+        storage.delete(self.previous_export_db)
+        for tempdb in self.tempdbs:
+            os.remove(tempdb)
+        super(IncrementalExportChannelTestCase, self).tearDown()
+
+    def _create_content_database(self, force=False):
+        tempdb = create_content_database(self.content_channel, force, self.admin_user.id, False)
+        self.tempdbs.append(tempdb)
+        return tempdb
+
+    def _get_export_data(self, tempdb):
+        with using_content_database(tempdb):
+            return {
+                "nodes": sorted(kolibri_models.ContentNode.objects.values_list(
+                    "id", "parent_id", "lft", "rght", "level", "title", "available", "lang_id", "categories"
+                )),
+                "files": sorted(kolibri_models.File.objects.values_list("contentnode_id", "local_file_id", "preset")),
+                "local_files": sorted(kolibri_models.LocalFile.objects.values_list("id", flat=True)),
+                "assessment_metadata": sorted(kolibri_models.AssessmentMetaData.objects.values_list("contentnode_id", "number_of_assessments")),
+                "channel": list(kolibri_models.ChannelMetadata.objects.values_list("id", "root_id")),
+            }
+
+    def assertIncrementalExportMatchesFullExport(self):
+        with patch("contentcuration.utils.publish.INCREMENTAL_PUBLISH_THRESHOLD", 1.0), \
+                patch.object(TreeMapper, "map_nodes", side_effect=AssertionError("Channel was not published incrementally")):
+            incremental_data = self._get_export_data(self._create_content_database())
+        self.assertEqual(self._get_export_data(self._create_content_database(force=True)), incremental_data)
+
+    def test_edited_nodes(self):
+        video_1, video_2, video_3, video_4 = self.topic_a.get_children()
+        video_1.title = "Video 1 edited"
+        video_1.save()
+        video_2.delete()
+        video_3.move_to(self.topic_b, "last-child")
+        video_4.move_to(self.topic_a, "first-child")
+
+        new_topic = create_node(
+            {"kind_id": "topic", "title": "Topic C", "children": [{"kind_id": "video", "title": "Video 5"}]},
+            parent=self.content_channel.main_tree,
+        )
+        new_topic.move_to(self.topic_a, "left")
+
+        self.assertIncrementalExportMatchesFullExport()
+
+    def test_relabelled_topic(self):
+        self.topic_b.categories = {subjects.MATHEMATICS: True}
+        self.topic_b.language_id = "sw"
+        self.topic_b.save()
+
+        self.assertIncrementalExportMatchesFullExport()
+
+    def test_unpublishable_topic(self):
+        self.topic_a.complete = False
+        self.topic_a.save()
+        for node in self.topic_b.get_children():
+            node.delete()
+
+        self.assertIncrementalExportMatchesFullExport()
+
+    def test_too_many_changes(self):
+        self.topic_a.get_children().update(changed=True)
+
+        with patch.object(IncrementalTreeMapper, "map_nodes", side_effect=AssertionError("Channel was published incrementally")):
+            full_data = self._get_export_data(self._create_content_database())
+        self.assertEqual(self._get_export_data(self._create_content_database(force=True)), full_data)
+
+
 class EmptyChannelTestCase(StudioTestCase):
 
     @classmethod
@@ -502,6 +673,131 @@ class ChannelExportUtilityFunctionTestCase(StudioTestCase):
             channel = cc.Channel.objects.create(thumbnail="/content/kolibri_flapping_bird.png", thumbnail_encoding={})
             self.assertEqual("this is a test", convert_channel_thumbnail(channel))
 
+    def test_build_perseus_zip_prefetched_no_queries(self):
+        content_channel = channel()
+        exercise = content_channel.main_tree.get_descendants().filter(kind_id="exercise").first()
+        assessment_items = list(
+            exercise.assessment_items.prefetch_related(Prefetch("files", queryset=cc.File.objects.select_related("file_format"))).order_by("order")
+        )
+        exercise_data, _ = process_assessment_metadata(exercise, None, assessment_items=assessment_items)
+        with self.assertNumQueries(0):
+            path, _ = build_perseus_zip(exercise, exercise_data, assessment_items, content_channel.id)
+        try:
+            with zipfile.ZipFile(path) as zf:
+                self.assertIn("exercise.json", zf.namelist())
+                for item in assessment_items:
+                    self.assertIn("{}.json".format(item.assessment_id), zf.namelist())
+        finally:
+            os.remove(path)
+
+    def test_build_perseus_zip_reads_each_image_once(self):
+        content_channel = channel()
+        exercise = content_channel.main_tree.get_descendants().filter(kind_id="exercise").first()
+        image = create_studio_file("an exercise image", preset=format_presets.EXERCISE_IMAGE, ext="png")
+        image_markdown = "![]({}/{})".format(exercises.CONTENT_STORAGE_PLACEHOLDER, image["name"])
+        items = list(exercise.assessment_items.order_by("order"))
+        for item in items:
+            item.question = "Question {}".format(image_markdown)
+            item.hints = json.dumps([{"hint": "Hint {}".format(image_markdown), "order": 1}])
+            item.save()
+        image["db_file"].assessment_item = items[0]
+        image["db_file"].save()
+
+        assessment_items = list(
+            exercise.assessment_items.prefetch_related(Prefetch("files", queryset=cc.File.objects.select_related("file_format"))).order_by("order")
+        )
+        exercise_data, _ = process_assessment_metadata(exercise, None, assessment_items=assessment_items)
+        with patch("contentcuration.utils.publish.read_storage_file", wraps=read_storage_file) as read:
+            path, _ = build_perseus_zip(exercise, exercise_data, assessment_items, content_channel.id)
+        try:
+            read.assert_called_once_with(cc.generate_object_storage_name(image["db_file"].checksum, image["name"]))
+            with zipfile.ZipFile(path) as zf:
+                image_name = "images/{}".format(image["name"])
+                self.assertEqual(1, zf.namelist().count(image_name))
+                self.assertEqual(b"an exercise image", zf.read(image_name))
+        finally:
+            os.remove(path)
+
+    def test_exercise_asset_loader_prefetches_referenced_images(self):
+        content_channel = channel()
+        exercise = content_channel.main_tree.get_descendants().filter(kind_id="exercise").first()
+        image = create_studio_file("a hint image", preset=format_presets.EXERCISE_IMAGE, ext="png")
+        item = exercise.assessment_items.order_by("order").first()
+        item.hints = json.dumps([{"hint": "![]({}/{} =10x10)".format(exercises.CONTENT_STORAGE_PLACEHOLDER, image["name"]), "order": 1}])
+        item.save()
+
+        storage_name = cc.generate_object_storage_name(image["db_file"].checksum, image["name"])
+        with ExerciseAssetLoader() as assets:
+            assets.prefetch([item])
+            self.assertIn(storage_name, assets.downloads)
+            with patch("contentcuration.utils.publish.read_storage_file") as read:
+                self.assertEqual(b"a hint image", assets.read(storage_name))
+            read.assert_not_called()
+
+    def test_perseus_archive_hash_changes_with_inputs(self):
+        content_channel = channel()
+        exercise = content_channel.main_tree.get_descendants().filter(kind_id="exercise").first()
+        assessment_items = list(exercise.assessment_items.prefetch_related("files").order_by("order"))
+        exercise_data, _ = process_assessment_metadata(exercise, None, assessment_items=assessment_items)
+        archive_hash = get_perseus_archive_hash(exercise_data, assessment_items)
+        self.assertEqual(archive_hash, get_perseus_archive_hash(exercise_data, assessment_items))
+
+        assessment_items[0].question = "A different question"
+        self.assertNotEqual(archive_hash, get_perseus_archive_hash(exercise_data, assessment_items))
+
+    def test_republish_reuses_cached_perseus_archives(self):
+        content_channel = channel()
+        set_channel_icon_encoding(content_channel)
+        exercise_files = cc.File.objects.filter(contentnode__tree_id=content_channel.main_tree.tree_id, preset_id=format_presets.EXERCISE)
+
+        os.remove(create_content_database(content_channel, True, self.admin_user.id, True))
+        checksums = sorted(exercise_files.values_list("checksum", flat=True))
+        self.assertTrue(checksums)
+        # the hash is stored with the exercise files rather than in the cache
+        self.assertFalse(exercise_files.filter(archive_hash__isnull=True).exists())
+        cache.clear()
+
+        with patch("contentcuration.utils.publish.create_perseus_zip") as create_perseus_zip:
+            os.remove(create_content_database(content_channel, True, self.admin_user.id, True))
+        create_perseus_zip.assert_not_called()
+        self.assertEqual(checksums, sorted(exercise_files.values_list("checksum", flat=True)))
+
+    def test_copy_template_database(self):
+        fh, tempdb = tempfile.mkstemp(suffix=".sqlite3")
+        self.addCleanup(os.remove, tempdb)
+        copy_template_database(tempdb)
+        self.assertEqual(get_template_database(), get_template_database())
+
+        with using_content_database(tempdb):
+            self.assertEqual(0, kolibri_models.ContentNode.objects.count())
+            with patch("kolibri_content.utils.call_command") as call_command_mock:
+                migrate_content_database(get_active_content_database())
+            call_command_mock.assert_not_called()
+
+    def test_in_memory_content_database(self):
+        fh, tempdb = tempfile.mkstemp(suffix=".sqlite3")
+        self.addCleanup(os.remove, tempdb)
+        copy_template_database(tempdb)
+
+        with using_content_database(tempdb, in_memory=True):
+            kolibri_models.Language.objects.create(id="en", lang_code="en")
+            # Nothing is written to the file until the block completes
+            with closing(sqlite3.connect(tempdb)) as disk_connection:
+                self.assertEqual((0,), disk_connection.execute("SELECT COUNT(*) FROM content_language").fetchone())
+        with self.assertRaises(ValueError), using_content_database(tempdb, in_memory=True):
+            kolibri_models.Language.objects.create(id="sw", lang_code="sw")
+            raise ValueError()
+
+        with using_content_database(tempdb):
+            self.assertEqual(["en"], list(kolibri_models.Language.objects.values_list("id", flat=True)))
+
+    def test_template_database_rebuilt_when_migrations_change(self):
+        template = get_template_database()
+        with patch("kolibri_content.utils.get_migration_state", return_value="changed"):
+            new_template = get_template_database()
+        self.assertNotEqual(template, new_template)
+        self.assertFalse(os.path.exists(template))
+
     def test_create_slideshow_manifest(self):
         ccnode = cc.ContentNode.objects.create(kind_id=slideshow(), extra_fields={}, complete=True)
         create_slideshow_manifest(ccnode)
@@ -509,6 +805,92 @@ class ChannelExportUtilityFunctionTestCase(StudioTestCase):
         assert len(manifest_collection) == 1
 
 
+class ExportDatabaseStorageTestCase(StudioTestCase):
+
+    def setUp(self):
+        super(ExportDatabaseStorageTestCase, self).setUp()
+        self.content_channel = cc.Channel.objects.create(version=2)
+        fh, self.tempdb = tempfile.mkstemp(suffix=".sqlite3")
+        copy_template_database(self.tempdb)
+        self.export_db_locations = [
+            os.path.join(settings.DB_ROOT, "{}.sqlite3".format(self.content_channel.id)),
+            os.path.join(settings.DB_ROOT, "{}-2.sqlite3".format(self.content_channel.id)),
+        ]
+        with using_content_database(self.tempdb), patch("contentcuration.utils.publish.storage.save", wraps=storage.save) as save:
+            save_export_database(self.content_channel.id, 2)
+        self.saved_names = [call[0][0] for call in save.call_args_list]
+
+    def tearDown(self):
+        for export_db_location in self.export_db_locations:
+            storage.delete(export_db_location)
+            storage.delete(get_export_database_manifest_location(export_db_location))
+        os.remove(self.tempdb)
+        super(ExportDatabaseStorageTestCase, self).tearDown()
+
+    def test_export_database_uploaded_once(self):
+        self.assertEqual([self.export_db_locations[1]], [name for name in self.saved_names if name.endswith(".sqlite3")])
+        for export_db_location in self.export_db_locations:
+            with storage.open(export_db_location) as f, open(self.tempdb, "rb") as tempf:
+                self.assertEqual(tempf.read(), f.read())
+
+    def test_export_database_manifests(self):
+        for export_db_location in self.export_db_locations:
+            manifest = get_export_database_manifest(export_db_location)
+            self.assertEqual(2, manifest["version"])
+            self.assertEqual(MIN_SCHEMA_VERSION, manifest["schema_version"])
+            self.assertTrue(check_export_database(self.tempdb, manifest))
+
+    def test_copy_previous_export_database_checks_manifest(self):
+        fh, path = tempfile.mkstemp(suffix=".sqlite3")
+        self.addCleanup(os.remove, path)
+        self.assertTrue(copy_previous_export_database(self.content_channel, path))
+
+        manifest_location = get_export_database_manifest_location(self.export_db_locations[1])
+        manifest = dict(get_export_database_manifest(self.export_db_locations[1]), md5="0" * 32)
+        storage.delete(manifest_location)
+        storage.save(manifest_location, ContentFile(json.dumps(manifest).encode("utf-8")))
+        self.assertFalse(copy_previous_export_database(self.content_channel, path))
+
+
+class PublishProfileTestCase(StudioTestCase):
+
+    def test_profiler_records_stage_queries(self):
+        profiler = PublishProfiler()
+        with profiler.stage("count") as stage:
+            list(cc.Channel.objects.all())
+            list(cc.Channel.objects.all())
+            stage["nodes"] += 2
+        with profiler.stage("count"):
+            list(cc.Channel.objects.all())
+
+        profile = profiler.get_profile()
+        self.assertEqual(3, profile["stages"]["count"]["queries"])
+        self.assertEqual(2, profile["stages"]["count"]["nodes"])
+        self.assertGreaterEqual(profile["total_time"], profile["stages"]["count"]["time"])
+        json.dumps(profile)
+
+    def test_publish_channel_records_profile(self):
+        content_channel = channel()
+        task_id = uuid.uuid4().hex
+        cc.CustomTaskMetadata.objects.create(task_id=task_id, channel_id=content_channel.id, user=self.admin_user)
+
+        content_channel = publish_channel(self.admin_user.id, content_channel.id, progress_tracker=ProgressTracker(task_id, lambda progress: None))
+
+        stages = ["migrate", "tree_map", "exercises", "prerequisites", "upload", "tsvector_sync", "mark_published", "fill_published_fields"]
+        task_profile = cc.CustomTaskMetadata.objects.get(task_id=task_id).profile
+        self.assertEqual(set(stages), set(task_profile["stages"]))
+        self.assertGreater(task_profile["stages"]["tree_map"]["nodes"], 0)
+        self.assertGreater(task_profile["stages"]["tree_map"]["queries"], 0)
+        self.assertGreater(task_profile["stages"]["upload"]["bytes_uploaded"], 0)
+        exercises = task_profile["stages"]["exercises"]
+        self.assertGreater(exercises["build_time"], 0)
+        self.assertEqual(min(exercises["nodes"], PROFILE_SLOWEST_EXERCISES), len(exercises["slowest"]))
+
+        content_channel.refresh_from_db()
+        version_profile = content_channel.published_data[str(content_channel.version)]["profile"]
+        self.assertEqual(set(stages), set(version_profile["stages"]))
+
+
 class ChannelExportPrerequisiteTestCase(StudioTestCase):
     @classmethod
     def setUpClass(cls):
@@ -543,6 +925,26 @@ class ChannelExportPrerequisiteTestCase(StudioTestCase):
         cc.PrerequisiteContentRelationship.objects.create(target_node=exercise, prerequisite=node1)
         map_prerequisites(node1)
 
+    def test_prerequisites_mapped_between_exported_nodes(self):
+        channel = cc.Channel.objects.create()
+        nodes = [
+            cc.ContentNode.objects.create(kind_id="exercise", parent_id=channel.main_tree.pk, complete=True)
+            for _i in range(3)
+        ]
+        for node in nodes[:2]:
+            kolibri_models.ContentNode.objects.create(
+                id=node.node_id, content_id=node.content_id, channel_id=channel.id, kind=node.kind_id, title=node.title, available=True
+            )
+        cc.PrerequisiteContentRelationship.objects.create(target_node=nodes[1], prerequisite=nodes[0])
+        # The prerequisite of this relationship was not exported, so it is dropped
+        cc.PrerequisiteContentRelationship.objects.create(target_node=nodes[1], prerequisite=nodes[2])
+
+        self.assertEqual(1, map_prerequisites(channel.main_tree))
+        self.assertEqual(
+            [nodes[0].node_id],
+            list(kolibri_models.ContentNode.objects.get(id=nodes[1].node_id).has_prerequisite.values_list("id", flat=True)),
+        )
+
 
 class ChannelExportPublishedData(StudioTestCase):
     def test_fill_published_fields(self):
@@ -553,3 +955,28 @@ class ChannelExportPublishedData(StudioTestCase):
         self.assertTrue(channel.published_data)
         self.assertIsNotNone(channel.published_data.get(0))
         self.assertEqual(channel.published_data[0]['version_notes'], version_notes)
+
+    def test_published_stats(self):
+        content_channel = channel()
+        mark_all_nodes_as_published(content_channel)
+        published_nodes = content_channel.main_tree.get_descendants().filter(published=True)
+
+        with self.assertNumQueries(1):
+            stats = get_published_stats(content_channel)
+
+        self.assertEqual(published_nodes.exclude(kind_id=content_kinds.TOPIC).count(), stats["resource_count"])
+        self.assertEqual(
+            list(published_nodes.values("kind_id").annotate(count=Count("kind_id")).order_by("kind_id")),
+            stats["kind_count"],
+        )
+        self.assertEqual(
+            published_nodes.values("files__checksum", "files__file_size").distinct().aggregate(size=Sum("files__file_size"))["size"],
+            stats["size"],
+        )
+        languages = set(published_nodes.exclude(language=None).values_list("language", flat=True))
+        languages.update(published_nodes.values_list("files__language", flat=True))
+        self.assertEqual(languages, set(stats["included_languages"]))
+
+        fill_published_fields(content_channel, "")
+        published_data = content_channel.published_data[content_channel.version]
+        self.assertEqual(stats, {key: published_data[key] for key in stats})
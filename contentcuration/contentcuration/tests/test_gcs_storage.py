@@ -130,3 +130,30 @@ class GoogleCloudStorageOpenTestCase(TestCase):
         assert isinstance(f, File)
         # This checks that an actual temp file was written on disk for the file.git
         assert f.name
+
+
+class GoogleCloudStorageCopyTestCase(TestCase):
+    """
+    Tests for GoogleCloudStorage.copy().
+    """
+
+    def setUp(self):
+        self.mock_client = create_autospec(Client)
+        self.storage = gcs(client=self.mock_client())
+
+    def test_copies_blob_within_bucket(self):
+        """
+        Check that copy() makes a server side copy of the blob, rather than downloading it.
+        """
+        blob = self.storage.bucket.get_blob.return_value
+        self.storage.copy("content/databases/a-1.sqlite3", "content/databases/a.sqlite3")
+
+        self.storage.bucket.copy_blob.assert_called_once_with(blob, self.storage.bucket, "content/databases/a.sqlite3")
+
+    def test_raises_error_if_source_does_not_exist(self):
+        """
+        Check that copy() raises a FileNotFoundError if there is nothing to copy.
+        """
+        self.storage.bucket.get_blob.return_value = None
+        with pytest.raises(FileNotFoundError):
+            self.storage.copy("content/databases/a-1.sqlite3", "content/databases/a.sqlite3")
@@ -1,11 +1,14 @@
 import uuid
+from importlib import import_module
 from uuid import uuid4
 
 import mock
 import pytest
+from django.apps import apps
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.models import Q
 from django.db.utils import IntegrityError
 from django.utils import timezone
@@ -18,6 +21,7 @@ from contentcuration.models import AssessmentItem
 from contentcuration.models import Channel
 from contentcuration.models import ChannelHistory
 from contentcuration.models import ChannelSet
+from contentcuration.models import ChecksumReference
 from contentcuration.models import ContentNode
 from contentcuration.models import CONTENTNODE_TREE_ID_CACHE_KEY
 from contentcuration.models import File
@@ -713,6 +717,109 @@ class FileTestCase(PermissionQuerysetTestCase):
             )
 
 
+class ChecksumReferenceTestCase(StudioTestCase):
+    def setUp(self):
+        super(ChecksumReferenceTestCase, self).setUpBase()
+        self.tree_id = self.channel.main_tree.tree_id
+
+    def _create_file(self, parent_id, checksum=None, file_size=100):
+        return File.objects.create(
+            contentnode=create_contentnode(parent_id),
+            checksum=checksum or uuid4().hex,
+            file_size=file_size,
+            preset_id=format_presets.VIDEO_HIGH_RES,
+            file_format_id="mp4",
+            uploaded_by=self.user,
+        )
+
+    def _references(self, tree_id):
+        return set(
+            ChecksumReference.objects.filter(tree_id=tree_id).values_list(
+                "uploaded_by_id", "checksum", "file_size", "kind", "count"
+            )
+        )
+
+    def assertReferencesMatchRebuild(self, tree_id):
+        references = self._references(tree_id)
+        ChecksumReference.objects.rebuild(tree_id)
+        self.assertEqual(references, self._references(tree_id))
+
+    def test_create(self):
+        node_file = self._create_file(self.channel.main_tree_id)
+        self.assertEqual(
+            {(self.user.id, node_file.checksum, 100, content_kinds.VIDEO, 1)},
+            self._references(self.tree_id),
+        )
+        self.assertReferencesMatchRebuild(self.tree_id)
+
+    def test_delete(self):
+        node_file = self._create_file(self.channel.main_tree_id)
+        other_file = self._create_file(self.channel.main_tree_id, checksum=node_file.checksum)
+        reference = ChecksumReference.objects.get(tree_id=self.tree_id, checksum=node_file.checksum)
+        self.assertEqual(2, reference.count)
+
+        other_file.delete()
+        reference.refresh_from_db()
+        self.assertEqual(1, reference.count)
+        self.assertReferencesMatchRebuild(self.tree_id)
+
+        node_file.contentnode.delete()
+        self.assertFalse(ChecksumReference.objects.filter(checksum=node_file.checksum).exists())
+
+    def test_reassign(self):
+        node_file = self._create_file(self.channel.main_tree_id)
+        other_channel = testdata.channel()
+        node_file.contentnode = create_contentnode(other_channel.main_tree_id)
+        node_file.save()
+
+        self.assertEqual(set(), self._references(self.tree_id))
+        self.assertEqual(1, len(self._references(other_channel.main_tree.tree_id)))
+        self.assertReferencesMatchRebuild(other_channel.main_tree.tree_id)
+
+    def test_move_node(self):
+        node_file = self._create_file(self.channel.main_tree_id)
+        self.channel.trash_tree = testdata.tree()
+        self.channel.save()
+        node_file.contentnode.move_to(self.channel.trash_tree, "last-child")
+
+        self.assertEqual(set(), self._references(self.tree_id))
+        self.assertEqual(1, len(self._references(self.channel.trash_tree.tree_id)))
+        self.assertReferencesMatchRebuild(self.channel.trash_tree.tree_id)
+
+    def test_copy_node(self):
+        node_file = self._create_file(self.channel.main_tree_id)
+        other_channel = testdata.channel()
+        node_file.contentnode.copy_to(other_channel.main_tree)
+
+        self.assertEqual(1, len(self._references(self.tree_id)))
+        self.assertEqual(
+            {(self.user.id, node_file.checksum, 100, content_kinds.VIDEO, 1)},
+            self._references(other_channel.main_tree.tree_id),
+        )
+        self.assertReferencesMatchRebuild(other_channel.main_tree.tree_id)
+
+    def test_get_space_used(self):
+        node_file = self._create_file(self.channel.main_tree_id, file_size=100)
+        self._create_file(self.channel.main_tree_id, checksum=node_file.checksum, file_size=100)
+        self._create_file(self.channel.main_tree_id, file_size=50)
+
+        self.assertEqual(150, self.user.get_space_used())
+        self.assertEqual({content_kinds.VIDEO: 150}, self.user.get_space_used_by_kind())
+
+    def test_backfill_migration(self):
+        node_file = self._create_file(self.channel.main_tree_id)
+        self._create_file(self.channel.main_tree_id, checksum=node_file.checksum)
+        references = self._references(self.tree_id)
+        ChecksumReference.objects.all().delete()
+
+        migration = import_module("contentcuration.migrations.0155_backfill_checksumreference")
+        with connection.schema_editor() as schema_editor:
+            migration.backfill_checksum_references(apps, schema_editor)
+
+        self.assertEqual(references, self._references(self.tree_id))
+        self.assertEqual(100, self.user.get_space_used())
+
+
 class AssessmentItemFilePermissionTestCase(PermissionQuerysetTestCase):
     @property
     def base_queryset(self):
@@ -1,10 +1,14 @@
 import codecs
 import hashlib
+import os
+import shutil
+import tempfile
 from datetime import timedelta
 from io import BytesIO
 
 import pytest
 import requests
+from django.core.files.base import ContentFile
 from django.core.files.storage import FileSystemStorage
 from django.test import TestCase
 from django_s3_storage.storage import S3Storage
@@ -13,6 +17,7 @@ from mock import MagicMock
 from .base import StudioTestCase
 from contentcuration.models import generate_object_storage_name
 from contentcuration.utils.storage_common import _get_gcs_presigned_put_url
+from contentcuration.utils.storage_common import copy_file
 from contentcuration.utils.storage_common import determine_content_type
 from contentcuration.utils.storage_common import get_presigned_upload_url
 from contentcuration.utils.storage_common import UnknownStorageBackendError
@@ -63,6 +68,38 @@ class MimeTypesTestCase(TestCase):
         assert typ == "application/octet-stream"
 
 
+class CopyFileTestCase(TestCase):
+    """
+    Tests for copying files within a storage backend.
+    """
+
+    def test_file_system_storage_links_file(self):
+        """
+        Check that a copy on the file system is a hard link to the original file,
+        and that it replaces any file already at the destination.
+        """
+        storage = FileSystemStorage(location=tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, storage.location)
+        storage.save("databases/a-1.sqlite3", ContentFile(b"new"))
+        storage.save("databases/a.sqlite3", ContentFile(b"old"))
+
+        copy_file("databases/a-1.sqlite3", "databases/a.sqlite3", storage=storage)
+
+        with storage.open("databases/a.sqlite3") as f:
+            assert f.read() == b"new"
+        assert os.path.samefile(storage.path("databases/a-1.sqlite3"), storage.path("databases/a.sqlite3"))
+
+    def test_s3_storage_copies_on_server(self):
+        """
+        Check that S3 copies are made by the server, rather than by downloading the file.
+        """
+        storage = MagicMock(spec=S3Storage)
+        copy_file("databases/a-1.sqlite3", "databases/a.sqlite3", storage=storage)
+
+        storage.copy.assert_called_once_with("databases/a-1.sqlite3", "databases/a.sqlite3")
+        storage.open.assert_not_called()
+
+
 class FileSystemStoragePresignedURLTestCase(TestCase):
     """
     Test cases for generating presigned URLs with the FileSystemStorage backend.
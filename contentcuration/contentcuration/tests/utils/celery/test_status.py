@@ -0,0 +1,95 @@
+import uuid
+
+from celery import states
+from django.test import override_settings
+from django.test import SimpleTestCase
+from django_redis import get_redis_connection
+
+from contentcuration.utils.celery.status import get_channel_tasks_key
+from contentcuration.utils.celery.status import get_task_statuses
+from contentcuration.utils.celery.status import populate_task_statuses
+from contentcuration.utils.celery.status import remove_task_statuses
+from contentcuration.utils.celery.status import set_task_progress
+from contentcuration.utils.celery.status import set_task_status
+
+
+class TaskStatusTestCase(SimpleTestCase):
+    def setUp(self):
+        super(TaskStatusTestCase, self).setUp()
+        self.channel_id = uuid.uuid4().hex
+
+    def get_tasks(self):
+        tasks, missing = get_task_statuses([self.channel_id])
+        return {task["task_id"]: task for task in tasks}, missing
+
+    def test_missing_until_populated(self):
+        set_task_status("started", "export-channel", self.channel_id, states.STARTED)
+        tasks, missing = self.get_tasks()
+        self.assertEqual([self.channel_id], missing)
+
+        populate_task_statuses([self.channel_id], [])
+        tasks, missing = self.get_tasks()
+        self.assertEqual([], missing)
+        self.assertEqual(states.STARTED, tasks["started"]["status"])
+
+    def test_populate_keeps_newer_statuses(self):
+        set_task_status("task", "export-channel", self.channel_id, states.FAILURE, traceback="Traceback")
+        populate_task_statuses([self.channel_id], [{
+            "task_id": "task",
+            "task_name": "export-channel",
+            "traceback": None,
+            "progress": 20,
+            "channel_id": uuid.UUID(self.channel_id),
+            "status": states.STARTED,
+        }])
+
+        tasks, missing = self.get_tasks()
+        self.assertEqual(states.FAILURE, tasks["task"]["status"])
+        self.assertEqual("Traceback", tasks["task"]["traceback"])
+        self.assertEqual(20, tasks["task"]["progress"])
+
+    def test_progress(self):
+        populate_task_statuses([self.channel_id], [])
+        set_task_status("task", "export-channel", self.channel_id, states.STARTED)
+        set_task_progress("task", self.channel_id, 40)
+        self.assertEqual(40, self.get_tasks()[0]["task"]["progress"])
+
+        # Progress of tasks that have been removed isn't cached again
+        remove_task_statuses(self.channel_id, ["task"])
+        set_task_progress("task", self.channel_id, 60)
+        self.assertEqual({}, self.get_tasks()[0])
+
+    def test_populate_skips_removed_tasks(self):
+        # The task finished after its status was read from the database, but before the cache was populated
+        set_task_status("task", "export-channel", self.channel_id, states.STARTED)
+        remove_task_statuses(self.channel_id, ["task"])
+        populate_task_statuses([self.channel_id], [{
+            "task_id": "task",
+            "task_name": "export-channel",
+            "traceback": None,
+            "progress": 20,
+            "channel_id": uuid.UUID(self.channel_id),
+            "status": states.STARTED,
+        }])
+        self.assertEqual({}, self.get_tasks()[0])
+
+        # Unless it is started again
+        set_task_status("task", "export-channel", self.channel_id, states.STARTED)
+        self.assertEqual(states.STARTED, self.get_tasks()[0]["task"]["status"])
+
+    @override_settings(SYNC_TASK_STATUS_TIMEOUT=60)
+    def test_writes_keep_expiry(self):
+        redis = get_redis_connection("default")
+        key = get_channel_tasks_key(self.channel_id)
+        set_task_status("task", "export-channel", self.channel_id, states.STARTED)
+        self.assertEqual(60, redis.ttl(key))
+
+        redis.expire(key, 10)
+        set_task_status("other", "export-channel", self.channel_id, states.STARTED)
+        set_task_progress("task", self.channel_id, 40)
+        remove_task_statuses(self.channel_id, ["task"])
+        self.assertEqual(10, redis.ttl(key))
+
+        # Populating the cache from the database restarts it
+        populate_task_statuses([self.channel_id], [])
+        self.assertEqual(60, redis.ttl(key))
@@ -1,8 +1,18 @@
+import uuid
+
 import mock
+from django.db import transaction
 from django.test import SimpleTestCase
 
+from ..base import StudioTestCase
 from ..helpers import mock_class_instance
+from contentcuration.models import AssessmentItem
+from contentcuration.models import ContentNode
+from contentcuration.tests import testdata
+from contentcuration.utils.cache import get_revision
+from contentcuration.utils.cache import get_tree_revision_name
 from contentcuration.utils.cache import ResourceSizeCache
+from contentcuration.utils.cache import TreeRevisionCache
 
 
 class ResourceSizeCacheTestCase(SimpleTestCase):
@@ -80,3 +90,99 @@ class ResourceSizeCacheTestCase(SimpleTestCase):
         with mock.patch.object(self.helper, 'cache_set') as cache_set:
             self.helper.set_modified('2021-01-01 00:00:00')
             cache_set.assert_called_once_with(self.helper.modified_key, '2021-01-01 00:00:00')
+
+
+class TreeRevisionCacheTestCase(StudioTestCase):
+    def setUp(self):
+        super(TreeRevisionCacheTestCase, self).setUpBase()
+        self.tree_id = self.channel.main_tree.tree_id
+        self.node = self.channel.main_tree.get_descendants().first()
+
+    def assertBumped(self, tree_id, revision):
+        self.assertGreater(get_revision(get_tree_revision_name(tree_id)), revision)
+
+    def test_cached_value(self):
+        TreeRevisionCache(self.tree_id).set("test", 123)
+        self.assertEqual(123, TreeRevisionCache(self.tree_id).get("test"))
+        self.assertIsNone(TreeRevisionCache(self.channel.trash_tree.tree_id).get("test"))
+
+    def test_node_change(self):
+        cache = TreeRevisionCache(self.tree_id)
+        cache.set("test", 123)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.node.title = "changed"
+            self.node.save()
+        self.assertBumped(self.tree_id, cache.revision)
+        self.assertIsNone(TreeRevisionCache(self.tree_id).get("test"))
+
+    def test_bumped_on_commit(self):
+        revision = TreeRevisionCache(self.tree_id).revision
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.node.save()
+            self.assertEqual(revision, TreeRevisionCache(self.tree_id).revision)
+        for callback in callbacks:
+            callback()
+        self.assertBumped(self.tree_id, revision)
+
+    def test_not_bumped_on_rollback(self):
+        revision = TreeRevisionCache(self.tree_id).revision
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.node.save()
+                    raise ValueError()
+        self.assertEqual(revision, TreeRevisionCache(self.tree_id).revision)
+
+    def test_file_change(self):
+        file = self.node.get_descendants(include_self=True).filter(files__isnull=False).first().files.first()
+        revision = TreeRevisionCache(self.tree_id).revision
+        with self.captureOnCommitCallbacks(execute=True):
+            file.save()
+        self.assertBumped(self.tree_id, revision)
+
+        revision = TreeRevisionCache(self.tree_id).revision
+        with self.captureOnCommitCallbacks(execute=True):
+            file.delete()
+        self.assertBumped(self.tree_id, revision)
+
+    def test_move_to_another_tree(self):
+        trash_tree_id = self.channel.trash_tree.tree_id
+        revision = TreeRevisionCache(self.tree_id).revision
+        trash_revision = TreeRevisionCache(trash_tree_id).revision
+        with self.captureOnCommitCallbacks(execute=True):
+            self.node.move_to(self.channel.trash_tree, "last-child")
+        self.assertBumped(self.tree_id, revision)
+        self.assertBumped(trash_tree_id, trash_revision)
+
+    def test_insert_children(self):
+        revision = TreeRevisionCache(self.tree_id).revision
+        with self.captureOnCommitCallbacks(execute=True):
+            ContentNode.objects.insert_children(self.channel.main_tree, [ContentNode(title="new", kind=testdata.topic())])
+        self.assertBumped(self.tree_id, revision)
+
+    def test_bumped_once_per_transaction(self):
+        trash_tree_id = self.channel.trash_tree.tree_id
+        with mock.patch("contentcuration.utils.cache._bump_revisions") as bump_revisions:
+            with self.captureOnCommitCallbacks(execute=True):
+                for node in self.channel.main_tree.get_descendants()[:3]:
+                    node.save()
+                self.channel.trash_tree.save()
+        bump_revisions.assert_called_once_with(sorted([get_tree_revision_name(self.tree_id), get_tree_revision_name(trash_tree_id)]))
+
+    def test_bumped_after_rolled_back_savepoint(self):
+        revision = TreeRevisionCache(self.tree_id).revision
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.node.save()
+                    raise ValueError()
+            # The names collected in the savepoint were rolled back with it, but later changes are still bumped
+            self.channel.main_tree.save()
+        self.assertBumped(self.tree_id, revision)
+
+    def test_assessment_item_change(self):
+        item = AssessmentItem.objects.create(contentnode_id=self.node.id, assessment_id=uuid.uuid4().hex)
+        revision = TreeRevisionCache(self.tree_id).revision
+        with self.captureOnCommitCallbacks(execute=True):
+            AssessmentItem.objects.get(pk=item.pk).save()
+        self.assertBumped(self.tree_id, revision)
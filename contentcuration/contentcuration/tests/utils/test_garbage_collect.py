@@ -11,6 +11,7 @@ from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.urls import reverse_lazy
+from django.utils import timezone
 from django_celery_results.models import TaskResult
 from le_utils.constants import content_kinds
 from le_utils.constants import file_formats
@@ -23,17 +24,27 @@ from contentcuration.models import File
 from contentcuration.models import UserHistory
 from contentcuration.tests.base import BaseAPITestCase
 from contentcuration.tests.base import StudioTestCase
+from contentcuration.tests.testdata import channel as create_channel_data
 from contentcuration.tests.testdata import tree
+from contentcuration.tests.testdata import user as create_user_data
 from contentcuration.utils.db_tools import create_user
+from contentcuration.utils.garbage_collect import archive_changes
 from contentcuration.utils.garbage_collect import clean_up_contentnodes
+from contentcuration.utils.garbage_collect import clean_up_deleted_channel_changes
 from contentcuration.utils.garbage_collect import clean_up_deleted_chefs
 from contentcuration.utils.garbage_collect import clean_up_feature_flags
 from contentcuration.utils.garbage_collect import clean_up_soft_deleted_users
 from contentcuration.utils.garbage_collect import clean_up_stale_files
 from contentcuration.utils.garbage_collect import clean_up_tasks
+from contentcuration.utils.garbage_collect import fold_change_updates
 from contentcuration.utils.garbage_collect import get_deleted_chefs_root
 from contentcuration.views.internal import api_commit_channel
 from contentcuration.views.internal import create_channel
+from contentcuration.viewsets.channel import _unpublished_changes_query
+from contentcuration.viewsets.sync.constants import CONTENTNODE
+from contentcuration.viewsets.sync.utils import generate_delete_event
+from contentcuration.viewsets.sync.utils import generate_publish_event
+from contentcuration.viewsets.sync.utils import generate_update_event
 
 pytestmark = pytest.mark.django_db
 
@@ -460,3 +471,122 @@ class CleanupStaleFilesTestCase(StudioTestCase):
             File.objects.get(id=self.file_to_keep.id)
         except File.DoesNotExist:
             self.fail("File was deleted")
+
+
+class CompactChangesTestCase(StudioTestCase):
+
+    def setUp(self):
+        super(CompactChangesTestCase, self).setUp()
+        self.channel = create_channel_data()
+        self.user = create_user_data()
+        self.channel.editors.add(self.user)
+        self.node1, self.node2 = self.channel.main_tree.get_descendants()[:2]
+
+    def update(self, node, mods):
+        return generate_update_event(node.id, CONTENTNODE, mods, channel_id=self.channel.id)
+
+    def create_changes(self, events, days_ago=0):
+        changes = cc.Change.create_changes(events, created_by_id=self.user.id, applied=True)
+        cc.Change.objects.filter(server_rev__in=[c.server_rev for c in changes]).update(created=timezone.now() - timedelta(days=days_ago))
+        return changes
+
+    def test_fold_change_updates(self):
+        folded = self.create_changes(
+            [self.update(self.node1, {"title": "A"}), self.update(self.node1, {"description": "B"}), self.update(self.node1, {"title": "C"})],
+            days_ago=40,
+        )
+        # A change other than an update breaks the run
+        broken = self.create_changes(
+            [
+                self.update(self.node2, {"title": "A"}),
+                generate_delete_event(self.node2.id, CONTENTNODE, channel_id=self.channel.id),
+                self.update(self.node2, {"title": "B"}),
+            ],
+            days_ago=40,
+        )
+        recent = self.create_changes([self.update(self.node1, {"title": "D"})])
+
+        self.assertEqual(2, fold_change_updates(timezone.now() - timedelta(days=30)))
+
+        remaining = cc.Change.objects.filter(channel=self.channel)
+        self.assertEqual(
+            sorted([folded[-1].server_rev, recent[0].server_rev] + [c.server_rev for c in broken]),
+            sorted(remaining.values_list("server_rev", flat=True)),
+        )
+        folded_change = remaining.get(server_rev=folded[-1].server_rev)
+        self.assertEqual({"description": "B", "title": "C"}, folded_change.kwargs["mods"])
+
+    def test_changes_without_creation_time_are_old(self):
+        # Changes made before their creation time was recorded
+        changes = self.create_changes([self.update(self.node1, {"title": "A"}), self.update(self.node1, {"title": "B"})])
+        cc.Change.objects.filter(server_rev__in=[c.server_rev for c in changes]).update(created=None)
+
+        self.assertEqual(1, fold_change_updates(timezone.now() - timedelta(days=30)))
+        # The last edit of the channel is kept
+        self.create_changes([self.update(self.node2, {"title": "C"})])
+        self.assertEqual(1, archive_changes(timezone.now() - timedelta(days=90)))
+        self.assertIsNone(cc.ArchivedChange.objects.get(server_rev=changes[-1].server_rev).created)
+
+    def test_fold_change_updates_overlapping_mods(self):
+        changes = self.create_changes(
+            [
+                self.update(self.node1, {"extra_fields": {"m": 1}}),
+                self.update(self.node1, {"extra_fields.n": 2}),
+                self.update(self.node1, {"title": "A"}),
+            ],
+            days_ago=40,
+        )
+
+        self.assertEqual(1, fold_change_updates(timezone.now() - timedelta(days=30)))
+
+        remaining = cc.Change.objects.filter(channel=self.channel).order_by("server_rev")
+        self.assertEqual([changes[0].server_rev, changes[2].server_rev], [c.server_rev for c in remaining])
+        self.assertEqual({"extra_fields.n": 2, "title": "A"}, remaining[1].kwargs["mods"])
+
+    def test_clean_up_deleted_channel_changes(self):
+        self.create_changes([self.update(self.node1, {"title": "A"})])
+        self.channel.mark_deleted(self.user)
+        self.channel.history.update(performed=timezone.now() - timedelta(days=40))
+
+        recently_deleted = create_channel_data()
+        recently_deleted.mark_deleted(self.user)
+        cc.Change.create_changes(
+            [generate_update_event(recently_deleted.id, "channel", {"name": "A"}, channel_id=recently_deleted.id)], applied=True
+        )
+
+        self.assertEqual(1, clean_up_deleted_channel_changes(timezone.now() - timedelta(days=30)))
+        self.assertFalse(cc.Change.objects.filter(channel=self.channel).exists())
+        self.assertTrue(cc.Change.objects.filter(channel=recently_deleted).exists())
+
+    def test_archive_changes(self):
+        older_than = timezone.now() - timedelta(days=90)
+        old = self.create_changes([self.update(self.node1, {"title": "A"}), self.update(self.node2, {"title": "B"})], days_ago=100)
+        publish = self.create_changes([generate_publish_event(self.channel.id)], days_ago=100)
+        pending = cc.Change.create_changes([self.update(self.node1, {"title": "C"})], created_by_id=self.user.id)
+        cc.Change.objects.filter(server_rev=pending[0].server_rev).update(created=timezone.now() - timedelta(days=100))
+        recent = self.create_changes([self.update(self.node1, {"title": "D"})])
+        unpublished_changes = _unpublished_changes_query(self.channel).exists()
+
+        # Changes that haven't been applied are kept
+        self.assertEqual(3, archive_changes(older_than, batch_size=2))
+
+        self.assertEqual(
+            sorted([c.server_rev for c in old] + [publish[0].server_rev]),
+            sorted(cc.ArchivedChange.objects.values_list("server_rev", flat=True)),
+        )
+        self.assertEqual(
+            sorted([pending[0].server_rev, recent[0].server_rev]),
+            sorted(cc.Change.objects.filter(channel=self.channel).values_list("server_rev", flat=True)),
+        )
+        self.assertEqual(unpublished_changes, _unpublished_changes_query(self.channel).exists())
+
+    def test_archive_changes_keeps_last_edit(self):
+        older_than = timezone.now() - timedelta(days=90)
+        self.create_changes([self.update(self.node1, {"title": "A"})], days_ago=110)
+        last_edit = self.create_changes([self.update(self.node1, {"title": "B"})], days_ago=100)
+        self.assertTrue(_unpublished_changes_query(self.channel).exists())
+
+        self.assertEqual(1, archive_changes(older_than))
+
+        self.assertEqual([last_edit[0].server_rev], list(cc.Change.objects.filter(channel=self.channel).values_list("server_rev", flat=True)))
+        self.assertTrue(_unpublished_changes_query(self.channel).exists())
@@ -1,15 +1,16 @@
-import datetime
 from time import sleep
 
 import mock
-import pytest
 from dateutil.parser import isoparse
-from django.db.models import F
-from django.db.models import Max
+from django.core.cache import cache
 from django.test import SimpleTestCase
+from django.utils import timezone
 
 from ..base import StudioTestCase
+from contentcuration.models import File
 from contentcuration.tests.helpers import mock_class_instance
+from contentcuration.utils.cache import FILES_MODIFIED_KEY
+from contentcuration.utils.cache import TreeRevisionCache
 from contentcuration.utils.nodes import calculate_resource_size
 from contentcuration.utils.nodes import ResourceSizeHelper
 from contentcuration.utils.nodes import SlowCalculationError
@@ -31,13 +32,22 @@ class ResourceSizeHelperTestCase(StudioTestCase):
             is_root_node.return_value = False
             self.assertEqual(10, self.helper.get_size())
 
-    @pytest.mark.skip
     def test_modified_since(self):
-        max_modified = self.helper.queryset.aggregate(max_modified=Max(F('modified')))['max_modified']
-        before_max = max_modified - datetime.timedelta(seconds=1)
-        after_max = max_modified + datetime.timedelta(seconds=1)
-        self.assertTrue(self.helper.modified_since(before_max.isoformat()))
-        self.assertFalse(self.helper.modified_since(after_max.isoformat()))
+        before = timezone.now()
+        file = File.objects.filter(contentnode__tree_id=self.root.tree_id).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            file.save()
+        after = timezone.now()
+        self.assertTrue(self.helper.modified_since(before.isoformat()))
+        self.assertFalse(self.helper.modified_since(after.isoformat()))
+
+    def test_modified_since__completed(self):
+        node = self.root.get_descendants().filter(files__isnull=False).first()
+        before = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            node.complete = not node.complete
+            node.save()
+        self.assertTrue(self.helper.modified_since(before))
 
 
 @mock.patch("contentcuration.utils.nodes.ResourceSizeHelper")
@@ -57,6 +67,7 @@ class CalculateResourceSizeTestCase(SimpleTestCase):
         self.assertFalse(stale)
         cache().set_size.assert_called_once_with(456)
         cache().set_modified.assert_called_once_with(now_val)
+        cache().set_version.assert_called_once_with(TreeRevisionCache(self.node.tree_id).version)
 
     def test_cached(self, cache, helper):
         cache().get_size.return_value = 123
@@ -65,6 +76,15 @@ class CalculateResourceSizeTestCase(SimpleTestCase):
         size, stale = calculate_resource_size(self.node)
         self.assertEqual(123, size)
         self.assertFalse(stale)
+        cache().set_version.assert_called_once_with(TreeRevisionCache(self.node.tree_id).version)
+
+    def test_cached__tree_unchanged(self, cache, helper):
+        cache().get_size.return_value = 123
+        cache().get_version.return_value = TreeRevisionCache(self.node.tree_id).version
+        size, stale = calculate_resource_size(self.node)
+        self.assertEqual(123, size)
+        self.assertFalse(stale)
+        helper().modified_since.assert_not_called()
 
     def test_stale__too_big__no_force(self, cache, helper):
         self.node.get_descendant_count.return_value = STALE_MAX_CALCULATION_SIZE + 1
@@ -123,6 +143,8 @@ class CalculateResourceSizeIntegrationTestCase(StudioTestCase):
     def setUp(self):
         super(CalculateResourceSizeIntegrationTestCase, self).setUpBase()
         self.root = self.channel.main_tree
+        # tree ids are reused between tests, so don't rely on a watermark left by an earlier one
+        cache.delete(FILES_MODIFIED_KEY.format(self.root.tree_id))
 
     def test_small(self):
         size, stale = calculate_resource_size(self.root)
@@ -133,3 +155,26 @@ class CalculateResourceSizeIntegrationTestCase(StudioTestCase):
         size, stale = calculate_resource_size(self.root)
         self.assertEqual(10, size)
         self.assertFalse(stale)
+
+    def test_cached__not_modified(self):
+        calculate_resource_size(self.root)
+        # a change that doesn't modify the files of the tree only bumps its revision
+        with self.captureOnCommitCallbacks(execute=True):
+            self.root.title = "changed"
+            self.root.save()
+        with mock.patch.object(ResourceSizeHelper, "get_size") as get_size:
+            size, stale = calculate_resource_size(self.root)
+            get_size.assert_not_called()
+        self.assertEqual(10, size)
+        self.assertFalse(stale)
+
+    def test_cached__files_modified(self):
+        calculate_resource_size(self.root)
+        file = File.objects.filter(contentnode__tree_id=self.root.tree_id).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            file.delete()
+        with mock.patch.object(ResourceSizeHelper, "get_size", return_value=5) as get_size:
+            size, stale = calculate_resource_size(self.root)
+            get_size.assert_called_once()
+        self.assertEqual(5, size)
+        self.assertFalse(stale)
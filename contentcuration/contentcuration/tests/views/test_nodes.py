@@ -1,15 +1,12 @@
-import datetime
 import json
 
-import pytz
-from django.conf import settings
-from django.core.cache import cache
 from django.urls import reverse
 from mock import Mock
 from mock import patch
 
 from contentcuration.tasks import generatenodediff_task
 from contentcuration.tests.base import BaseAPITestCase
+from contentcuration.utils.cache import TreeRevisionCache
 
 
 class NodesViewsTestCase(BaseAPITestCase):
@@ -42,18 +39,19 @@ class NodesViewsTestCase(BaseAPITestCase):
         assert len(details['kind_count']) > 0
 
     def test_get_channel_details_cached(self):
-        cache_key = "details_{}".format(self.channel.main_tree.id)
+        main_tree = self.channel.main_tree
+        data = {"resource_count": -1}
+        TreeRevisionCache(main_tree.tree_id).set("details_{}".format(main_tree.node_id), json.dumps(data))
 
-        # force the cache to update by adding a very old cache entry. Since Celery tasks run sync in the test suite,
-        # get_channel_details will return an updated cache value rather than generate it async.
-        data = {"last_update": pytz.utc.localize(datetime.datetime(1990, 1, 1)).strftime(settings.DATE_TIME_FORMAT)}
-        cache.set(cache_key, json.dumps(data))
+        url = reverse('get_channel_details', kwargs={"channel_id": self.channel.id})
+        response = self.get(url)
+        self.assertEqual(data, json.loads(response.content))
 
-        with patch("contentcuration.views.nodes.getnodedetails_task") as task_mock:
-            url = reverse('get_channel_details', kwargs={"channel_id": self.channel.id})
-            self.get(url)
-            # Check that the outdated cache prompts an asynchronous cache update
-            task_mock.enqueue.assert_called_once_with(self.user, node_id=self.channel.main_tree.id)
+        # Changing a node of the tree bumps its revision, so the details are recalculated
+        with self.captureOnCommitCallbacks(execute=True):
+            main_tree.get_descendants().first().save()
+        response = self.get(url)
+        self.assertGreater(json.loads(response.content)["resource_count"], 0)
 
 
 class ChannelDetailsEndpointTestCase(BaseAPITestCase):
@@ -200,6 +200,42 @@ class ApiAddNodesToTreeTestCase(StudioTestCase):
                 values[0]: True
             })
 
+    def test_creates_nodes_in_order(self):
+        source_channel = channel()
+        source_video = source_channel.main_tree.get_descendants().filter(kind_id=content_kinds.VIDEO).first()
+        remote_node = self._make_node_data()
+        remote_node.update({
+            "source_channel_id": source_channel.id,
+            "source_node_id": source_video.node_id,
+            "source_content_id": source_video.content_id,
+        })
+        content_data = [self._make_node_data(), self._make_node_data(), remote_node, self._make_node_data()]
+
+        response = self.admin_client().post(
+            reverse_lazy("api_add_nodes_to_tree"),
+            data={"root_id": self.root_node.id, "content_data": content_data},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.root_node.refresh_from_db()
+        children = list(self.root_node.get_children())
+        self.assertEqual(
+            [response.json()["root_ids"][node_data["node_id"]] for node_data in content_data],
+            [child.id for child in children[-len(content_data):]],
+        )
+        # The children are siblings with consecutive lft and rght values
+        for previous, child in zip(children, children[1:]):
+            self.assertEqual(previous.rght + 1, child.lft)
+        self.assertEqual(children[-1].rght + 1, self.root_node.rght)
+        for child in children[-len(content_data):]:
+            self.assertEqual(
+                {"oer", "edtech"},
+                set(child.tags.filter(channel=self.channel).values_list("tag_name", flat=True)),
+            )
+            self.assertTrue(child.files.exists())
+        self.assertEqual(1, self.channel.tags.filter(tag_name="oer").count())
+
     @skipIf(True, "Disable until we mark nodes as incomplete rather than just warn")
     def test_invalid_nodes_are_not_complete(self):
         node_0 = ContentNode.objects.get(title=self.title)
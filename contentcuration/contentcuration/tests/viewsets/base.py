@@ -4,6 +4,7 @@ from django.urls import reverse
 
 from contentcuration.celery import app
 from contentcuration.models import Change
+from contentcuration.tests.helpers import clear_change_streams
 from contentcuration.tests.helpers import clear_tasks
 from contentcuration.viewsets.sync.constants import CHANNEL
 from contentcuration.viewsets.sync.constants import SYNCED
@@ -12,6 +13,7 @@ from contentcuration.viewsets.sync.utils import generate_copy_event as base_gene
 from contentcuration.viewsets.sync.utils import generate_create_event as base_generate_create_event
 from contentcuration.viewsets.sync.utils import generate_delete_event as base_generate_delete_event
 from contentcuration.viewsets.sync.utils import generate_deploy_event as base_generate_deploy_event
+from contentcuration.viewsets.sync.utils import generate_move_event as base_generate_move_event
 from contentcuration.viewsets.sync.utils import generate_update_event as base_generate_update_event
 
 
@@ -33,6 +35,12 @@ def generate_delete_event(*args, **kwargs):
     return event
 
 
+def generate_move_event(*args, **kwargs):
+    event = base_generate_move_event(*args, **kwargs)
+    event["rev"] = random.randint(1, 10000000)
+    return event
+
+
 def generate_update_event(*args, **kwargs):
     event = base_generate_update_event(*args, **kwargs)
     event["rev"] = random.randint(1, 10000000)
@@ -68,6 +76,7 @@ class SyncTestMixin(object):
     def setUp(self):
         super(SyncTestMixin, self).setUp()
         clear_tasks()
+        clear_change_streams()
 
     @classmethod
     def tearDownClass(cls):
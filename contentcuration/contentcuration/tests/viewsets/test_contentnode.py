@@ -27,6 +27,7 @@ from contentcuration.tests.base import StudioAPITestCase
 from contentcuration.tests.viewsets.base import generate_copy_event
 from contentcuration.tests.viewsets.base import generate_create_event
 from contentcuration.tests.viewsets.base import generate_delete_event
+from contentcuration.tests.viewsets.base import generate_move_event
 from contentcuration.tests.viewsets.base import generate_update_event
 from contentcuration.tests.viewsets.base import SyncTestMixin
 from contentcuration.utils.db_tools import TreeBuilder
@@ -1115,6 +1116,27 @@ class SyncTestCase(SyncTestMixin, StudioAPITestCase):
         except models.ContentNode.DoesNotExist:
             self.fail("ContentNode 2 was deleted")
 
+    def test_move_contentnodes(self):
+        first, last = self.channel.main_tree.get_children().first(), self.channel.main_tree.get_children().last()
+        other_channel = testdata.channel()
+
+        response = self.sync_changes(
+            [
+                generate_move_event(last.id, CONTENTNODE, first.id, "left", channel_id=self.channel.id),
+                generate_move_event(first.id, CONTENTNODE, first.id, "last-child", channel_id=self.channel.id),
+                generate_move_event(first.id, CONTENTNODE, last.id, "first-child", channel_id=self.channel.id),
+                # The user can't edit the other channel
+                generate_move_event(last.id, CONTENTNODE, other_channel.main_tree_id, "last-child", channel_id=self.channel.id),
+            ],
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+        self.assertEqual(last.id, self.channel.main_tree.get_children().first().id)
+        self.assertEqual(last.id, models.ContentNode.objects.get(id=first.id).parent_id)
+        self.assertEqual(self.channel.main_tree.tree_id, models.ContentNode.objects.get(id=last.id).tree_id)
+        errored = models.Change.objects.filter(channel=self.channel, errored=True).order_by("server_rev")
+        self.assertEqual([first.id, last.id], [change.kwargs["key"] for change in errored])
+
     def test_copy_contentnode(self):
         self.channel.editors.add(self.user)
         contentnode = models.ContentNode.objects.create(**self.contentnode_db_metadata)
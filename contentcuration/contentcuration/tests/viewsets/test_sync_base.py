@@ -0,0 +1,132 @@
+from __future__ import absolute_import
+
+import uuid
+
+import mock
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from contentcuration import models
+from contentcuration.tests import testdata
+from contentcuration.tests.base import StudioTestCase
+from contentcuration.viewsets.sync.base import apply_changes
+from contentcuration.viewsets.sync.base import get_change_runs
+from contentcuration.viewsets.sync.constants import CHANNEL
+from contentcuration.viewsets.sync.constants import CONTENTNODE
+from contentcuration.viewsets.sync.constants import MOVED
+from contentcuration.viewsets.sync.utils import generate_delete_event
+from contentcuration.viewsets.sync.utils import generate_update_event
+
+
+class ApplyChangesTestCase(StudioTestCase):
+
+    def setUp(self):
+        super(ApplyChangesTestCase, self).setUp()
+        self.channel = testdata.channel()
+        self.user = testdata.user()
+        self.channel.editors.add(self.user)
+        self.nodes = list(self.channel.main_tree.get_descendants())
+
+    def create_changes(self, events):
+        return models.Change.create_changes(events, created_by_id=self.user.id)
+
+    def update_title_events(self, nodes, title="Updated"):
+        return [
+            generate_update_event(node.id, CONTENTNODE, {"title": title}, channel_id=self.channel.id)
+            for node in nodes
+        ]
+
+    def test_get_change_runs(self):
+        node1, node2 = self.nodes[:2]
+        changes = self.create_changes(
+            self.update_title_events([node1, node2])
+            # A second change to an object starts a new run
+            + self.update_title_events([node1])
+            + [generate_delete_event(node2.id, CONTENTNODE, channel_id=self.channel.id)]
+        )
+        moves = self.create_changes(
+            [generate_update_event(node1.id, CONTENTNODE, {}, channel_id=self.channel.id) for _i in range(2)]
+        )
+        for move in moves:
+            move.change_type = MOVED
+
+        runs = list(get_change_runs(changes + moves))
+        self.assertEqual([[changes[0], changes[1]], [changes[2]], [changes[3]], [moves[0]], [moves[1]]], runs)
+
+    def test_apply_changes_in_batches(self):
+        nodes = self.nodes[:5]
+        self.create_changes(self.update_title_events(nodes))
+        changes = models.Change.objects.filter(channel=self.channel)
+
+        with CaptureQueriesContext(connection) as batched:
+            apply_changes(changes)
+
+        self.assertTrue(all(change.applied and not change.errored for change in changes))
+        for node in nodes:
+            node.refresh_from_db()
+            self.assertEqual("Updated", node.title)
+
+        # Compare with the queries made when the changes are applied one at a time
+        models.Change.objects.all().delete()
+        for event in self.update_title_events(nodes, title="Updated again"):
+            self.create_changes([event])
+        with CaptureQueriesContext(connection) as individual:
+            for change in models.Change.objects.filter(channel=self.channel).order_by("server_rev"):
+                apply_changes(models.Change.objects.filter(pk=change.pk))
+        self.assertLess(len(batched), len(individual))
+
+    def test_apply_changes_records_errors_of_each_change(self):
+        node = self.nodes[0]
+        self.create_changes(
+            self.update_title_events([node])
+            + [generate_update_event(uuid.uuid4().hex, CONTENTNODE, {"title": "Updated"}, channel_id=self.channel.id)]
+        )
+        applied, errored = models.Change.objects.filter(channel=self.channel).order_by("server_rev")
+
+        apply_changes(models.Change.objects.filter(channel=self.channel))
+
+        applied.refresh_from_db()
+        errored.refresh_from_db()
+        self.assertTrue(applied.applied)
+        self.assertFalse(applied.errored)
+        self.assertTrue(errored.errored)
+        self.assertFalse(errored.applied)
+        self.assertIn("errors", errored.kwargs)
+
+    def test_apply_changes_rolls_back_only_the_changes_that_fail(self):
+        other_channel = testdata.channel()
+        other_channel.editors.add(self.user)
+        self.create_changes([
+            generate_update_event(self.channel.id, CHANNEL, {"name": "Renamed"}, channel_id=self.channel.id),
+            generate_update_event(other_channel.id, CHANNEL, {"name": "Renamed"}, channel_id=other_channel.id),
+        ])
+        applied, errored = models.Change.objects.filter(table=CHANNEL).order_by("server_rev")
+        save = models.Channel.save
+
+        def failing_save(channel, *args, **kwargs):
+            if channel.id == other_channel.id:
+                # violates the NOT NULL constraint of the column, rather than failing validation
+                channel.name = None
+            return save(channel, *args, **kwargs)
+
+        with mock.patch.object(models.Channel, "save", autospec=True, side_effect=failing_save):
+            apply_changes(models.Change.objects.filter(table=CHANNEL))
+
+        applied.refresh_from_db()
+        errored.refresh_from_db()
+        self.channel.refresh_from_db()
+        self.assertTrue(applied.applied)
+        self.assertFalse(applied.errored)
+        self.assertEqual("Renamed", self.channel.name)
+        self.assertTrue(errored.errored)
+        self.assertFalse(errored.applied)
+
+    def test_apply_changes_leaves_changes_without_handler(self):
+        self.create_changes(self.update_title_events(self.nodes[:1]))
+
+        with mock.patch.dict("contentcuration.viewsets.sync.base.event_handlers", clear=True):
+            apply_changes(models.Change.objects.filter(channel=self.channel))
+
+        change = models.Change.objects.get(channel=self.channel)
+        self.assertFalse(change.applied)
+        self.assertFalse(change.errored)
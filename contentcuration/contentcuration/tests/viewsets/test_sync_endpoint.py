@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+
+import uuid
+
+from celery import states
+from django.test import override_settings
+from django_celery_results.models import TaskResult
+
+from contentcuration import models
+from contentcuration.tests import testdata
+from contentcuration.tests.base import StudioAPITestCase
+from contentcuration.tests.viewsets.base import generate_update_event
+from contentcuration.tests.viewsets.base import SyncTestMixin
+from contentcuration.utils.celery.status import remove_task_statuses
+from contentcuration.utils.celery.status import set_task_progress
+from contentcuration.viewsets.sync.constants import CHANNEL
+
+
+class PaginatedSyncTestCase(SyncTestMixin, StudioAPITestCase):
+
+    def setUp(self):
+        super(PaginatedSyncTestCase, self).setUp()
+        self.channel = testdata.channel()
+        self.user = testdata.user()
+        self.channel.editors.add(self.user)
+        self.client.force_authenticate(user=self.user)
+        self.server_rev = models.Change.objects.order_by("-server_rev").values_list("server_rev", flat=True).first() or 0
+        self.changes = [
+            models.Change.create_change(
+                generate_update_event(self.channel.id, CHANNEL, {"name": "Updated {}".format(i)}, channel_id=self.channel.id), applied=True
+            )
+            for i in range(5)
+        ]
+
+    def pull_changes(self):
+        """
+        Pulls changes from the sync endpoint until there is no next_rev, returns the server_revs of each response
+        """
+        pages = []
+        rev = self.server_rev
+        while rev is not None:
+            response = self.client.post(
+                self.sync_url,
+                {"channel_revs": {self.channel.id: rev}, "user_rev": rev},
+                format="json",
+            )
+            self.assertEqual(response.status_code, 200, response.content)
+            data = response.json()
+            pages.append([c["server_rev"] for c in data["changes"] + data["successes"]])
+            rev = data["next_rev"]
+            if rev is not None:
+                self.assertEqual(pages[-1][-1], rev)
+        return pages
+
+    @override_settings(SYNC_MAX_CHANGES_PER_RESPONSE=2)
+    def test_changes_limited_per_response(self):
+        revs = [c.server_rev for c in self.changes]
+        self.assertEqual([revs[:2], revs[2:4], revs[4:]], self.pull_changes())
+
+    @override_settings(SYNC_MAX_RESPONSE_BYTES=1)
+    def test_response_size_limited(self):
+        # At least one change is always returned
+        self.assertEqual([[c.server_rev] for c in self.changes], self.pull_changes())
+
+    def test_all_changes_returned(self):
+        self.assertEqual([[c.server_rev for c in self.changes]], self.pull_changes())
+
+
+class TaskStatusSyncTestCase(SyncTestMixin, StudioAPITestCase):
+
+    def setUp(self):
+        super(TaskStatusSyncTestCase, self).setUp()
+        self.channel = testdata.channel()
+        self.user = testdata.user()
+        self.channel.editors.add(self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def create_task(self, status, task_name="export-channel"):
+        task_id = uuid.uuid4().hex
+        TaskResult.objects.create(task_id=task_id, status=status, task_name=task_name)
+        models.CustomTaskMetadata.objects.create(task_id=task_id, channel_id=self.channel.id, user=self.user, progress=10)
+        return task_id
+
+    def get_tasks(self):
+        response = self.client.post(self.sync_url, {"channel_revs": {self.channel.id: 0}, "user_rev": 0}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return {task["task_id"]: task for task in response.json()["tasks"]}
+
+    def test_tasks_cached(self):
+        started_id = self.create_task(states.STARTED)
+        failed_id = self.create_task(states.FAILURE)
+        self.create_task(states.SUCCESS)
+        self.create_task(states.STARTED, task_name="apply_channel_changes")
+
+        tasks = self.get_tasks()
+        self.assertEqual({started_id, failed_id}, set(tasks))
+        self.assertEqual(10, tasks[started_id]["progress"])
+        self.assertEqual(self.channel.id, uuid.UUID(tasks[started_id]["channel_id"]).hex)
+
+        # Later polls are answered from the cache
+        TaskResult.objects.all().delete()
+        set_task_progress(started_id, self.channel.id, 50)
+        tasks = self.get_tasks()
+        self.assertEqual(50, tasks[started_id]["progress"])
+        self.assertEqual(states.FAILURE, tasks[failed_id]["status"])
+
+        remove_task_statuses(self.channel.id, [started_id, failed_id])
+        self.assertEqual({}, self.get_tasks())
+
+    @override_settings(SYNC_TASK_STATUS_TIMEOUT=0)
+    def test_tasks_not_cached(self):
+        task_id = self.create_task(states.STARTED)
+        self.assertEqual({task_id}, set(self.get_tasks()))
+        TaskResult.objects.all().delete()
+        self.assertEqual({}, self.get_tasks())
@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+
+import mock
+from django.test import override_settings
+from django_redis import get_redis_connection
+
+from contentcuration import models
+from contentcuration.tests import testdata
+from contentcuration.tests.base import StudioTestCase
+from contentcuration.viewsets.sync import base as sync_base
+from contentcuration.viewsets.sync.constants import CONTENTNODE
+from contentcuration.viewsets.sync.scheduler import ChangeLease
+from contentcuration.viewsets.sync.scheduler import drain_changes
+from contentcuration.viewsets.sync.scheduler import get_channel_lease_key
+from contentcuration.viewsets.sync.scheduler import release_stale_lease
+from contentcuration.viewsets.sync.scheduler import schedule_changes
+from contentcuration.viewsets.sync.utils import generate_update_event
+
+
+def mock_task(task_id="task"):
+    task = mock.Mock()
+    task.app.conf.task_always_eager = False
+    task.request.id = task_id
+    return task
+
+
+class ChangeSchedulerTestCase(StudioTestCase):
+
+    def setUp(self):
+        super(ChangeSchedulerTestCase, self).setUp()
+        redis = get_redis_connection("default")
+        keys = list(redis.scan_iter("sync:apply:*"))
+        if keys:
+            redis.delete(*keys)
+        self.channel = testdata.channel()
+        self.user = testdata.user()
+        self.channel.editors.add(self.user)
+        self.lease_key = get_channel_lease_key(self.channel.id)
+        self.nodes = list(self.channel.main_tree.get_descendants())
+
+    def create_changes(self, count):
+        models.Change.create_changes(
+            [
+                generate_update_event(node.id, CONTENTNODE, {"title": "Updated"}, channel_id=self.channel.id)
+                for node in self.nodes[:count]
+            ],
+            created_by_id=self.user.id,
+        )
+        return models.Change.objects.filter(channel=self.channel, applied=False, errored=False)
+
+    def test_lease(self):
+        lease = ChangeLease(self.lease_key, "first")
+        self.assertTrue(lease.acquire())
+        self.assertFalse(ChangeLease(self.lease_key, "second").acquire())
+
+        self.assertTrue(lease.transfer("second"))
+        self.assertEqual("second", lease.get_holder())
+        self.assertFalse(ChangeLease(self.lease_key, "first").release())
+
+        self.assertTrue(lease.release())
+        self.assertIsNone(lease.get_holder())
+
+    def test_schedule_changes_enqueues_once(self):
+        task = mock_task()
+        schedule_changes(task, self.user, self.lease_key, channel_id=self.channel.id)
+        schedule_changes(task, self.user, self.lease_key, channel_id=self.channel.id)
+
+        task.enqueue.assert_called_once()
+        task_id = task.enqueue.call_args[1]["task_id"]
+        self.assertEqual(task_id, ChangeLease(self.lease_key, None).get_holder())
+
+    def test_release_stale_lease(self):
+        ChangeLease(self.lease_key, "stale").acquire()
+        self.assertFalse(release_stale_lease(self.lease_key, ["stale"]))
+        self.assertTrue(release_stale_lease(self.lease_key, ["other"]))
+        self.assertIsNone(ChangeLease(self.lease_key, None).get_holder())
+
+    @override_settings(SYNC_APPLY_BATCH_SIZE=2)
+    def test_drain_changes(self):
+        changes = self.create_changes(5)
+        task = mock_task()
+
+        drain_changes(task, changes, self.lease_key)
+
+        self.assertFalse(changes.exists())
+        self.assertFalse(models.Change.objects.filter(channel=self.channel, errored=True).exists())
+        self.assertEqual(5, models.ContentNode.objects.filter(tree_id=self.channel.main_tree.tree_id, title="Updated").count())
+        self.assertIsNone(ChangeLease(self.lease_key, None).get_holder())
+        task.requeue.assert_not_called()
+
+    def test_drain_changes_lease_held(self):
+        changes = self.create_changes(2)
+        ChangeLease(self.lease_key, "other").acquire()
+
+        drain_changes(mock_task(), changes, self.lease_key)
+
+        self.assertEqual(2, changes.count())
+        self.assertEqual("other", ChangeLease(self.lease_key, None).get_holder())
+
+    @override_settings(SYNC_APPLY_BATCH_SIZE=2, SYNC_APPLY_TIME_SLICE=-1)
+    def test_drain_changes_hands_over(self):
+        changes = self.create_changes(5)
+        task = mock_task()
+
+        drain_changes(task, changes, self.lease_key)
+
+        self.assertEqual(3, changes.count())
+        task.requeue.assert_called_once()
+        self.assertEqual(task.requeue.call_args[1]["task_id"], ChangeLease(self.lease_key, None).get_holder())
+
+    def test_drain_changes_releases_lease_on_failure(self):
+        changes = self.create_changes(2)
+
+        with mock.patch("contentcuration.viewsets.sync.base.apply_changes", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                drain_changes(mock_task(), changes, self.lease_key)
+
+        self.assertEqual(2, changes.count())
+        self.assertIsNone(ChangeLease(self.lease_key, None).get_holder())
+
+    @override_settings(SYNC_APPLY_LEASE_TIMEOUT=10)
+    def test_lease_is_short(self):
+        lease = ChangeLease(self.lease_key, "first")
+        lease.acquire()
+        self.assertLessEqual(get_redis_connection("default").pttl(self.lease_key), 10 * 1000)
+
+    @mock.patch("contentcuration.viewsets.sync.base.APPLY_CHANGES_BATCH_SIZE", 1)
+    def test_drain_changes_stops_when_lease_lost(self):
+        changes = self.create_changes(2)
+        apply_change_run = sync_base._apply_change_run
+
+        def take_over_lease(run):
+            apply_change_run(run)
+            # The lease expired while the run was applied, and another task took it
+            redis = get_redis_connection("default")
+            redis.set(self.lease_key, "other")
+
+        with mock.patch("contentcuration.viewsets.sync.base._apply_change_run", side_effect=take_over_lease):
+            drain_changes(mock_task(), changes, self.lease_key)
+
+        self.assertEqual(1, changes.count())
+        self.assertEqual("other", ChangeLease(self.lease_key, None).get_holder())
@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+
+from django.test import override_settings
+
+from contentcuration import models
+from contentcuration.tests import testdata
+from contentcuration.tests.base import StudioAPITestCase
+from contentcuration.tests.viewsets.base import generate_update_event
+from contentcuration.tests.viewsets.base import SyncTestMixin
+from contentcuration.viewsets.sync.constants import CHANNEL
+from contentcuration.viewsets.sync.stream import get_change_stream_stats
+from contentcuration.viewsets.sync.stream import get_stream_changes
+
+
+@override_settings(SYNC_CHANGE_STREAM_SIZE=3)
+class ChangeStreamTestCase(SyncTestMixin, StudioAPITestCase):
+
+    def setUp(self):
+        super(ChangeStreamTestCase, self).setUp()
+        self.channel = testdata.channel()
+        self.user = testdata.user()
+        self.channel.editors.add(self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def apply_change(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return models.Change.create_change(
+                generate_update_event(self.channel.id, CHANNEL, {"name": name}, channel_id=self.channel.id),
+                created_by_id=self.user.id,
+                applied=True,
+            )
+
+    def get_stream_changes(self, rev):
+        return get_stream_changes(self.user.id, 0, {self.channel.id: rev})
+
+    def test_changes_served_from_stream(self):
+        first = self.apply_change("First")
+        second = self.apply_change("Second")
+
+        changes = self.get_stream_changes(first.server_rev)
+
+        self.assertEqual([second.server_rev], [c["server_rev"] for c in changes])
+        self.assertEqual({"name": "Second"}, changes[0]["kwargs"]["mods"])
+        self.assertEqual(self.channel.id, changes[0]["channel_id"])
+        self.assertTrue(changes[0]["applied"])
+
+    def test_changes_before_stream_not_served(self):
+        # Changes made while the stream was disabled aren't in it
+        with override_settings(SYNC_CHANGE_STREAM_SIZE=0):
+            first = self.apply_change("First")
+        self.apply_change("Second")
+
+        self.assertIsNone(self.get_stream_changes(first.server_rev - 1))
+        self.assertIsNotNone(self.get_stream_changes(first.server_rev))
+
+    def test_trimmed_changes_not_served(self):
+        changes = [self.apply_change("Change {}".format(i)) for i in range(5)]
+
+        self.assertIsNone(self.get_stream_changes(changes[0].server_rev - 1))
+        served = self.get_stream_changes(changes[1].server_rev)
+        self.assertEqual([c.server_rev for c in changes[2:]], [c["server_rev"] for c in served])
+
+    def test_unapplied_revs_covered(self):
+        first = self.apply_change("First")
+        second = self.apply_change("Second")
+
+        changes = get_stream_changes(self.user.id, 0, {self.channel.id: second.server_rev}, unapplied_revs=[first.server_rev])
+        self.assertEqual([first.server_rev], [c["server_rev"] for c in changes])
+
+    def test_sync_response_matches_database(self):
+        first = self.apply_change("First")
+        self.apply_change("Second")
+        data = {"channel_revs": {self.channel.id: first.server_rev}, "user_rev": 0}
+
+        response = self.client.post(self.sync_url, data, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        with override_settings(SYNC_CHANGE_STREAM_SIZE=0):
+            db_response = self.client.post(self.sync_url, data, format="json")
+        self.assertEqual(db_response.json(), response.json())
+
+        stats = get_change_stream_stats(channel_ids=[self.channel.id])
+        self.assertGreater(stats["hits"], 0)
+        self.assertEqual(2, stats["streams"]["sync:stream:channel:{}".format(self.channel.id)]["length"])
@@ -6,6 +6,9 @@ from datetime import datetime
 
 from dateutil.parser import isoparse
 from django.core.cache import cache as django_cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django_redis.client import DefaultClient
 from django_redis.client.default import _main_exceptions
 
@@ -105,11 +108,155 @@ def delete_public_channel_cache_keys():
     """
     from contentcuration.views.base import PUBLIC_CHANNELS_CACHE_KEYS
 
+    bump_revisions(PUBLIC_CHANNELS_REVISION)
     delete_cache_keys("*get_public_channel_list*")
     delete_cache_keys("*get_user_public_channels*")
     django_cache.delete_many(list(PUBLIC_CHANNELS_CACHE_KEYS.values()))
 
 
+REVISION_KEY = "revision:{}"
+# Values cached for a revision are never read once it is bumped, so they only need to live long enough to be reused
+REVISION_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+PUBLIC_CHANNELS_REVISION = "public_channels"
+
+
+def get_tree_revision_name(tree_id):
+    return "tree:{}".format(tree_id)
+
+
+def _init_revision(key, cache):
+    # Start counting from the current time in milliseconds, rather than zero, so that revisions keep
+    # increasing if the counter is evicted, and values cached for earlier revisions are never read again
+    cache.add(key, int(time.time() * 1000), timeout=None)
+
+
+def get_revision(name, cache=None):
+    """
+    Returns the current revision of the data named `name`, which increases whenever it changes
+    """
+    cache = cache or django_cache
+    key = REVISION_KEY.format(name)
+    revision = cache.get(key)
+    if revision is None:
+        _init_revision(key, cache)
+        revision = cache.get(key)
+    return revision
+
+
+def _bump_revisions(names, cache=None):
+    cache = cache or django_cache
+    for name in names:
+        key = REVISION_KEY.format(name)
+        _init_revision(key, cache)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The counter was evicted in between, so reading it again starts a higher revision anyway
+            pass
+
+
+class _PendingRevisions(object):
+    """
+    The names of the revisions to bump once the current transaction of a connection commits
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.names = set()
+        # Django replaces the list of commit callbacks whenever it drops callbacks from it
+        self.callbacks = None
+        self.done = False
+
+    def is_queued(self):
+        return not self.done and self.connection.in_atomic_block and self.callbacks is self.connection.run_on_commit
+
+    def bump(self):
+        self.done = True
+        _bump_revisions(sorted(self.names))
+
+
+def bump_revisions(*names):
+    """
+    Increments the revisions of the data named `names` once the current transaction commits, so that
+    a value can't be derived from the data before the change and cached for the new revision.
+    The names are collected for each transaction, so that each revision is bumped once when it commits.
+    """
+    if not names:
+        return
+    connection = transaction.get_connection()
+    pending = getattr(connection, "pending_revisions", None)
+    if pending is not None and pending.is_queued():
+        pending.names.update(names)
+        return
+    pending = _PendingRevisions(connection)
+    pending.names.update(names)
+    connection.pending_revisions = pending
+    transaction.on_commit(pending.bump)
+    pending.callbacks = connection.run_on_commit
+
+
+def bump_tree_revisions(*tree_ids):
+    """
+    Increments the revisions of the ContentNode trees `tree_ids`, for a change to their nodes,
+    or the files and assessment items of their nodes
+    """
+    bump_revisions(*(get_tree_revision_name(tree_id) for tree_id in tree_ids if tree_id is not None))
+
+
+class RevisionCache:
+    """
+    Helper class for caching values derived from the data named `name`, keyed on its revision,
+    so that cached values can be read without checking whether the data has changed since.
+
+    The revision is read once, before anything is derived, so a value derived while the data
+    is changed is cached for the revision it was derived from, which the change has already bumped.
+    """
+
+    def __init__(self, name, cache=None, timeout=REVISION_CACHE_TIMEOUT):
+        self.name = name
+        self.cache = cache or django_cache
+        self.timeout = timeout
+
+    @cached_property
+    def revision(self):
+        return get_revision(self.name, cache=self.cache)
+
+    @property
+    def version(self):
+        """
+        A string identifying the revision, to store alongside values cached elsewhere
+        """
+        return "{}:{}".format(self.name, self.revision)
+
+    def key(self, key):
+        return "{}:{}".format(self.version, key)
+
+    def get(self, key, default=None):
+        return self.cache.get(self.key(key), default)
+
+    def set(self, key, value):
+        return self.cache.set(self.key(key), value, self.timeout)
+
+    def get_or_set(self, key, func):
+        """
+        Returns the value cached for `key`, or caches and returns the value returned by `func`
+        """
+        value = self.get(key)
+        if value is None:
+            value = func()
+            self.set(key, value)
+        return value
+
+
+class TreeRevisionCache(RevisionCache):
+    """
+    Helper class for caching values derived from the nodes of a ContentNode tree
+    """
+
+    def __init__(self, tree_id, **kwargs):
+        super(TreeRevisionCache, self).__init__(get_tree_revision_name(tree_id), **kwargs)
+
+
 def redis_retry(func):
     """
     This decorator wraps a function using the lower level Redis client to mimic functionality
@@ -127,6 +274,43 @@ def redis_retry(func):
     return redis_retry_func
 
 
+FILES_MODIFIED_KEY = "files_modified:{}"
+
+
+def get_files_modified(tree_id, cache=None):
+    """
+    Returns a watermark of when the files counted towards the resource sizes of the nodes of the tree
+    were last modified, which is never earlier than the modifications. If it isn't known, the files
+    are assumed to be modified now.
+
+    :rtype: datetime
+    """
+    cache = cache or django_cache
+    key = FILES_MODIFIED_KEY.format(tree_id)
+    modified = cache.get(key)
+    if modified is None:
+        modified = timezone.now()
+        cache.add(key, modified.isoformat(), timeout=None)
+        return modified
+    return isoparse(modified)
+
+
+def _set_files_modified(tree_ids, cache=None):
+    cache = cache or django_cache
+    modified = timezone.now().isoformat()
+    cache.set_many({FILES_MODIFIED_KEY.format(tree_id): modified for tree_id in tree_ids}, timeout=None)
+
+
+def mark_files_modified(*tree_ids):
+    """
+    Moves the files modified watermark of the trees `tree_ids` to when the current transaction commits,
+    for a change to the files of their nodes, or to which of their nodes are counted
+    """
+    tree_ids = sorted(set(tree_id for tree_id in tree_ids if tree_id is not None))
+    if tree_ids:
+        transaction.on_commit(functools.partial(_set_files_modified, tree_ids))
+
+
 FILE_MODIFIED = -1
 
 
@@ -179,6 +363,10 @@ class ResourceSizeCache:
     def modified_key(self):
         return "{}:modified".format(self.node.pk)
 
+    @property
+    def version_key(self):
+        return "{}:version".format(self.node.pk)
+
     @redis_retry
     def cache_get(self, key):
         if self.redis_client is not None:
@@ -206,12 +394,22 @@ class ResourceSizeCache:
         modified = self.cache_get(self.modified_key)
         return isoparse(modified) if modified is not None else modified
 
+    def get_version(self):
+        version = self.cache_get(self.version_key)
+        return version.decode("utf-8") if isinstance(version, bytes) else version
+
     def set_size(self, size):
         return self.cache_set(self.size_key, size)
 
     def set_modified(self, modified):
         return self.cache_set(self.modified_key, modified.isoformat() if isinstance(modified, datetime) else modified)
 
+    def set_version(self, version):
+        """
+        :param version: The `RevisionCache.version` of the node's tree the size was calculated for
+        """
+        return self.cache_set(self.version_key, version)
+
     def reset_modified(self, modified):
         """
         Sets modified if it's less than the existing, otherwise sets None if not a datetime
@@ -0,0 +1,199 @@
+"""
+A cache of the status of the tasks of each channel, for the sync endpoint.
+
+The tasks of a channel that have started or failed are kept in a Redis hash, which tasks update as they
+start, progress, fail and finish. A marker field is added to the hash once it has been populated from the
+database, so that sync requests only query the database for channels whose hash has no marker. A task that
+finishes leaves a tombstone in the hash, so that a status read from the database before it finished isn't
+cached after it. The hash expires `SYNC_TASK_STATUS_TIMEOUT` seconds after it was populated, or after it
+was first written if it never was, which bounds how long it can disagree with the database.
+"""
+import json
+import logging
+import uuid
+
+from celery import states
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+
+POPULATED_FIELD = "populated"
+
+PROGRESS_SUFFIX = ":progress"
+
+REMOVED_SUFFIX = ":removed"
+
+# Only updates the progress of tasks that are still in the hash
+PROGRESS_SCRIPT = """
+if redis.call("hexists", KEYS[1], ARGV[1]) == 1 then
+    redis.call("hset", KEYS[1], ARGV[1] .. ARGV[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Only sets the status and progress of tasks that haven't been removed,
+# without overwriting statuses and progress that tasks have written
+POPULATE_SCRIPT = """
+if redis.call("hexists", KEYS[1], ARGV[1] .. ARGV[2]) == 1 then
+    return 0
+end
+redis.call("hsetnx", KEYS[1], ARGV[1], ARGV[4])
+if ARGV[5] ~= "" then
+    redis.call("hsetnx", KEYS[1], ARGV[1] .. ARGV[3], ARGV[5])
+end
+return 1
+"""
+
+# Only sets the expiry of hashes that have none, so that writes don't keep a hash from expiring
+EXPIRE_SCRIPT = """
+if redis.call("ttl", KEYS[1]) == -1 then
+    return redis.call("expire", KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+
+def get_channel_tasks_key(channel_id):
+    return "sync:tasks:channel:{}".format(channel_id)
+
+
+def _get_channel_id(channel_id):
+    return uuid.UUID(str(channel_id)).hex if channel_id else None
+
+
+def _get_task_status(task_id, task_name, channel_id, status, traceback=None, progress=None):
+    return {
+        "task_id": task_id,
+        "task_name": task_name,
+        "traceback": traceback,
+        "progress": progress,
+        # Formatted as the channel ids read from the database are serialized
+        "channel_id": str(uuid.UUID(channel_id)),
+        "status": status,
+    }
+
+
+def _write(func, channel_id):
+    timeout = settings.SYNC_TASK_STATUS_TIMEOUT
+    channel_id = _get_channel_id(channel_id)
+    if not timeout or not channel_id:
+        return
+    key = get_channel_tasks_key(channel_id)
+    try:
+        pipeline = get_redis_connection("default").pipeline(transaction=True)
+        func(pipeline, key, channel_id)
+        pipeline.eval(EXPIRE_SCRIPT, 1, key, timeout)
+        pipeline.execute()
+    except RedisError as e:
+        logging.warning("Unable to update the task status cache: {}".format(e))
+        # Remove the hash rather than leave it out of date, so that it is populated from the database again
+        try:
+            get_redis_connection("default").delete(key)
+        except RedisError:
+            pass
+
+
+def set_task_status(task_id, task_name, channel_id, status, traceback=None, progress=None):
+    """
+    Caches the status of a task of a channel that has started or failed
+    """
+    def write(pipeline, key, channel_id):
+        task_status = _get_task_status(task_id, task_name, channel_id, status, traceback=traceback)
+        # A task that is retried is started again with the same id
+        pipeline.hdel(key, task_id + REMOVED_SUFFIX)
+        pipeline.hset(key, task_id, json.dumps(task_status))
+        if progress is not None:
+            pipeline.hset(key, task_id + PROGRESS_SUFFIX, progress)
+
+    _write(write, channel_id)
+
+
+def set_task_progress(task_id, channel_id, progress):
+    """
+    Updates the progress of a task of a channel, if its status is cached
+    """
+    def write(pipeline, key, channel_id):
+        pipeline.eval(PROGRESS_SCRIPT, 1, key, task_id, PROGRESS_SUFFIX, progress)
+
+    _write(write, channel_id)
+
+
+def remove_task_statuses(channel_id, task_ids):
+    """
+    Removes tasks of a channel from the cache, once they are no longer started or failed,
+    and leaves tombstones so that they aren't populated again from earlier reads of the database
+    """
+    task_ids = list(task_ids)
+    if not task_ids:
+        return
+
+    def write(pipeline, key, channel_id):
+        pipeline.hdel(key, *[field for task_id in task_ids for field in (task_id, task_id + PROGRESS_SUFFIX)])
+        pipeline.hset(key, mapping={task_id + REMOVED_SUFFIX: 1 for task_id in task_ids})
+
+    _write(write, channel_id)
+
+
+def _load_tasks(fields):
+    tasks = []
+    for field, value in fields.items():
+        field = field.decode()
+        if field == POPULATED_FIELD or field.endswith(PROGRESS_SUFFIX) or field.endswith(REMOVED_SUFFIX):
+            continue
+        task = json.loads(value)
+        progress = fields.get((field + PROGRESS_SUFFIX).encode())
+        if progress is not None:
+            task["progress"] = int(progress)
+        tasks.append(task)
+    return tasks
+
+
+def get_task_statuses(channel_ids):
+    """
+    Returns the cached tasks of the channels, and the ids of the channels whose tasks aren't cached
+    """
+    channel_ids = [_get_channel_id(channel_id) for channel_id in channel_ids]
+    if not settings.SYNC_TASK_STATUS_TIMEOUT:
+        return [], channel_ids
+    try:
+        pipeline = get_redis_connection("default").pipeline(transaction=False)
+        for channel_id in channel_ids:
+            pipeline.hgetall(get_channel_tasks_key(channel_id))
+        results = pipeline.execute()
+    except RedisError as e:
+        logging.warning("Unable to read the task status cache: {}".format(e))
+        return [], channel_ids
+
+    tasks = []
+    missing = []
+    for channel_id, fields in zip(channel_ids, results):
+        if POPULATED_FIELD.encode() in fields:
+            tasks.extend(_load_tasks(fields))
+        else:
+            missing.append(channel_id)
+    return tasks, missing
+
+
+def populate_task_statuses(channel_ids, tasks):
+    """
+    Populates the cache for the channels with their started and failed tasks read from the database,
+    without overwriting statuses that tasks have written since, or caching tasks that have finished since
+    """
+    tasks_by_channel = {}
+    for task in tasks:
+        if task["status"] in (states.STARTED, states.FAILURE):
+            tasks_by_channel.setdefault(_get_channel_id(task["channel_id"]), []).append(task)
+
+    for channel_id in channel_ids:
+        def write(pipeline, key, channel_id):
+            for task in tasks_by_channel.get(channel_id, []):
+                task_status = _get_task_status(task["task_id"], task["task_name"], channel_id, task["status"], traceback=task["traceback"])
+                progress = task["progress"] if task["progress"] is not None else ""
+                pipeline.eval(POPULATE_SCRIPT, 1, key, task["task_id"], REMOVED_SUFFIX, PROGRESS_SUFFIX, json.dumps(task_status), progress)
+            pipeline.hset(key, POPULATED_FIELD, 1)
+            # The cache now agrees with the database, so it expires the timeout from now
+            pipeline.expire(key, settings.SYNC_TASK_STATUS_TIMEOUT)
+
+        _write(write, channel_id)
@@ -13,6 +13,9 @@ from django.db import transaction
 
 from contentcuration.constants.locking import TASK_LOCK
 from contentcuration.db.advisory_lock import advisory_lock
+from contentcuration.utils.celery.status import remove_task_statuses
+from contentcuration.utils.celery.status import set_task_progress
+from contentcuration.utils.celery.status import set_task_status
 from contentcuration.utils.sentry import report_exception
 
 
@@ -23,16 +26,18 @@ class ProgressTracker:
     """
     Helper to track task progress
     """
-    __slots__ = ("task_id", "send_event", "total", "progress", "last_reported_progress")
+    __slots__ = ("task_id", "send_event", "channel_id", "total", "progress", "last_reported_progress")
 
-    def __init__(self, task_id, send_event):
+    def __init__(self, task_id, send_event, channel_id=None):
         """
         :param task_id: The ID of the calling task
         :param send_event: Callback to send the task event
         :type send_event: Callable
+        :param channel_id: The ID of the channel of the task, whose cached task status to update
         """
         self.task_id = task_id
         self.send_event = send_event
+        self.channel_id = channel_id
         self.total = 100.0
         self.progress = 0.0
         self.last_reported_progress = 0.0
@@ -59,6 +64,7 @@ class ProgressTracker:
         if math.floor(self.last_reported_progress) < math.floor(self.task_progress):
             self.last_reported_progress = self.task_progress
             self.send_event(progress=self.task_progress)
+            set_task_progress(self.task_id, self.channel_id, self.task_progress)
 
     @property
     def task_progress(self):
@@ -111,6 +117,9 @@ class CeleryTask(Task):
     # Tasks are acknowledged just before they start executing
     acks_late = False
 
+    # Whether the status of the task is cached for the sync endpoint, when called with a `channel_id`
+    cache_status = True
+
     @property
     def TaskModel(self):
         """
@@ -118,13 +127,27 @@ class CeleryTask(Task):
         """
         return self.backend.TaskModel
 
+    def before_start(self, task_id, args, kwargs):
+        if self.cache_status:
+            set_task_status(task_id, self.name, kwargs.get("channel_id"), states.STARTED)
+
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         """
         Report task failures to sentry as long as the exception is not one of the types for which it should `autoretry`
         """
+        if self.cache_status:
+            set_task_status(task_id, self.name, kwargs.get("channel_id"), states.FAILURE, traceback=einfo.traceback)
         if not getattr(self, "autoretry_for", None) or not isinstance(exc, self.autoretry_for):
             report_exception(exc)
 
+    def on_success(self, retval, task_id, args, kwargs):
+        if self.cache_status:
+            remove_task_statuses(kwargs.get("channel_id"), [task_id])
+
+    def on_retry(self, exc, task_id, args, kwargs, einfo):
+        if self.cache_status:
+            remove_task_statuses(kwargs.get("channel_id"), [task_id])
+
     def shadow_name(self, *args, **kwargs):
         """
         DO NOT add functionality here as that will make it impossible to rely on `.name` for finding task by name in the
@@ -202,7 +225,7 @@ class CeleryTask(Task):
         Enqueues the task called with `kwargs`, and requires the user who wants to enqueue it.
 
         :param user: User object of the user performing the operation
-        :param kwargs: Keyword arguments for task `apply_async`
+        :param kwargs: Keyword arguments for task `apply_async`, and optionally the `task_id` to enqueue it with
         :return: The celery async result
         :rtype: CeleryAsyncResult
         """
@@ -216,7 +239,7 @@ class CeleryTask(Task):
         if signature is None:
             signature = self.generate_signature(kwargs)
 
-        task_id = uuid.uuid4().hex
+        task_id = kwargs.pop('task_id', None) or uuid.uuid4().hex
         prepared_kwargs = self._prepare_kwargs(kwargs)
         channel_id = prepared_kwargs.get("channel_id")
         custom_task_result = CustomTaskMetadata(
@@ -271,9 +294,10 @@ class CeleryTask(Task):
             kwargs.update(signature=signature)
             return self.enqueue(user, **kwargs)
 
-    def requeue(self, **kwargs):
+    def requeue(self, task_id=None, **kwargs):
         """
         Re-enqueues the same task, during execution of the task, with the same arguments
+        :param task_id: The ID to enqueue the new task with, generated if not given
         :param kwargs: Keyword arguments to override the original arguments
         :return: The celery async result
         :rtype: CeleryAsyncResult
@@ -287,7 +311,7 @@ class CeleryTask(Task):
         signature = self.generate_signature(kwargs)
         custom_task_metadata = CustomTaskMetadata.objects.get(task_id=request.id)
         logging.info(f"Re-queuing task {self.name} for user {custom_task_metadata.user.pk} from {request.id} | {signature}")
-        return self.enqueue(custom_task_metadata.user, signature=signature, **task_kwargs)
+        return self.enqueue(custom_task_metadata.user, signature=signature, task_id=task_id, **task_kwargs)
 
     def revoke(self, exclude_task_ids=None, **kwargs):
         """
@@ -307,6 +331,8 @@ class CeleryTask(Task):
             logging.info(f"Revoking task {task_id}")
             self.app.control.revoke(task_id, terminate=True)
             count += 1
+        if self.cache_status:
+            remove_task_statuses(kwargs.get("channel_id"), task_ids)
         # be sure the database backend has these marked appropriately
         TaskResult.objects.filter(task_id__in=task_ids).update(status=states.REVOKED)
         return count
@@ -3,11 +3,15 @@
 Studio garbage collection utilities. Clean up all these old, unused records!
 """
 import datetime
+import json
 import logging
 
 from celery import states
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Max
+from django.db.models import Q
 from django.db.models import Subquery
 from django.db.models.expressions import CombinedExpression
 from django.db.models.expressions import Exists
@@ -19,14 +23,20 @@ from django.utils.timezone import now
 from django_celery_results.models import TaskResult
 from le_utils.constants import content_kinds
 
+from contentcuration.constants import channel_history
 from contentcuration.constants import feature_flags
 from contentcuration.constants import user_history
 from contentcuration.db.models.functions import JSONObjectKeys
+from contentcuration.models import ArchivedChange
+from contentcuration.models import Change
+from contentcuration.models import Channel
+from contentcuration.models import ChannelHistory
 from contentcuration.models import ContentNode
 from contentcuration.models import CustomTaskMetadata
 from contentcuration.models import File
 from contentcuration.models import User
 from contentcuration.models import UserHistory
+from contentcuration.viewsets.sync.constants import UPDATED
 
 
 class DisablePostDeleteSignal(object):
@@ -200,3 +210,174 @@ def clean_up_stale_files(last_modified=None):
             files_to_clean_up_slice = files_to_clean_up.values_list("id", flat=True)[0:CHUNKSIZE]
 
     logging.info("Files with a modified date older than {} were deleted. Deleted {} file(s).".format(last_modified, count))
+
+
+CHANGE_BATCH_SIZE = 1000
+
+ARCHIVED_CHANGE_FIELDS = (
+    "server_rev",
+    "created_by_id",
+    "channel_id",
+    "user_id",
+    "client_rev",
+    "session_id",
+    "table",
+    "change_type",
+    "kwargs",
+    "applied",
+    "errored",
+    "created",
+)
+
+
+def _created_before(older_than):
+    # Changes made before their creation time was recorded have none, and are older than any cutoff
+    return Q(created__lt=older_than) | Q(created__isnull=True)
+
+
+def _is_created_before(change, older_than):
+    return change["created"] is None or change["created"] < older_than
+
+
+def _mods_overlap(mods, other_mods):
+    # Mods are applied in no particular order, so a field can't be folded with a change to a field within it
+    return any(
+        field != other_field and (field.startswith(other_field + ".") or other_field.startswith(field + "."))
+        for field in mods for other_field in other_mods
+    )
+
+
+def _fold_change_run(run, updated_changes, deleted_revs):
+    """
+    Folds the mods of a run of updates to the same object into its last update,
+    the run is split wherever an update has mods that overlap with the earlier ones
+    """
+    start = 0
+    mods = {}
+    for i, change in enumerate(run):
+        change_mods = change["kwargs"].get("mods", {})
+        if _mods_overlap(change_mods, mods):
+            _fold_change_run(run[start:i], updated_changes, deleted_revs)
+            start = i
+            mods = {}
+        mods.update(change_mods)
+    if len(run) - start < 2:
+        return
+    last = run[-1]
+    updated_changes.append(Change(server_rev=last["server_rev"], kwargs=dict(last["kwargs"], mods=mods)))
+    deleted_revs.extend(change["server_rev"] for change in run[start:-1])
+
+
+def _save_folded_changes(updated_changes, deleted_revs):
+    with transaction.atomic():
+        Change.objects.bulk_update(updated_changes, ["kwargs"])
+        Change.objects.filter(server_rev__in=deleted_revs).delete()
+    count = len(deleted_revs)
+    del updated_changes[:]
+    del deleted_revs[:]
+    return count
+
+
+def _get_update_runs(channel_id, older_than, batch_size):
+    """
+    Yields the runs of applied updates to the same object in a channel made before `older_than`,
+    a run is broken by any other change to the object
+    """
+    runs = {}
+    changes = Change.objects.filter(_created_before(older_than), channel_id=channel_id) \
+        .order_by("server_rev") \
+        .values("server_rev", "table", "change_type", "applied", "kwargs")
+    for change in changes.iterator(chunk_size=batch_size):
+        key = (change["table"], json.dumps(change["kwargs"].get("key")))
+        if change["change_type"] == UPDATED and change["applied"]:
+            runs.setdefault(key, []).append(change)
+        elif key in runs:
+            yield runs.pop(key)
+    for run in runs.values():
+        yield run
+
+
+def fold_change_updates(older_than, batch_size=CHANGE_BATCH_SIZE):
+    """
+    Folds each run of applied updates to the same object in a channel made before `older_than` into the
+    last update of the run, which has the same effect when synced. Returns the number of changes removed.
+    """
+    channel_ids = list(
+        Change.objects.filter(_created_before(older_than), change_type=UPDATED, applied=True, channel_id__isnull=False)
+        .values_list("channel_id", flat=True)
+        .distinct()
+    )
+    updated_changes = []
+    deleted_revs = []
+    count = 0
+    for channel_id in channel_ids:
+        for run in _get_update_runs(channel_id, older_than, batch_size):
+            _fold_change_run(run, updated_changes, deleted_revs)
+            if len(deleted_revs) >= batch_size:
+                count += _save_folded_changes(updated_changes, deleted_revs)
+    return count + _save_folded_changes(updated_changes, deleted_revs)
+
+
+def clean_up_deleted_channel_changes(deleted_before, batch_size=CHANGE_BATCH_SIZE):
+    """
+    Deletes the changes of channels that were deleted before `deleted_before`, returns the number of changes deleted
+    """
+    deletion_time_subquery = Subquery(
+        ChannelHistory.objects.filter(channel_id=OuterRef("id"), action=channel_history.DELETION)
+        .values("performed")
+        .order_by("-performed")[:1]
+    )
+    channel_ids = Channel.objects.filter(deleted=True) \
+        .annotate(deletion_time=deletion_time_subquery) \
+        .filter(deletion_time__lt=deleted_before) \
+        .values_list("id", flat=True)
+
+    count = 0
+    for channel_id in channel_ids.iterator():
+        changes = Change.objects.filter(channel_id=channel_id)
+        revs = list(changes.values_list("server_rev", flat=True)[:batch_size])
+        while revs:
+            Change.objects.filter(server_rev__in=revs).delete()
+            count += len(revs)
+            revs = list(changes.values_list("server_rev", flat=True)[:batch_size])
+    return count
+
+
+def archive_changes(older_than, batch_size=CHANGE_BATCH_SIZE):
+    """
+    Moves the changes made before `older_than` that have been applied or have errored to the ArchivedChange table.
+    The last edit of each channel is kept, along with any later changes, as unpublished changes are detected from
+    the changes after the last publish. Returns the number of changes archived.
+    """
+    # The last edit of a channel only moves forward, so looking it up once per channel is safe
+    last_edit_revs = {}
+    last_rev = 0
+    count = 0
+    while True:
+        batch = list(
+            Change.objects.filter(server_rev__gt=last_rev)
+            .order_by("server_rev")
+            .values(*ARCHIVED_CHANGE_FIELDS)[:batch_size]
+        )
+        # Changes are created in server_rev order, so once a batch has no old changes there are none left
+        if not any(_is_created_before(c, older_than) for c in batch):
+            break
+        last_rev = batch[-1]["server_rev"]
+        old_changes = [c for c in batch if _is_created_before(c, older_than) and (c["applied"] or c["errored"])]
+
+        channel_ids = set(c["channel_id"] for c in old_changes if c["channel_id"]).difference(last_edit_revs)
+        last_edit_revs.update(
+            Change.objects.filter(channel_id__in=channel_ids, created_by__isnull=False, user__isnull=True)
+            .values("channel_id")
+            .annotate(last_edit_rev=Max("server_rev"))
+            .values_list("channel_id", "last_edit_rev")
+        )
+        archived_changes = [
+            ArchivedChange(**c) for c in old_changes
+            if not c["channel_id"] or c["server_rev"] < last_edit_revs.get(c["channel_id"], c["server_rev"] + 1)
+        ]
+        with transaction.atomic():
+            ArchivedChange.objects.bulk_create(archived_changes)
+            Change.objects.filter(server_rev__in=[c.server_rev for c in archived_changes]).delete()
+        count += len(archived_changes)
+    return count
@@ -130,6 +130,17 @@ class GoogleCloudStorage(Storage):
 
         return name
 
+    def copy(self, src_name, dst_name):
+        """
+        Copies the object at src_name to dst_name within the bucket, without downloading it.
+        The copy keeps the metadata of the original, such as its content encoding.
+        """
+        blob = self.bucket.get_blob(src_name)
+        if blob is None:
+            raise FileNotFoundError("{} not found".format(src_name))
+        self.bucket.copy_blob(blob, self.bucket, dst_name)
+        return dst_name
+
     def url(self, name):
         """
         Return a publicly accessible URL for the given object.
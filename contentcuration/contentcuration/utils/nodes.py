@@ -6,8 +6,10 @@ import os
 import time
 from builtins import next
 from builtins import str
+from datetime import datetime
 from io import BytesIO
 
+from dateutil.parser import isoparse
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.exceptions import ValidationError
@@ -17,16 +19,20 @@ from django.db.models import Sum
 from django.utils import timezone
 from le_utils.constants import completion_criteria
 from le_utils.constants import content_kinds
+from le_utils.constants import file_formats
 from le_utils.constants import format_presets
 
 from contentcuration.models import AssessmentItem
+from contentcuration.models import ChecksumReference
 from contentcuration.models import ContentNode
 from contentcuration.models import File
 from contentcuration.models import FormatPreset
 from contentcuration.models import generate_object_storage_name
 from contentcuration.models import Language
 from contentcuration.models import User
+from contentcuration.utils.cache import get_files_modified
 from contentcuration.utils.cache import ResourceSizeCache
+from contentcuration.utils.cache import TreeRevisionCache
 from contentcuration.utils.files import get_thumbnail_encoding
 from contentcuration.utils.sentry import report_exception
 
@@ -49,17 +55,11 @@ def map_files_to_node(user, node, data):  # noqa: C901
 
     for file_data in valid_data:
         filename = file_data["filename"]
-        checksum, ext1 = os.path.splitext(filename)
-        ext = ext1.lstrip(".")
 
         # Determine a preset if none is given
         kind_preset = FormatPreset.get_preset(file_data["preset"]) or FormatPreset.guess_format_preset(filename)
 
-        file_path = generate_object_storage_name(checksum, filename)
-        storage = default_storage
-
-        if not storage.exists(file_path):
-            raise IOError('{} not found'.format(file_path))
+        file_path = _get_file_path(filename)
 
         try:
             if file_data.get('language'):
@@ -70,19 +70,7 @@ def map_files_to_node(user, node, data):  # noqa: C901
             logging.warning("file_data with language {} does not exist.".format(invalid_lang))
             return ValidationError("file_data given was invalid; expected string, got {}".format(invalid_lang))
 
-        resource_obj = File(
-            checksum=checksum,
-            contentnode=node,
-            file_format_id=ext,
-            original_filename=file_data.get('original_filename') or 'file',
-            source_url=file_data.get('source_url'),
-            file_size=file_data['size'],
-            preset=kind_preset,
-            language_id=file_data.get('language'),
-            uploaded_by=user,
-            duration=file_data.get("duration"),
-        )
-        resource_obj.file_on_disk.name = file_path
+        resource_obj = _build_node_file(user, node, file_data, kind_preset, file_path)
 
         if kind_preset and kind_preset.thumbnail:
             # If this is a thumbnail, delete any other thumbnails that are
@@ -101,6 +89,117 @@ def map_files_to_node(user, node, data):  # noqa: C901
             node.save()
 
 
+def _get_file_path(filename):
+    checksum, _ext = os.path.splitext(filename)
+    file_path = generate_object_storage_name(checksum, filename)
+    if not default_storage.exists(file_path):
+        raise IOError('{} not found'.format(file_path))
+    return file_path
+
+
+def _build_node_file(user, node, file_data, preset, file_path):
+    checksum, ext = os.path.splitext(file_data["filename"])
+    resource_obj = File(
+        checksum=checksum,
+        contentnode=node,
+        file_format_id=ext.lstrip("."),
+        original_filename=file_data.get('original_filename') or 'file',
+        source_url=file_data.get('source_url'),
+        file_size=file_data['size'],
+        preset=preset,
+        language_id=file_data.get('language'),
+        uploaded_by=user,
+        duration=file_data.get("duration"),
+    )
+    resource_obj.file_on_disk.name = file_path
+    return resource_obj
+
+
+def _bulk_create_files(user, files):
+    from contentcuration.utils.user import calculate_user_storage
+
+    # As File.save would
+    for file in files:
+        if file.file_format_id not in dict(file_formats.choices):
+            raise ValidationError("Invalid file_format")
+    File.objects.bulk_create(files)
+    ChecksumReference.objects.update_files(File.objects.filter(pk__in=[f.pk for f in files]))
+    if files:
+        calculate_user_storage(user.id)
+
+
+def map_files_to_nodes(user, nodes_data):
+    """
+    Generate the files that reference each of the newly created content nodes in `nodes_data`,
+    a list of (node, file data) pairs, with a single insert.
+    """
+    presets = {preset.id: preset for preset in FormatPreset.objects.all()}
+    languages = set(Language.objects.filter(
+        pk__in=[file_data['language'] for _node, data in nodes_data for file_data in filter_out_nones(data) if file_data.get('language')]
+    ).values_list("pk", flat=True))
+
+    files = []
+    thumbnail_nodes = []
+    for node, data in nodes_data:
+        node_files = []
+        thumbnail = None
+        for file_data in filter_out_nones(data):
+            filename = file_data["filename"]
+            # Determine a preset if none is given
+            kind_preset = presets.get(file_data["preset"]) or FormatPreset.guess_format_preset(filename)
+            file_path = _get_file_path(filename)
+
+            if file_data.get('language') and file_data['language'] not in languages:
+                # As in map_files_to_node, the remaining files of the node are not mapped
+                logging.warning("file_data with language {} does not exist.".format(file_data['language']))
+                break
+
+            resource_obj = _build_node_file(user, node, file_data, kind_preset, file_path)
+            if kind_preset and kind_preset.thumbnail:
+                # A node only keeps its last thumbnail of each preset
+                node_files = [f for f in node_files if f.preset_id != kind_preset.id]
+                thumbnail = resource_obj
+            node_files.append(resource_obj)
+
+        files.extend(node_files)
+        if thumbnail:
+            node.thumbnail_encoding = json.dumps({
+                'base64': get_thumbnail_encoding("{}.{}".format(thumbnail.checksum, thumbnail.file_format_id)),
+                'points': [],
+                'zoom': 0
+            })
+            thumbnail_nodes.append(node)
+
+    _bulk_create_files(user, files)
+    ContentNode.objects.bulk_update(thumbnail_nodes, ["thumbnail_encoding"])
+
+
+def map_files_to_assessment_items(user, assessment_items_data):
+    """
+    Generate the files referenced in each of the newly created assessment items in
+    `assessment_items_data`, a list of (assessment item, file data) pairs, with a single insert.
+    """
+    files = []
+    for assessment_item, data in assessment_items_data:
+        for file_data in filter_out_nones(data):
+            filename = file_data["filename"]
+            checksum, ext = filename.split(".")
+            resource_obj = File(
+                checksum=checksum,
+                assessment_item=assessment_item,
+                file_format_id=ext,
+                original_filename=file_data.get('original_filename') or 'file',
+                source_url=file_data.get('source_url'),
+                file_size=file_data['size'],
+                preset_id=file_data["preset"],   # assessment_item-files always have a preset
+                uploaded_by=user,
+            )
+            resource_obj.file_on_disk.name = _get_file_path(filename)
+            files.append(resource_obj)
+
+    _bulk_create_files(user, files)
+
+
 def map_files_to_assessment_item(user, assessment_item, data):
     """
     Generate files referenced in given assesment item (a.k.a. question).
@@ -343,29 +442,15 @@ class ResourceSizeHelper:
 
     def modified_since(self, compare_datetime):
         """
-        Determines if resources have been modified since ${compare_datetime}
+        Determines if resources have been modified since ${compare_datetime}, from the watermark
+        of when the files of the nodes of the tree were last modified, rather than querying the files
 
-        SQL:
-            SELECT BOOL_OR(modified > ${compare_datetime})
-            FROM (
-                SELECT
-                    modified_at
-                FROM contentcuration_file
-                WHERE contentnode_id IN ( SELECT id FROM contentcuration_contentnode WHERE ... )
-            ) subquery
-            ;
-
-        :
         :param compare_datetime: The datetime with which to compare.
         :return: A boolean indicating whether or not resources have been modified since the datetime
         """
-        return True
-        # TODO: need to optimize joins between files and content nodes, this is just as slow as calc
-        # compare_datetime = compare_datetime.isoformat() if isinstance(compare_datetime, datetime) else compare_datetime
-        # result = self.queryset.aggregate(
-        #     modified_since=BoolOr(CombinedExpression(F('modified'), '>', Value(compare_datetime)))
-        # )
-        # return result['modified_since']
+        if not isinstance(compare_datetime, datetime):
+            compare_datetime = isoparse(compare_datetime)
+        return get_files_modified(self.node.tree_id) > compare_datetime
 
 
 STALE_MAX_CALCULATION_SIZE = 500
@@ -402,14 +487,21 @@ def calculate_resource_size(node, force=False):
     """
     cache = ResourceSizeCache(node)
     db = ResourceSizeHelper(node)
+    # read the revision of the tree before calculating, so a change made meanwhile bumps it past the cached size
+    version = TreeRevisionCache(node.tree_id).version
 
     size = None if force else cache.get_size()
     modified = None if force else cache.get_modified()
 
+    # nothing in the tree has changed since the size was cached
+    if size is not None and cache.get_version() == version:
+        return size, False
+
     # since we added file.modified as nullable, if the result is None/Null, then we know that it
     # hasn't been modified since our last cached value, so we only need to check is False
     if size is not None and modified is not None and db.modified_since(modified) is False:
-        # use cache if not modified since cache modified timestamp
+        # use cache if not modified since cache modified timestamp, and until the tree next changes
+        cache.set_version(version)
         return size, False
 
     # if the node is too big to calculate its size right away, we return "stale"
@@ -418,11 +510,15 @@ def calculate_resource_size(node, force=False):
 
     start = time.time()
 
+    # make sure the files modified watermark of the tree is known before marking the modified time,
+    # otherwise it would be initialized later than the cached size, which would then never be used
+    get_files_modified(node.tree_id)
     # do recalculation, marking modified time before starting
     now = timezone.now()
     size = db.get_size()
     cache.set_size(size)
     cache.set_modified(now)
+    cache.set_version(version)
     elapsed = time.time() - start
 
     if not force and elapsed > SLOW_UNFORCED_CALC_THRESHOLD:
@@ -16,6 +16,8 @@ from rest_framework.pagination import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
+from contentcuration.utils.cache import RevisionCache
+
 
 class ValuesPage(Page):
     def __init__(self, object_list, number, paginator):
@@ -39,6 +41,9 @@ class ValuesViewsetPaginator(Paginator):
 
 
 class CachedValuesViewsetPaginator(ValuesViewsetPaginator):
+    # The name of a revision that is bumped by the changes that affect the count, if any
+    revision_name = None
+
     @cached_property
     def count(self):
         """
@@ -52,6 +57,8 @@ class CachedValuesViewsetPaginator(ValuesViewsetPaginator):
                 "query-count:"
                 + hashlib.md5(query_string).hexdigest()
             )
+            if self.revision_name is not None:
+                cache_key = RevisionCache(self.revision_name).key(cache_key)
             value = cache.get(cache_key)
             if value is None:
                 value = super(CachedValuesViewsetPaginator, self).count
@@ -1,32 +1,42 @@
 from __future__ import division
 
+import hashlib
 import itertools
 import json
 import logging as logmodule
 import os
 import re
+import shutil
 import tempfile
 import time
 import traceback
 import uuid
 import zipfile
 from builtins import str
+from collections import Counter
+from collections import OrderedDict
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextlib import ExitStack
 from copy import deepcopy
-from itertools import chain
 
+from django.apps import apps
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.files import File
+from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage as storage
 from django.core.management import call_command
-from django.db.models import Count
+from django.db import connections
+from django.db import DEFAULT_DB_ALIAS
+from django.db import transaction
 from django.db.models import Exists
-from django.db.models import Max
+from django.db.models import F
 from django.db.models import OuterRef
+from django.db.models import Prefetch
 from django.db.models import Q
 from django.db.models import Subquery
-from django.db.models import Sum
-from django.db.utils import IntegrityError
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
@@ -35,6 +45,8 @@ from kolibri_content import models as kolibrimodels
 from kolibri_content.base_models import MAX_TAG_LENGTH
 from kolibri_content.router import get_active_content_database
 from kolibri_content.router import using_content_database
+from kolibri_content.utils import copy_template_database
+from kolibri_content.utils import migrate_content_database
 from kolibri_public.utils.mapper import ChannelMapper
 from le_utils.constants import completion_criteria
 from le_utils.constants import content_kinds
@@ -51,6 +63,7 @@ from search.utils import get_fts_annotated_contentnode_qs
 
 from contentcuration import models as ccmodels
 from contentcuration.decorators import delay_user_storage_calculation
+from contentcuration.utils.cache import bump_tree_revisions
 from contentcuration.utils.cache import delete_public_channel_cache_keys
 from contentcuration.utils.files import create_thumbnail_from_base64
 from contentcuration.utils.files import get_thumbnail_encoding
@@ -58,15 +71,28 @@ from contentcuration.utils.nodes import migrate_extra_fields
 from contentcuration.utils.parser import extract_value
 from contentcuration.utils.parser import load_json_string
 from contentcuration.utils.sentry import report_exception
+from contentcuration.utils.storage_common import copy_file
 
 
 logmodule.basicConfig()
 logging = logmodule.getLogger(__name__)
 
 PERSEUS_IMG_DIR = exercises.IMG_PLACEHOLDER + "/images"
+# Markdown image references in the text of assessment items, and the path and dimensions of the image they reference
+IMAGE_MARKDOWN_REGEX = re.compile(r'!\[(?:[^\]]*)]\(([^\)]+)\)')
+IMAGE_PATH_REGEX = re.compile(r'(.+/images/[^\s]+)(?:\s=([0-9\.]+)x([0-9\.]+))*')
 THUMBNAIL_DIMENSION = 128
 MIN_SCHEMA_VERSION = "1"
 PUBLISHING_UPDATE_THRESHOLD = 3600
+BATCH_SIZE = 1000
+# Included in the hash of the inputs of a Perseus archive, bump this when
+# the contents of the archives change so that cached archives are not reused
+PERSEUS_ARCHIVE_VERSION = 1
+# The largest fraction of a channel's nodes that is remapped into its previously published
+# export database, channels with more changes than this are published in full
+INCREMENTAL_PUBLISH_THRESHOLD = 0.1
+# The number of the slowest exercise builds that are kept in the profile of a publish
+PROFILE_SLOWEST_EXERCISES = 10
 
 
 class NoNodesChangedError(Exception):
@@ -97,6 +123,57 @@ class SlowPublishError(Exception):
         super(SlowPublishError, self).__init__(self.message)
 
 
+class PublishProfiler(object):
+    """
+    Records where the time of a publish goes. For each stage, it records the wall time, the number
+    and duration of the queries made on this thread to the default and active export databases, the
+    bytes uploaded to storage and the number of nodes processed. A stage that is entered more than
+    once accumulates its figures, and the figures of a stage include those of the stages nested in it.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.stages = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Profiles the enclosed block as the stage `name`, yields the record of the stage
+        so that the block can add its bytes uploaded and nodes processed to it
+        """
+        record = self.stages.setdefault(name, {"time": 0.0, "queries": 0, "query_time": 0.0, "bytes_uploaded": 0, "nodes": 0})
+
+        def record_query(execute, sql, params, many, context):
+            query_start = time.time()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                record["queries"] += 1
+                record["query_time"] += time.time() - query_start
+
+        aliases = {DEFAULT_DB_ALIAS, get_active_content_database(return_none_if_not_set=True)} - {None}
+        start = time.time()
+        try:
+            with ExitStack() as stack:
+                for alias in aliases:
+                    stack.enter_context(connections[alias].execute_wrapper(record_query))
+                yield record
+        finally:
+            record["time"] += time.time() - start
+
+    def get_profile(self):
+        """
+        Returns the figures of each stage, and the total time since the profiler was created, in a JSON serializable dict
+        """
+        return {
+            "total_time": round(time.time() - self.start, 3),
+            "stages": {
+                name: {key: round(value, 3) if isinstance(value, float) else value for key, value in record.items()}
+                for name, record in self.stages.items()
+            },
+        }
+
+
 def send_emails(channel, user_id, version_notes=''):
     subject = render_to_string('registration/custom_email_subject.txt', {'subject': _('Kolibri Studio Channel Published')})
     token = channel.secret_tokens.filter(is_primary=True).first()
@@ -116,46 +193,61 @@ def send_emails(channel, user_id, version_notes=''):
             user.email_user(subject, message, settings.DEFAULT_FROM_EMAIL, html_message=message)
 
 
-def create_content_database(channel, force, user_id, force_exercises, progress_tracker=None):
+def create_content_database(channel, force, user_id, force_exercises, progress_tracker=None, profiler=None):
     """
     :type progress_tracker: contentcuration.utils.celery.ProgressTracker|None
+    :type profiler: PublishProfiler|None
     """
+    profiler = profiler or PublishProfiler()
     # increment the channel version
     if not force:
         raise_if_nodes_are_all_unchanged(channel)
     fh, tempdb = tempfile.mkstemp(suffix=".sqlite3")
+    # Start from the previously published export database, unless a full republish was requested
+    incremental = not force and not force_exercises and copy_previous_export_database(channel, tempdb)
+    if not incremental:
+        copy_template_database(tempdb)
 
-    with using_content_database(tempdb):
+    with using_content_database(tempdb, in_memory=settings.PUBLISH_EXPORT_DATABASE_IN_MEMORY):
         if not channel.main_tree.publishing:
             channel.mark_publishing(user_id)
 
-        call_command("migrate",
-                     "content",
-                     database=get_active_content_database(),
-                     no_input=True)
+        # The previous export database may predate the latest content migrations
+        with profiler.stage("migrate"):
+            migrate_content_database(get_active_content_database())
         if progress_tracker:
             progress_tracker.track(10)
-        tree_mapper = TreeMapper(
-            channel.main_tree,
-            channel.language,
-            channel.id,
-            channel.name,
-            user_id=user_id,
-            force_exercises=force_exercises,
-            progress_tracker=progress_tracker,
-        )
-        tree_mapper.map_nodes()
-        kolibri_channel = map_channel_to_kolibri_channel(channel)
+        tree_mapper_args = (channel.main_tree, channel.language, channel.id, channel.name)
+        tree_mapper_kwargs = dict(user_id=user_id, force_exercises=force_exercises, progress_tracker=progress_tracker, profiler=profiler)
+        with profiler.stage("tree_map") as stage:
+            tree_mapper = None
+            if incremental:
+                tree_mapper = IncrementalTreeMapper(*tree_mapper_args, **tree_mapper_kwargs)
+                if not tree_mapper.prepare():
+                    logging.info("Too many changes to publish channel {} incrementally, publishing it in full".format(channel.id))
+                    clear_export_database()
+                    tree_mapper = None
+            if tree_mapper is None:
+                tree_mapper = TreeMapper(*tree_mapper_args, **tree_mapper_kwargs)
+            tree_mapper.map_nodes()
+            kolibri_channel = map_channel_to_kolibri_channel(channel)
+            stage["nodes"] += tree_mapper.mapped_node_count
         # It should be at this percent already, but just in case.
         if progress_tracker:
             progress_tracker.track(90)
-        map_prerequisites(channel.main_tree)
-        save_export_database(
-            channel.pk, channel.version + 1
-        )  # Need to save as version being published, not current version
+        with profiler.stage("prerequisites") as stage:
+            stage["nodes"] += map_prerequisites(channel.main_tree)
+
+    # An export database built in memory is only written to the temp file once the block above completes
+    with using_content_database(tempdb):
+        with profiler.stage("upload") as stage:
+            stage["bytes_uploaded"] += save_export_database(
+                channel.pk, channel.version + 1
+            )  # Need to save as version being published, not current version
         if channel.public:
-            mapper = ChannelMapper(kolibri_channel)
-            mapper.run()
+            with profiler.stage("kolibri_public"):
+                mapper = ChannelMapper(kolibri_channel)
+                mapper.run()
 
     return tempdb
 
@@ -190,6 +282,15 @@ inheritable_simple_value_fields = [
 
 
 class TreeMapper:
+    """
+    Maps the publishable nodes of a Studio tree into the active export database.
+
+    The tree is read in lft order in chunks of `batch_size` nodes, so that the files, tags and
+    assessment items of each chunk can be fetched with a handful of queries. As nodes are read in
+    tree order, the MPTT fields of the exported tree are calculated in memory, which allows the
+    kolibri_content rows to be bulk created instead of inserted one node at a time.
+    """
+
     def __init__(
         self,
         root_node,
@@ -199,6 +300,9 @@ class TreeMapper:
         user_id=None,
         force_exercises=False,
         progress_tracker=None,
+        batch_size=None,
+        exercise_workers=None,
+        profiler=None,
     ):
         if not root_node.is_publishable():
             raise ChannelIncompleteError("Attempted to publish a channel with an incomplete root node or no resources")
@@ -213,65 +317,684 @@ class TreeMapper:
         self.channel_name = channel_name
         self.user_id = user_id
         self.force_exercises = force_exercises
+        self.batch_size = batch_size or BATCH_SIZE
+        self.exercise_workers = exercise_workers or settings.PUBLISH_EXERCISE_WORKERS
+        self.profiler = profiler or PublishProfiler()
+        self.mapped_node_count = 0
+
+        self.presets = {preset.id: preset for preset in ccmodels.FormatPreset.objects.all()}
+
+        # Ids of Studio topics that have been mapped, used to exclude the descendants of unpublished topics
+        self.mapped_topic_ids = set()
+        # A stack of (rght, kolibrinode, metadata) tuples for the mapped topics that are ancestors of the
+        # node currently being mapped, the kolibrinode is only saved once its rght value is known
+        self.open_topics = []
+        # The next lft or rght value to assign in the export tree
+        self.mptt_counter = 1
+
+        # Ids of objects that have already been queued for creation in the export database
+        self.licenses = {}
+        self.language_ids = set()
+        self.tag_ids = set()
+        self.local_file_ids = set()
+
+        self.pending = OrderedDict(
+            (model, []) for model in (
+                kolibrimodels.Language,
+                kolibrimodels.ContentTag,
+                kolibrimodels.LocalFile,
+                kolibrimodels.ContentNode,
+                kolibrimodels.File,
+                kolibrimodels.ContentNode.tags.through,
+                kolibrimodels.AssessmentMetaData,
+            )
+        )
+        # (ccnode, kolibrinode, exercise_data, assessment_items, archive_hash) tuples for the
+        # exercises in the current chunk whose Perseus archives need to be built
+        self.pending_exercises = []
 
-    def _node_completed(self):
+    def _node_completed(self, count=1):
+        self.mapped_node_count += count
         if self.progress_tracker:
-            self.progress_tracker.increment(increment=self.percent_per_node)
+            self.progress_tracker.increment(increment=self.percent_per_node * count)
 
     def map_nodes(self):
-        self.recurse_nodes(self.root_node, {})
-
-    def recurse_nodes(self, node, inherited_fields):  # noqa C901
-        logging.debug("Mapping node with id {id}".format(id=node.pk))
+        lft, rght = self._get_tree_bounds()
+        # Rows are created before their parents are complete, so rely on the deferred foreign key
+        # checks of the export database by doing all of the mapping in a single transaction
+        with transaction.atomic(using=get_active_content_database()), \
+                ThreadPoolExecutor(max_workers=self.exercise_workers) as executor:
+            self._map_queryset(self._get_queryset().filter(lft__gte=lft, rght__lte=rght), executor)
+
+    def _get_tree_bounds(self):
+        # Read the bounds of the tree from the database, as the MPTT fields of the root node instance
+        # may be stale if nodes were added to the tree after it was loaded
+        return ccmodels.ContentNode.objects.filter(pk=self.root_node.pk).values_list("lft", "rght").get()
+
+    def _get_queryset(self):
+        has_resources = Exists(
+            ccmodels.ContentNode.objects.filter(
+                tree_id=OuterRef("tree_id"),
+                lft__gte=OuterRef("lft"),
+                rght__lte=OuterRef("rght"),
+            ).exclude(kind_id=content_kinds.TOPIC).values("pk")
+        )
+        return (
+            ccmodels.ContentNode.objects.filter(tree_id=self.root_node.tree_id)
+            .select_related("license", "language")
+            .annotate(has_resources=has_resources)
+            .order_by("lft")
+        )
 
+    def _map_queryset(self, queryset, executor):
+        for nodes in self._get_node_chunks(queryset):
+            self._map_chunk(nodes)
+            self._map_exercises(executor)
+            self._flush()
+        self._close_topics()
+        self._flush()
+
+    def _get_node_chunks(self, queryset):
+        last_lft = None
+        while True:
+            chunk = queryset if last_lft is None else queryset.filter(lft__gt=last_lft)
+            nodes = list(chunk[:self.batch_size])
+            if not nodes:
+                break
+            yield nodes
+            last_lft = nodes[-1].lft
+
+    def _is_publishable(self, node):
+        # Only process nodes whose parent has been mapped as a topic
+        if node.pk != self.root_node.pk and node.parent_id not in self.mapped_topic_ids:
+            return False
+        return self._is_node_publishable(node)
+
+    def _is_node_publishable(self, node):
         # Only process nodes that are either non-topics or have non-topic descendants
-        if node.is_publishable():
-            # early validation to make sure we don't have any exercises without mastery models
-            # which should be unlikely when the node is complete, but just in case
-            if node.kind_id == content_kinds.EXERCISE:
+        if not node.complete or not node.has_resources:
+            return False
+        # early validation to make sure we don't have any exercises without mastery models
+        # which should be unlikely when the node is complete, but just in case
+        if node.kind_id == content_kinds.EXERCISE:
+            try:
+                # migrates and extracts the mastery model from the exercise
+                _, mastery_model = parse_assessment_metadata(node)
+                if not mastery_model:
+                    raise ValueError("Exercise does not have a mastery model")
+            except Exception as e:
+                logging.warning("Unable to parse exercise {id} mastery model: {error}".format(id=node.pk, error=str(e)))
+                return False
+        return True
+
+    def _map_chunk(self, nodes):
+        # Prefetch for every node that could be published, the few that are excluded because
+        # of an unpublished ancestor are cheaper to over fetch than to query separately
+        candidates = [node for node in nodes if node.complete and node.has_resources]
+        candidate_ids = [node.pk for node in candidates]
+        files_by_node = self._get_files_by_node(candidate_ids)
+        tags_by_node = self._get_tags_by_node(candidate_ids)
+        assessment_items_by_node = self._get_assessment_items_by_node(
+            [node.pk for node in candidates if node.kind_id == content_kinds.EXERCISE]
+        )
+
+        for node in nodes:
+            self._close_topics(before_lft=node.lft)
+            if not self._is_publishable(node):
+                continue
+            logging.debug("Mapping node with id {id}".format(id=node.pk))
+            self._map_node(
+                node,
+                files_by_node.get(node.pk, []),
+                tags_by_node.get(node.pk, []),
+                assessment_items_by_node.get(node.pk, []),
+            )
+
+        # Exercises that still need their Perseus archive built are completed once it is
+        self._node_completed(len(nodes) - len(self.pending_exercises))
+
+    def _get_files_by_node(self, node_ids):
+        files_by_node = {}
+        files = ccmodels.File.objects.filter(contentnode_id__in=node_ids)\
+            .exclude(Q(preset_id=format_presets.EXERCISE_IMAGE) | Q(preset_id=format_presets.EXERCISE_GRAPHIE))\
+            .select_related("language", "file_format")
+        for f in files:
+            files_by_node.setdefault(f.contentnode_id, []).append(f)
+        return files_by_node
+
+    def _get_tags_by_node(self, node_ids):
+        tags_by_node = {}
+        tags = ccmodels.ContentNode.tags.through.objects.filter(contentnode_id__in=node_ids)\
+            .values_list("contentnode_id", "contenttag_id", "contenttag__tag_name")
+        for node_id, tag_id, tag_name in tags:
+            tags_by_node.setdefault(node_id, []).append((tag_id, tag_name))
+        return tags_by_node
+
+    def _get_assessment_items_by_node(self, node_ids):
+        assessment_items_by_node = {}
+        # Prefetch everything create_perseus_zip needs, so that it doesn't query the database
+        items = ccmodels.AssessmentItem.objects.filter(contentnode_id__in=node_ids)\
+            .prefetch_related(Prefetch("files", queryset=ccmodels.File.objects.select_related("file_format")))\
+            .order_by("order")
+        for item in items:
+            assessment_items_by_node.setdefault(item.contentnode_id, []).append(item)
+        return assessment_items_by_node
+
+    def _get_inherited_metadata(self, node):
+        inherited_fields = self.open_topics[-1][2] if self.open_topics else {}
+        metadata = {}
+
+        for field in inheritable_map_fields:
+            metadata[field] = {}
+            inherited_keys = (inherited_fields.get(field) or {}).keys()
+            own_keys = (getattr(node, field) or {}).keys()
+            # Get a list of all keys in reverse order of length so we can remove any less specific values
+            all_keys = sorted(set(inherited_keys).union(set(own_keys)), key=len, reverse=True)
+            for key in all_keys:
+                if not any(k != key and k.startswith(key) for k in all_keys):
+                    metadata[field][key] = True
+
+        for field in inheritable_simple_value_fields:
+            if field in inherited_fields:
+                metadata[field] = inherited_fields[field]
+            if getattr(node, field):
+                metadata[field] = getattr(node, field)
+
+        return metadata
+
+    def _map_node(self, node, files, tags, assessment_items):
+        metadata = self._get_inherited_metadata(node)
+        kolibrinode = self._create_bare_contentnode(node, metadata, files)
+
+        if node.kind_id == content_kinds.EXERCISE:
+            exercise_data, assessment_metadata = process_assessment_metadata(node, kolibrinode, assessment_items=assessment_items)
+            self.pending[kolibrimodels.AssessmentMetaData].append(assessment_metadata)
+            if self.force_exercises or node.changed or not any(f.preset_id == format_presets.EXERCISE for f in files):
+                archive_hash = get_perseus_archive_hash(exercise_data, assessment_items)
+                exercise_file = get_cached_perseus_exercise(node, archive_hash, files, user_id=self.user_id)
+                files = [f for f in files if f.preset_id != format_presets.EXERCISE]
+                if exercise_file:
+                    files.append(exercise_file)
+                else:
+                    # The exercise file is mapped once its archive has been built by _map_exercises
+                    self.pending_exercises.append((node, kolibrinode, exercise_data, assessment_items, archive_hash))
+        elif node.kind_id == content_kinds.SLIDESHOW:
+            files = files + [create_slideshow_manifest(node, user_id=self.user_id)]
+
+        self._create_associated_file_objects(kolibrinode, node, files)
+        self._map_tags_to_node(kolibrinode, tags)
+
+        if node.kind_id == content_kinds.TOPIC:
+            self.mapped_topic_ids.add(node.pk)
+            self.open_topics.append((node.rght, kolibrinode, metadata))
+        else:
+            kolibrinode.rght = self._next_mptt_value()
+            self._queue_node(kolibrinode)
+
+    def _map_exercises(self, executor):
+        """
+        Builds the Perseus archives of the pending exercises on the executor's worker threads.
+        The workers only read from storage, saving the archives and mapping their files is
+        done on this thread as it queries the database.
+        """
+        if not self.pending_exercises:
+            return
+        with self.profiler.stage("exercises"), ExerciseAssetLoader() as assets:
+            # Start downloading the images of all of the pending exercises before building any of them
+            for pending in self.pending_exercises:
+                assets.prefetch(pending[3])
+            futures = {
+                executor.submit(build_perseus_zip, node, exercise_data, assessment_items, self.channel_id, assets): (node, kolibrinode, archive_hash)
+                for node, kolibrinode, exercise_data, assessment_items, archive_hash in self.pending_exercises
+            }
+            self.pending_exercises = []
+            self._save_exercises(futures)
+
+    def _save_exercises(self, futures):
+        """
+        Saves the archives of the exercises as their builds complete, `futures` maps each build to its node
+        """
+        stage = self.profiler.stages["exercises"]
+        try:
+            for future in as_completed(futures):
+                node, kolibrinode, archive_hash = futures.pop(future)
+                temppath, elapsed = future.result()
                 try:
-                    # migrates and extracts the mastery model from the exercise
-                    _, mastery_model = parse_assessment_metadata(node)
-                    if not mastery_model:
-                        raise ValueError("Exercise does not have a mastery model")
-                except Exception as e:
-                    logging.warning("Unable to parse exercise {id} mastery model: {error}".format(id=node.pk, error=str(e)))
-                    return
-
-            metadata = {}
-
-            for field in inheritable_map_fields:
-                metadata[field] = {}
-                inherited_keys = (inherited_fields.get(field) or {}).keys()
-                own_keys = (getattr(node, field) or {}).keys()
-                # Get a list of all keys in reverse order of length so we can remove any less specific values
-                all_keys = sorted(set(inherited_keys).union(set(own_keys)), key=len, reverse=True)
-                for key in all_keys:
-                    if not any(k != key and k.startswith(key) for k in all_keys):
-                        metadata[field][key] = True
-
-            for field in inheritable_simple_value_fields:
-                if field in inherited_fields:
-                    metadata[field] = inherited_fields[field]
-                if getattr(node, field):
-                    metadata[field] = getattr(node, field)
-
-            kolibrinode = create_bare_contentnode(node, self.default_language, self.channel_id, self.channel_name, metadata)
-
-            if node.kind_id == content_kinds.EXERCISE:
-                exercise_data = process_assessment_metadata(node, kolibrinode)
-                if self.force_exercises or node.changed or not \
-                        node.files.filter(preset_id=format_presets.EXERCISE).exists():
-                    create_perseus_exercise(node, kolibrinode, exercise_data, user_id=self.user_id)
-            elif node.kind_id == content_kinds.SLIDESHOW:
-                create_slideshow_manifest(node, user_id=self.user_id)
-            elif node.kind_id == content_kinds.TOPIC:
-                for child in node.children.all():
-                    self.recurse_nodes(child, metadata)
-            create_associated_file_objects(kolibrinode, node)
-            map_tags_to_node(kolibrinode, node)
-
-        self._node_completed()
+                    exercise_file = save_perseus_exercise(node, temppath, user_id=self.user_id, archive_hash=archive_hash)
+                finally:
+                    os.unlink(temppath)
+                stage["bytes_uploaded"] += exercise_file.file_size
+                stage["nodes"] += 1
+                self._record_exercise_build(stage, node, elapsed)
+                self._create_associated_file_objects(kolibrinode, node, [exercise_file])
+                logging.debug("Built Perseus archive for node {} in {:.3f} seconds".format(node.pk, elapsed))
+                self._node_completed()
+        finally:
+            # Don't leave behind the archives of exercises that were not saved because of an error
+            for future in futures:
+                if not future.cancel() and not future.exception():
+                    os.unlink(future.result()[0])
+
+    def _record_exercise_build(self, stage, node, elapsed):
+        """
+        Adds the time taken to build the archive of an exercise to the profile of the exercises stage,
+        which keeps the total build time on the worker threads and the slowest exercises
+        """
+        stage["build_time"] = stage.get("build_time", 0.0) + elapsed
+        slowest = stage.setdefault("slowest", [])
+        slowest.append({"node_id": node.pk, "time": round(elapsed, 3)})
+        slowest.sort(key=lambda build: build["time"], reverse=True)
+        del slowest[PROFILE_SLOWEST_EXERCISES:]
+
+    def _next_mptt_value(self):
+        value = self.mptt_counter
+        self.mptt_counter += 1
+        return value
+
+    def _close_topics(self, before_lft=None):
+        """
+        Assigns rght values to, and queues for creation, the open topics that do not contain
+        the node at `before_lft`, or all open topics if `before_lft` is None
+        """
+        while self.open_topics and (before_lft is None or self.open_topics[-1][0] < before_lft):
+            _, kolibrinode, _ = self.open_topics.pop()
+            kolibrinode.rght = self._next_mptt_value()
+            self._queue_node(kolibrinode)
+
+    def _queue_node(self, kolibrinode):
+        self.pending[kolibrimodels.ContentNode].append(kolibrinode)
+
+    def _flush(self):
+        for Model, objects in self.pending.items():
+            if objects:
+                Model.objects.bulk_create(objects)
+                self.pending[Model] = []
+
+    def _get_license(self, ccnode):
+        if ccnode.license is None:
+            return None
+        use_license_description = not ccnode.license.is_custom
+        license_key = (
+            ccnode.license.license_name,
+            ccnode.license.license_description if use_license_description else ccnode.license_description,
+        )
+        if license_key not in self.licenses:
+            self.licenses[license_key] = create_kolibri_license_object(ccnode)[0]
+        return self.licenses[license_key]
+
+    def _map_language(self, language):
+        if language.pk not in self.language_ids:
+            self.language_ids.add(language.pk)
+            self.pending[kolibrimodels.Language].append(create_kolibri_language_object(language))
+        return language.pk
+
+    def _create_bare_contentnode(self, ccnode, metadata, files):
+        logging.debug("Creating a Kolibri contentnode for instance id {}".format(
+            ccnode.node_id))
+
+        kolibri_license = self._get_license(ccnode)
+
+        language = (ccnode.language if ccnode.kind_id == content_kinds.TOPIC else metadata.get("language")) or self.default_language
+        language_id = self._map_language(language) if language else None
+
+        options = {}
+        if ccnode.extra_fields and 'options' in ccnode.extra_fields:
+            options = ccnode.extra_fields['options']
+
+        duration = None
+        ccnode_completion_criteria = options.get("completion_criteria")
+        if ccnode_completion_criteria:
+            if ccnode_completion_criteria["model"] == completion_criteria.TIME or ccnode_completion_criteria["model"] == completion_criteria.APPROX_TIME:
+                duration = ccnode_completion_criteria["threshold"]
+        if duration is None and ccnode.kind_id in [content_kinds.AUDIO, content_kinds.VIDEO]:
+            # aggregate duration from associated files, choosing maximum if there are multiple, like hi and lo res videos.
+            duration = max((f.duration for f in files if f.duration is not None), default=None)
+
+        learning_activities = None
+        accessibility_labels = None
+        if ccnode.kind_id != content_kinds.TOPIC:
+            if ccnode.learning_activities:
+                learning_activities = ",".join(ccnode.learning_activities.keys())
+            if ccnode.accessibility_labels:
+                accessibility_labels = ",".join(ccnode.accessibility_labels.keys())
+
+        # Do not use the inherited metadata if this is a topic, just read from its own metadata instead.
+        grade_levels = ccnode.grade_levels if ccnode.kind_id == content_kinds.TOPIC else metadata["grade_levels"]
+        resource_types = ccnode.resource_types if ccnode.kind_id == content_kinds.TOPIC else metadata["resource_types"]
+        categories = ccnode.categories if ccnode.kind_id == content_kinds.TOPIC else metadata["categories"]
+        learner_needs = ccnode.learner_needs if ccnode.kind_id == content_kinds.TOPIC else metadata["learner_needs"]
+
+        parent = self.open_topics[-1][1] if self.open_topics else None
+
+        return kolibrimodels.ContentNode(
+            id=ccnode.node_id,
+            parent_id=parent.id if parent else None,
+            tree_id=1,
+            level=len(self.open_topics),
+            lft=self._next_mptt_value(),
+            kind=ccnode.kind_id,
+            title=ccnode.title if ccnode.parent_id else self.channel_name,
+            content_id=ccnode.content_id,
+            channel_id=self.channel_id,
+            author=ccnode.author or "",
+            description=ccnode.description,
+            sort_order=ccnode.sort_order,
+            license_owner=ccnode.copyright_holder or "",
+            license=kolibri_license,
+            available=ccnode.has_resources,  # Hide empty topics
+            stemmed_metaphone="",  # Stemmed metaphone is no longer used, and will cause no harm if blank
+            lang_id=language_id,
+            license_name=kolibri_license.license_name if kolibri_license is not None else None,
+            license_description=kolibri_license.license_description if kolibri_license is not None else None,
+            coach_content=ccnode.role_visibility == roles.COACH,
+            duration=duration,
+            options=options,
+            # Fields for metadata labels
+            grade_levels=",".join(grade_levels.keys()) if grade_levels else None,
+            resource_types=",".join(resource_types.keys()) if resource_types else None,
+            learning_activities=learning_activities,
+            accessibility_labels=accessibility_labels,
+            categories=",".join(categories.keys()) if categories else None,
+            learner_needs=",".join(learner_needs.keys()) if learner_needs else None,
+        )
+
+    def _create_associated_file_objects(self, kolibrinode, ccnode, files):
+        logging.debug("Creating LocalFile and File objects for Node {}".format(kolibrinode.id))
+        for ccfilemodel in files:
+            preset = self.presets[ccfilemodel.preset_id]
+            extension = ccfilemodel.file_format_id
+            if ccfilemodel.language_id:
+                self._map_language(ccfilemodel.language)
+
+            if preset.thumbnail:
+                ccfilemodel = create_associated_thumbnail(ccnode, ccfilemodel) or ccfilemodel
+
+            if ccfilemodel.checksum not in self.local_file_ids:
+                self.local_file_ids.add(ccfilemodel.checksum)
+                self.pending[kolibrimodels.LocalFile].append(kolibrimodels.LocalFile(
+                    id=ccfilemodel.checksum,
+                    extension=extension,
+                    file_size=ccfilemodel.file_size,
+                ))
+
+            self.pending[kolibrimodels.File].append(kolibrimodels.File(
+                id=ccfilemodel.pk,
+                checksum=ccfilemodel.checksum,
+                extension=extension,
+                available=True,  # TODO: Set this to False, once we have availability stamping implemented in Kolibri
+                file_size=ccfilemodel.file_size,
+                contentnode_id=kolibrinode.id,
+                preset=preset.pk,
+                supplementary=preset.supplementary,
+                lang_id=ccfilemodel.language_id,
+                thumbnail=preset.thumbnail,
+                priority=preset.order,
+                local_file_id=ccfilemodel.checksum,
+            ))
+
+    def _map_tags_to_node(self, kolibrinode, tags):
+        """ assigns tags to nodes, excluding any that are too long for the export database
+            Args:
+                kolibrinode (kolibri.models.ContentNode): node to map tag to
+                tags (list): (id, tag_name) tuples of the tags of the Studio node
+            Returns: None
+        """
+        for tag_id, tag_name in tags:
+            if len(tag_name) > MAX_TAG_LENGTH:
+                continue
+            if tag_id not in self.tag_ids:
+                self.tag_ids.add(tag_id)
+                self.pending[kolibrimodels.ContentTag].append(kolibrimodels.ContentTag(id=tag_id, tag_name=tag_name))
+            self.pending[kolibrimodels.ContentNode.tags.through].append(
+                kolibrimodels.ContentNode.tags.through(contentnode_id=kolibrinode.id, contenttag_id=tag_id)
+            )
+
+
+class IncrementalTreeMapper(TreeMapper):
+    """
+    Maps the changes made to a Studio tree since it was last published into an export database
+    that already contains the previously published version of the channel.
+
+    Each changed node is remapped on its own, unless it is a topic whose descendants are affected
+    by the change, because it is new to the export tree, has been moved, or has had its inheritable
+    metadata edited, in which case its whole subtree is remapped. Once the changes have been mapped,
+    the MPTT fields of the export tree are recalculated from the parent ids of its nodes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(IncrementalTreeMapper, self).__init__(*args, **kwargs)
+        # (ccnode, ancestors, remap_subtree) tuples for the changed nodes to map, in lft order
+        self.changed_nodes = []
+        # (lft, rght) bounds of the previously exported subtrees to delete before mapping
+        self.deleted_ranges = []
+        # Ids of the previously exported topics that are opened to map their descendants
+        self.existing_topic_ids = set()
+        # Ids of the export nodes whose children have been mapped
+        self.mapped_parent_ids = set()
+        # Number of nodes that will be remapped
+        self.remapped_nodes = 0
+
+    def prepare(self):
+        """
+        Works out which parts of the export tree need to be remapped. Returns False when that is
+        too large a part of the tree to be worth mapping incrementally, or when the previously
+        exported tree can't be updated incrementally at all.
+        """
+        lft, rght = self._get_tree_bounds()
+        max_remapped_nodes = INCREMENTAL_PUBLISH_THRESHOLD * (rght - lft + 1) / 2
+
+        exported_root = self._get_exported_nodes([self.root_node.node_id]).get(self.root_node.node_id)
+        if exported_root is None or exported_root["parent_id"] is not None:
+            return False
+
+        # The root node is always remapped, as its title and language come from the channel
+        queryset = self._get_queryset().filter(Q(changed=True) | Q(pk=self.root_node.pk), lft__gte=lft, rght__lte=rght)\
+            .annotate(parent_node_id=F("parent__node_id"))
+        if queryset.count() > max_remapped_nodes:
+            return False
+
+        # Studio (lft, rght) bounds of the subtrees that are already remapped or deleted as a whole
+        subtrees = []
+        for nodes in self._get_node_chunks(queryset):
+            exported_nodes = self._get_exported_nodes([node.node_id for node in nodes])
+            for node in nodes:
+                subtrees = [subtree for subtree in subtrees if subtree[1] > node.lft]
+                if any(subtree_lft <= node.lft for subtree_lft, _ in subtrees):
+                    continue
+                ancestors = list(self._get_queryset().filter(lft__lt=node.lft, rght__gt=node.rght))
+
+                if not all(ancestor.complete for ancestor in ancestors) or not self._is_node_publishable(node):
+                    subtrees.append(self._delete_unpublishable_subtree(node, ancestors))
+                elif node.kind_id == content_kinds.TOPIC and self._is_topic_moved_or_relabelled(node, exported_nodes.get(node.node_id)):
+                    subtrees.append(self._add_changed_node(node, ancestors, exported_nodes.get(node.node_id), remap_subtree=True))
+                else:
+                    self._add_changed_node(node, ancestors, exported_nodes.get(node.node_id))
+                    if node.kind_id == content_kinds.TOPIC:
+                        subtrees.extend(self._update_children(node, ancestors))
+
+                if self.remapped_nodes > max_remapped_nodes:
+                    return False
+        return True
+
+    def _is_topic_moved_or_relabelled(self, ccnode, exported_node):
+        # The labels of a topic are inherited by its descendants, so any change to them affects its whole subtree
+        return (
+            exported_node is None
+            or exported_node["parent_id"] != ccnode.parent_node_id
+            or self._get_label_values(exported_node) != self._get_label_values(self._get_topic_labels(ccnode))
+        )
+
+    def _add_changed_node(self, ccnode, ancestors, exported_node, remap_subtree=False):
+        if remap_subtree:
+            if exported_node:
+                self.deleted_ranges.append((exported_node["lft"], exported_node["rght"]))
+            self.remapped_nodes += (ccnode.rght - ccnode.lft + 1) // 2
+        else:
+            self.remapped_nodes += 1
+        self.changed_nodes.append((ccnode, ancestors, remap_subtree))
+        return ccnode.lft, ccnode.rght
+
+    def _update_children(self, ccnode, ancestors):
+        """
+        Deletes the exported children that have been removed from a topic, and adds the children
+        that have been moved into it to be remapped, returning the Studio bounds of their subtrees
+        """
+        children = list(self._get_queryset().filter(parent_id=ccnode.pk))
+        child_ids = set(child.node_id for child in children)
+        for exported_child in kolibrimodels.ContentNode.objects.filter(parent_id=ccnode.node_id).values("id", "lft", "rght"):
+            if exported_child["id"] not in child_ids:
+                self.deleted_ranges.append((exported_child["lft"], exported_child["rght"]))
+
+        subtrees = []
+        exported_children = self._get_exported_nodes(list(child_ids))
+        for child in children:
+            exported_child = exported_children.get(child.node_id)
+            if (exported_child is None or exported_child["parent_id"] != ccnode.node_id) and self._is_node_publishable(child):
+                subtrees.append(self._add_changed_node(child, ancestors + [ccnode], exported_child, remap_subtree=True))
+        return subtrees
+
+    def _delete_unpublishable_subtree(self, ccnode, ancestors):
+        """
+        Deletes the exported subtree of the node, or of its highest ancestor that is no longer
+        publishable, returning the Studio bounds of that subtree
+        """
+        subtree_root = next((ancestor for ancestor in ancestors if not ancestor.complete or not ancestor.has_resources), ccnode)
+        exported_subtree_root = self._get_exported_nodes([subtree_root.node_id]).get(subtree_root.node_id)
+        if exported_subtree_root:
+            self.deleted_ranges.append((exported_subtree_root["lft"], exported_subtree_root["rght"]))
+        return subtree_root.lft, subtree_root.rght
+
+    def _get_exported_nodes(self, node_ids):
+        exported_nodes = {}
+        for i in range(0, len(node_ids), self.batch_size):
+            for exported_node in kolibrimodels.ContentNode.objects.filter(id__in=node_ids[i:i + self.batch_size]).values(
+                "id", "parent_id", "lft", "rght", "lang_id", *inheritable_map_fields
+            ):
+                exported_nodes[exported_node["id"]] = exported_node
+        return exported_nodes
+
+    def _get_label_values(self, labels):
+        return tuple(labels[field] for field in ["lang_id"] + inheritable_map_fields)
+
+    def _get_topic_labels(self, ccnode):
+        # The values that _create_bare_contentnode exports for the labels that descendants of a topic inherit
+        language = ccnode.language or self.default_language
+        labels = {"lang_id": language.pk if language else None}
+        for field in inheritable_map_fields:
+            labels[field] = ",".join(getattr(ccnode, field).keys()) if getattr(ccnode, field) else None
+        return labels
+
+    def map_nodes(self):
+        with transaction.atomic(using=get_active_content_database()), \
+                ThreadPoolExecutor(max_workers=self.exercise_workers) as executor:
+            self._delete_previous_nodes()
+            # Don't create the objects the export database already has again
+            self.language_ids.update(kolibrimodels.Language.objects.values_list("id", flat=True))
+            self.tag_ids.update(kolibrimodels.ContentTag.objects.values_list("id", flat=True))
+            self.local_file_ids.update(kolibrimodels.LocalFile.objects.values_list("id", flat=True))
+            for node, ancestors, remap_subtree in self.changed_nodes:
+                self._open_ancestors(ancestors)
+                queryset = self._get_queryset()
+                if remap_subtree:
+                    queryset = queryset.filter(lft__gte=node.lft, rght__lte=node.rght)
+                else:
+                    queryset = queryset.filter(pk=node.pk)
+                    if node.kind_id == content_kinds.TOPIC:
+                        # Put the children of the topic back in order, in case they have been reordered
+                        self.mapped_parent_ids.add(node.node_id)
+                self._map_queryset(queryset, executor)
+            self._rebuild_tree()
+            delete_unused_export_objects()
+
+    def _delete_previous_nodes(self):
+        node_ids = set()
+        for lft, rght in self.deleted_ranges:
+            node_ids.update(kolibrimodels.ContentNode.objects.filter(lft__gte=lft, rght__lte=rght).values_list("id", flat=True))
+        for node, ancestors, remap_subtree in self.changed_nodes:
+            if remap_subtree:
+                # Include any nodes that have been moved into the subtree from elsewhere in the tree
+                node_ids.update(
+                    ccmodels.ContentNode.objects.filter(tree_id=node.tree_id, lft__gte=node.lft, rght__lte=node.rght)
+                    .values_list("node_id", flat=True)
+                )
+            else:
+                node_ids.add(node.node_id)
+        delete_export_nodes(list(node_ids), batch_size=self.batch_size)
+        # The prerequisites and channel metadata are all mapped again after the tree
+        kolibrimodels.ContentNode.has_prerequisite.through.objects.all().delete()
+        kolibrimodels.ChannelMetadata.objects.all().delete()
+
+    def _open_ancestors(self, ancestors):
+        self.open_topics = []
+        self.mapped_topic_ids = set()
+        exported_ids = self._get_exported_nodes([ancestor.node_id for ancestor in ancestors])
+        for ancestor in ancestors:
+            if ancestor.node_id in exported_ids:
+                self.existing_topic_ids.add(ancestor.node_id)
+                self.mapped_topic_ids.add(ancestor.pk)
+                metadata = self._get_inherited_metadata(ancestor)
+                self.open_topics.append((ancestor.rght, kolibrimodels.ContentNode(id=ancestor.node_id), metadata))
+            else:
+                # The ancestor had no resources when the channel was last published, so map it now
+                self._map_chunk([ancestor])
+
+    def _queue_node(self, kolibrinode):
+        if kolibrinode.id in self.existing_topic_ids:
+            return
+        self.mapped_parent_ids.add(kolibrinode.parent_id)
+        super(IncrementalTreeMapper, self)._queue_node(kolibrinode)
+
+    def _get_studio_order(self, parent_ids):
+        order = {}
+        parent_ids = [parent_id for parent_id in parent_ids if parent_id]
+        for i in range(0, len(parent_ids), self.batch_size):
+            order.update(
+                ccmodels.ContentNode.objects.filter(tree_id=self.root_node.tree_id, parent__node_id__in=parent_ids[i:i + self.batch_size])
+                .values_list("node_id", "lft")
+            )
+        return order
+
+    def _rebuild_tree(self):
+        """
+        Recalculates the MPTT fields of the export tree from the parent ids of its nodes,
+        and deletes any nodes that are no longer connected to its root
+        """
+        children = {}
+        previous_values = {}
+        for node_id, parent_id, lft, rght, level in kolibrimodels.ContentNode.objects.values_list("id", "parent_id", "lft", "rght", "level"):
+            children.setdefault(parent_id, []).append(node_id)
+            previous_values[node_id] = (lft, rght, level)
+
+        # Children of topics that have had nodes mapped into them are put in their order in Studio,
+        # while the order of the children of any other topic is unchanged
+        studio_order = self._get_studio_order(list(self.mapped_parent_ids))
+        for parent_id, child_ids in children.items():
+            if parent_id in self.mapped_parent_ids:
+                child_ids.sort(key=lambda child_id: studio_order.get(child_id, float("inf")))
+            else:
+                child_ids.sort(key=lambda child_id: previous_values[child_id][0])
+
+        values = {}
+        lft_values = {self.root_node.node_id: 1}
+        counter = 2
+        stack = [(self.root_node.node_id, 0, iter(children.get(self.root_node.node_id, [])))]
+        while stack:
+            node_id, level, child_ids = stack[-1]
+            child_id = next(child_ids, None)
+            if child_id is None:
+                stack.pop()
+                values[node_id] = (lft_values[node_id], counter, level)
+            else:
+                lft_values[child_id] = counter
+                stack.append((child_id, level + 1, iter(children.get(child_id, []))))
+            counter += 1
+
+        delete_export_nodes([node_id for node_id in previous_values if node_id not in values], batch_size=self.batch_size)
+        with connections[get_active_content_database()].cursor() as cursor:
+            cursor.executemany(
+                "UPDATE {} SET lft = %s, rght = %s, level = %s WHERE id = %s".format(kolibrimodels.ContentNode._meta.db_table),
+                [value + (node_id,) for node_id, value in values.items() if value != previous_values[node_id]],
+            )
 
 
 def create_slideshow_manifest(ccnode, user_id=None):
@@ -291,7 +1014,7 @@ def create_slideshow_manifest(ccnode, user_id=None):
             temp_manifest.seek(0)
             file_on_disk = File(open(temp_filepath, mode='rb'), name=filename)
             # Create the file in Studio
-            ccmodels.File.objects.create(
+            return ccmodels.File.objects.create(
                 file_on_disk=file_on_disk,
                 contentnode=ccnode,
                 file_format_id=file_formats.JSON,
@@ -304,96 +1027,8 @@ def create_slideshow_manifest(ccnode, user_id=None):
         temp_manifest.close()
 
 
-def create_bare_contentnode(ccnode, default_language, channel_id, channel_name, metadata):  # noqa: C901
-    logging.debug("Creating a Kolibri contentnode for instance id {}".format(
-        ccnode.node_id))
-
-    kolibri_license = None
-    if ccnode.license is not None:
-        kolibri_license = create_kolibri_license_object(ccnode)[0]
-
-    language = (ccnode.language if ccnode.kind_id == content_kinds.TOPIC else metadata.get("language")) or default_language
-    if language:
-        language, _new = get_or_create_language(language)
-
-    duration = None
-    if ccnode.kind_id in [content_kinds.AUDIO, content_kinds.VIDEO]:
-        # aggregate duration from associated files, choosing maximum if there are multiple, like hi and lo res videos
-        duration = ccnode.files.aggregate(duration=Max("duration")).get("duration")
-
-    options = {}
-    if ccnode.extra_fields and 'options' in ccnode.extra_fields:
-        options = ccnode.extra_fields['options']
-
-    duration = None
-    ccnode_completion_criteria = options.get("completion_criteria")
-    if ccnode_completion_criteria:
-        if ccnode_completion_criteria["model"] == completion_criteria.TIME or ccnode_completion_criteria["model"] == completion_criteria.APPROX_TIME:
-            duration = ccnode_completion_criteria["threshold"]
-    if duration is None and ccnode.kind_id in [content_kinds.AUDIO, content_kinds.VIDEO]:
-        # aggregate duration from associated files, choosing maximum if there are multiple, like hi and lo res videos.
-        duration = ccnode.files.aggregate(duration=Max("duration")).get("duration")
-
-    learning_activities = None
-    accessibility_labels = None
-    if ccnode.kind_id != content_kinds.TOPIC:
-        if ccnode.learning_activities:
-            learning_activities = ",".join(ccnode.learning_activities.keys())
-        if ccnode.accessibility_labels:
-            accessibility_labels = ",".join(ccnode.accessibility_labels.keys())
-
-    # Do not use the inherited metadata if this is a topic, just read from its own metadata instead.
-    grade_levels = ccnode.grade_levels if ccnode.kind_id == content_kinds.TOPIC else metadata["grade_levels"]
-    resource_types = ccnode.resource_types if ccnode.kind_id == content_kinds.TOPIC else metadata["resource_types"]
-    categories = ccnode.categories if ccnode.kind_id == content_kinds.TOPIC else metadata["categories"]
-    learner_needs = ccnode.learner_needs if ccnode.kind_id == content_kinds.TOPIC else metadata["learner_needs"]
-
-    kolibrinode, is_new = kolibrimodels.ContentNode.objects.update_or_create(
-        pk=ccnode.node_id,
-        defaults={
-            'kind': ccnode.kind.kind,
-            'title': ccnode.title if ccnode.parent else channel_name,
-            'content_id': ccnode.content_id,
-            'channel_id': channel_id,
-            'author': ccnode.author or "",
-            'description': ccnode.description,
-            'sort_order': ccnode.sort_order,
-            'license_owner': ccnode.copyright_holder or "",
-            'license': kolibri_license,
-            'available': ccnode.get_descendants(include_self=True).exclude(kind_id=content_kinds.TOPIC).exists(),  # Hide empty topics
-            'stemmed_metaphone': "",  # Stemmed metaphone is no longer used, and will cause no harm if blank
-            'lang': language,
-            'license_name': kolibri_license.license_name if kolibri_license is not None else None,
-            'license_description': kolibri_license.license_description if kolibri_license is not None else None,
-            'coach_content': ccnode.role_visibility == roles.COACH,
-            'duration': duration,
-            'options': options,
-            # Fields for metadata labels
-            "grade_levels": ",".join(grade_levels.keys()) if grade_levels else None,
-            "resource_types": ",".join(resource_types.keys()) if resource_types else None,
-            "learning_activities": learning_activities,
-            "accessibility_labels": accessibility_labels,
-            "categories": ",".join(categories.keys()) if categories else None,
-            "learner_needs": ",".join(learner_needs.keys()) if learner_needs else None,
-        }
-    )
-
-    if ccnode.parent:
-        logging.debug("Associating {child} with parent {parent}".format(
-            child=kolibrinode.pk,
-            parent=ccnode.parent.node_id
-        ))
-        kolibrinode.parent = kolibrimodels.ContentNode.objects.get(pk=ccnode.parent.node_id)
-
-    kolibrinode.save()
-    logging.debug("Created Kolibri ContentNode with node id {}".format(ccnode.node_id))
-    logging.debug("Kolibri node count: {}".format(kolibrimodels.ContentNode.objects.all().count()))
-
-    return kolibrinode
-
-
-def get_or_create_language(language):
-    return kolibrimodels.Language.objects.get_or_create(
+def create_kolibri_language_object(language):
+    return kolibrimodels.Language(
         id=language.pk,
         lang_code=language.lang_code,
         lang_subcode=language.lang_subcode,
@@ -440,66 +1075,119 @@ def create_associated_thumbnail(ccnode, ccfilemodel):
     )
 
 
-def create_associated_file_objects(kolibrinode, ccnode):
-    logging.debug("Creating LocalFile and File objects for Node {}".format(kolibrinode.id))
-    for ccfilemodel in ccnode.files.exclude(Q(preset_id=format_presets.EXERCISE_IMAGE) | Q(preset_id=format_presets.EXERCISE_GRAPHIE)):
-        preset = ccfilemodel.preset
-        fformat = ccfilemodel.file_format
-        if ccfilemodel.language:
-            get_or_create_language(ccfilemodel.language)
+def create_perseus_exercise(ccnode, kolibrinode, exercise_data, user_id=None):
+    logging.debug("Creating Perseus Exercise for Node {}".format(ccnode.title))
+    temppath, _ = build_perseus_zip(ccnode, exercise_data)
+    try:
+        return save_perseus_exercise(ccnode, temppath, user_id=user_id)
+    finally:
+        os.unlink(temppath)
 
-        if preset.thumbnail:
-            ccfilemodel = create_associated_thumbnail(ccnode, ccfilemodel) or ccfilemodel
 
-        kolibrilocalfilemodel, new = kolibrimodels.LocalFile.objects.get_or_create(
-            pk=ccfilemodel.checksum,
-            defaults={
-                'extension': fformat.extension,
-                'file_size': ccfilemodel.file_size,
+def get_perseus_archive_hash(exercise_data, assessment_items):
+    """
+    Hashes everything that create_perseus_zip writes to the archive of an exercise,
+    the assessment items should have their files prefetched
+    """
+    inputs = {
+        "version": PERSEUS_ARCHIVE_VERSION,
+        "exercise": exercise_data,
+        "assessment_items": [
+            {
+                "assessment_id": item.assessment_id,
+                "type": item.type,
+                "question": item.question,
+                "answers": item.answers,
+                "hints": item.hints,
+                "raw_data": item.raw_data,
+                "randomize": item.randomize,
+                "files": sorted(
+                    (f.preset_id or "", f.checksum or "", f.file_format_id or "", f.original_filename or "")
+                    for f in item.files.all()
+                ),
             }
-        )
+            for item in assessment_items
+        ],
+    }
+    return hashlib.md5(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
 
-        kolibrimodels.File.objects.create(
-            pk=ccfilemodel.pk,
-            checksum=ccfilemodel.checksum,
-            extension=fformat.extension,
-            available=True,  # TODO: Set this to False, once we have availability stamping implemented in Kolibri
-            file_size=ccfilemodel.file_size,
-            contentnode=kolibrinode,
-            preset=preset.pk,
-            supplementary=preset.supplementary,
-            lang_id=ccfilemodel.language and ccfilemodel.language.pk,
-            thumbnail=preset.thumbnail,
-            priority=preset.order,
-            local_file=kolibrilocalfilemodel,
-        )
 
+def get_cached_perseus_exercise(ccnode, archive_hash, files, user_id=None):
+    """
+    Returns an exercise file for the node from a previously built archive with the same inputs, reusing its
+    stored object instead of rendering and uploading it again, or None if no such archive is available
+        Args:
+            ccnode (<ContentNode>): exercise node to get the file for
+            archive_hash (str): hash of the inputs of the archive, from get_perseus_archive_hash
+            files (list): the current files of the node
+    """
+    for f in files:
+        if f.preset_id == format_presets.EXERCISE and f.archive_hash == archive_hash:
+            return f
+
+    previous = ccmodels.File.objects.filter(
+        archive_hash=archive_hash, preset_id=format_presets.EXERCISE
+    ).exclude(checksum="").values("checksum", "file_size").first()
+    if not previous:
+        return None
 
-def create_perseus_exercise(ccnode, kolibrinode, exercise_data, user_id=None):
-    logging.debug("Creating Perseus Exercise for Node {}".format(ccnode.title))
     filename = "{0}.{ext}".format(ccnode.title, ext=file_formats.PERSEUS)
-    temppath = None
-    try:
-        with tempfile.NamedTemporaryFile(suffix="zip", delete=False) as tempf:
-            temppath = tempf.name
-            create_perseus_zip(ccnode, exercise_data, tempf)
-            file_size = tempf.tell()
-            tempf.flush()
+    storage_name = ccmodels.generate_object_storage_name(previous["checksum"], filename)
+    if not storage.exists(storage_name):
+        return None
+
+    ccnode.files.filter(preset_id=format_presets.EXERCISE).delete()
+    return ccmodels.File.objects.create(
+        file_on_disk=storage_name,
+        checksum=previous["checksum"],
+        contentnode=ccnode,
+        file_format_id=file_formats.PERSEUS,
+        preset_id=format_presets.EXERCISE,
+        original_filename=filename,
+        file_size=previous["file_size"],
+        uploaded_by_id=user_id,
+        archive_hash=archive_hash,
+    )
 
-            ccnode.files.filter(preset_id=format_presets.EXERCISE).delete()
 
-            assessment_file_obj = ccmodels.File.objects.create(
-                file_on_disk=File(open(temppath, 'rb'), name=filename),
-                contentnode=ccnode,
-                file_format_id=file_formats.PERSEUS,
-                preset_id=format_presets.EXERCISE,
-                original_filename=filename,
-                file_size=file_size,
-                uploaded_by_id=user_id,
-            )
-            logging.debug("Created exercise for {0} with checksum {1}".format(ccnode.title, assessment_file_obj.checksum))
-    finally:
-        temppath and os.unlink(temppath)
+def build_perseus_zip(ccnode, exercise_data, assessment_items=None, channel_id=None, assets=None):
+    """
+    Writes the Perseus archive of an exercise to a temporary file, which the caller is responsible for removing.
+    When its assessment items and channel id are passed in, this doesn't query the database,
+    so it is safe to run outside of the main thread.
+        Returns: (path of the archive, seconds taken to build it)
+    """
+    start = time.time()
+    with tempfile.NamedTemporaryFile(suffix="zip", delete=False) as tempf:
+        try:
+            create_perseus_zip(ccnode, exercise_data, tempf, assessment_items=assessment_items, channel_id=channel_id, assets=assets)
+        except Exception:
+            os.unlink(tempf.name)
+            raise
+    return tempf.name, time.time() - start
+
+
+def save_perseus_exercise(ccnode, temppath, user_id=None, archive_hash=None):
+    """
+    Replaces the exercise file of a node with the Perseus archive at temppath,
+    recording the hash of the inputs it was built from for later publishes to reuse
+    """
+    filename = "{0}.{ext}".format(ccnode.title, ext=file_formats.PERSEUS)
+    ccnode.files.filter(preset_id=format_presets.EXERCISE).delete()
+
+    with open(temppath, 'rb') as archive:
+        assessment_file_obj = ccmodels.File.objects.create(
+            file_on_disk=File(archive, name=filename),
+            contentnode=ccnode,
+            file_format_id=file_formats.PERSEUS,
+            preset_id=format_presets.EXERCISE,
+            original_filename=filename,
+            file_size=os.path.getsize(temppath),
+            uploaded_by_id=user_id,
+            archive_hash=archive_hash,
+        )
+    logging.debug("Created exercise for {0} with checksum {1}".format(ccnode.title, assessment_file_obj.checksum))
+    return assessment_file_obj
 
 
 def parse_assessment_metadata(ccnode):
@@ -511,9 +1199,13 @@ def parse_assessment_metadata(ccnode):
     return randomize, extra_fields.get('options').get('completion_criteria').get('threshold')
 
 
-def process_assessment_metadata(ccnode, kolibrinode):
+def process_assessment_metadata(ccnode, kolibrinode, assessment_items=None):
+    """
+    Returns the exercise data for the Perseus archive and an unsaved AssessmentMetaData for the kolibri node
+    """
     # Get mastery model information, set to default if none provided
-    assessment_items = ccnode.assessment_items.all().order_by('order')
+    if assessment_items is None:
+        assessment_items = list(ccnode.assessment_items.all().order_by('order'))
     assessment_item_ids = [a.assessment_id for a in assessment_items]
 
     randomize, mastery_criteria = parse_assessment_metadata(ccnode)
@@ -523,10 +1215,10 @@ def process_assessment_metadata(ccnode, kolibrinode):
 
     mastery_model = {'type': exercise_data_type or exercises.M_OF_N}
     if mastery_model['type'] == exercises.M_OF_N:
-        mastery_model.update({'n': exercise_data.get('n') or min(5, assessment_items.count()) or 1})
-        mastery_model.update({'m': exercise_data.get('m') or min(5, assessment_items.count()) or 1})
+        mastery_model.update({'n': exercise_data.get('n') or min(5, len(assessment_items)) or 1})
+        mastery_model.update({'m': exercise_data.get('m') or min(5, len(assessment_items)) or 1})
     elif mastery_model['type'] == exercises.DO_ALL:
-        mastery_model.update({'n': assessment_items.count() or 1, 'm': assessment_items.count() or 1})
+        mastery_model.update({'n': len(assessment_items) or 1, 'm': len(assessment_items) or 1})
     elif mastery_model['type'] == exercises.NUM_CORRECT_IN_A_ROW_2:
         mastery_model.update({'n': 2, 'm': 2})
     elif mastery_model['type'] == exercises.NUM_CORRECT_IN_A_ROW_3:
@@ -546,20 +1238,123 @@ def process_assessment_metadata(ccnode, kolibrinode):
         'assessment_mapping': {a.assessment_id: a.type if a.type != 'true_false' else exercises.SINGLE_SELECTION for a in assessment_items},
     })
 
-    kolibrimodels.AssessmentMetaData.objects.create(
+    assessment_metadata = kolibrimodels.AssessmentMetaData(
         id=uuid.uuid4(),
         contentnode=kolibrinode,
         assessment_item_ids=assessment_item_ids,
-        number_of_assessments=assessment_items.count(),
+        number_of_assessments=len(assessment_items),
         mastery_model=mastery_model,
         randomize=randomize,
         is_manipulable=ccnode.kind_id == content_kinds.EXERCISE,
     )
 
-    return exercise_data
+    return exercise_data, assessment_metadata
+
+
+def get_question_files(question, preset_id):
+    return sorted((f for f in question.files.all() if f.preset_id == preset_id), key=lambda f: f.checksum or "")
+
+
+def read_storage_file(storage_name):
+    with storage.open(storage_name, 'rb') as f:
+        return f.read()
+
+
+def get_assessment_item_texts(assessment_item):
+    """
+    Returns the question, answers and hints of an item that write_assessment_item looks for images in
+    """
+    texts = [assessment_item.question]
+    try:
+        if assessment_item.type != exercises.INPUT_QUESTION:
+            texts.extend(answer.get('answer') for answer in json.loads(assessment_item.answers))
+        texts.extend(hint.get('hint') for hint in json.loads(assessment_item.hints))
+    except (AttributeError, TypeError, ValueError):
+        # Malformed items are reported when their archive is written
+        pass
+    return [text for text in texts if isinstance(text, basestring)]
+
+
+def get_assessment_item_storage_names(assessment_item):
+    """
+    Returns the storage names of the images that are written to the Perseus archive for an item,
+    the item should have its files prefetched
+    """
+    storage_names = [
+        ccmodels.generate_object_storage_name(f.checksum, str(f))
+        for f in assessment_item.files.all()
+        if f.checksum and f.preset_id in (format_presets.EXERCISE_IMAGE, format_presets.EXERCISE_GRAPHIE)
+    ]
+    for text in get_assessment_item_texts(assessment_item):
+        text = text.replace(exercises.CONTENT_STORAGE_PLACEHOLDER, PERSEUS_IMG_DIR)
+        for match in IMAGE_MARKDOWN_REGEX.finditer(text):
+            img_match = IMAGE_PATH_REGEX.search(match.group(1))
+            if not img_match:
+                continue
+            filename = img_match.group(1).split('/')[-1]
+            checksum = os.path.splitext(filename)[0]
+            try:
+                int(checksum, 16)
+            except ValueError:
+                # Improper checksums are reported by process_image_strings
+                continue
+            storage_names.append(ccmodels.generate_object_storage_name(checksum, filename))
+    return storage_names
+
+
+class ExerciseAssetLoader(object):
+    """
+    Downloads the images of exercises from storage ahead of writing their Perseus archives.
+    All of the images referenced by the items passed to `prefetch` are downloaded concurrently,
+    so that writing the archives only waits on the slowest download rather than on each in turn.
+    Images that weren't prefetched are read from storage when they are needed.
+    """
+
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or settings.PUBLISH_EXERCISE_IMAGE_WORKERS)
+        # Futures of the contents of the prefetched images, keyed by storage name
+        self.downloads = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
 
+    def prefetch(self, assessment_items):
+        for item in assessment_items:
+            for storage_name in get_assessment_item_storage_names(item):
+                if storage_name not in self.downloads:
+                    self.downloads[storage_name] = self.executor.submit(read_storage_file, storage_name)
+
+    def read(self, storage_name):
+        download = self.downloads.get(storage_name)
+        if download is None:
+            return read_storage_file(storage_name)
+        return download.result()
+
+    def close(self):
+        for download in self.downloads.values():
+            download.cancel()
+        self.executor.shutdown(wait=True)
+        self.downloads = {}
+
+
+def create_perseus_zip(ccnode, exercise_data, write_to_path, assessment_items=None, channel_id=None, assets=None):  # noqa C901
+    """
+    Writes the Perseus archive of an exercise, the assessment items should have their files prefetched.
+    Images are read through `assets`, an ExerciseAssetLoader that has prefetched the assessment items,
+    if one isn't passed in the images of this exercise are downloaded concurrently before it is written.
+    """
+    if assets is None:
+        if assessment_items is None:
+            assessment_items = list(ccnode.assessment_items.prefetch_related(
+                Prefetch("files", queryset=ccmodels.File.objects.select_related("file_format"))
+            ).order_by('order'))
+        with ExerciseAssetLoader() as assets:
+            assets.prefetch(assessment_items)
+            return create_perseus_zip(ccnode, exercise_data, write_to_path, assessment_items, channel_id, assets)
 
-def create_perseus_zip(ccnode, exercise_data, write_to_path):
     with zipfile.ZipFile(write_to_path, "w") as zf:
         try:
             exercise_context = {
@@ -568,27 +1363,30 @@ def create_perseus_zip(ccnode, exercise_data, write_to_path):
             exercise_result = render_to_string('perseus/exercise.json', exercise_context)
             write_to_zipfile("exercise.json", exercise_result, zf)
 
-            channel_id = ccnode.get_channel_id()
+            channel_id = channel_id or ccnode.get_channel_id()
+            # Names of the images written to the archive, to only write each image once
+            written_names = set()
 
-            for question in ccnode.assessment_items.prefetch_related('files').all().order_by('order'):
+            for question in assessment_items:
                 try:
-                    for image in question.files.filter(preset_id=format_presets.EXERCISE_IMAGE).order_by('checksum'):
+                    for image in get_question_files(question, format_presets.EXERCISE_IMAGE):
                         image_name = "images/{}.{}".format(image.checksum, image.file_format_id)
-                        if image_name not in zf.namelist():
-                            with storage.open(ccmodels.generate_object_storage_name(image.checksum, str(image)), 'rb') as content:
-                                write_to_zipfile(image_name, content.read(), zf)
+                        if image_name not in written_names:
+                            content = assets.read(ccmodels.generate_object_storage_name(image.checksum, str(image)))
+                            write_to_zipfile(image_name, content, zf)
+                            written_names.add(image_name)
 
-                    for image in question.files.filter(preset_id=format_presets.EXERCISE_GRAPHIE).order_by('checksum'):
+                    for image in get_question_files(question, format_presets.EXERCISE_GRAPHIE):
                         svg_name = "images/{0}.svg".format(image.original_filename)
                         json_name = "images/{0}-data.json".format(image.original_filename)
-                        if svg_name not in zf.namelist() or json_name not in zf.namelist():
-                            with storage.open(ccmodels.generate_object_storage_name(image.checksum, str(image)), 'rb') as content:
-                                content = content.read()
-                                # in Python 3, delimiter needs to be in bytes format
-                                content = content.split(exercises.GRAPHIE_DELIMITER.encode('ascii'))
-                                write_to_zipfile(svg_name, content[0], zf)
-                                write_to_zipfile(json_name, content[1], zf)
-                    write_assessment_item(question, zf, channel_id)
+                        if svg_name not in written_names or json_name not in written_names:
+                            content = assets.read(ccmodels.generate_object_storage_name(image.checksum, str(image)))
+                            # in Python 3, delimiter needs to be in bytes format
+                            content = content.split(exercises.GRAPHIE_DELIMITER.encode('ascii'))
+                            write_to_zipfile(svg_name, content[0], zf)
+                            write_to_zipfile(json_name, content[1], zf)
+                            written_names.update((svg_name, json_name))
+                    write_assessment_item(question, zf, channel_id, assets=assets, written_names=written_names)
                 except Exception as e:
                     logging.error("Error while publishing channel `{}`: {}".format(channel_id, str(e)))
                     logging.error(traceback.format_exc())
@@ -613,7 +1411,7 @@ def write_to_zipfile(filename, content, zf):
     zf.writestr(info, content)
 
 
-def write_assessment_item(assessment_item, zf, channel_id):  # noqa C901
+def write_assessment_item(assessment_item, zf, channel_id, assets=None, written_names=None):  # noqa C901
     if assessment_item.type == exercises.MULTIPLE_SELECTION:
         template = 'perseus/multiple_selection.json'
     elif assessment_item.type == exercises.SINGLE_SELECTION or assessment_item.type == 'true_false':
@@ -626,7 +1424,7 @@ def write_assessment_item(assessment_item, zf, channel_id):  # noqa C901
         raise TypeError("Unrecognized question type on item {}".format(assessment_item.assessment_id))
 
     question = process_formulas(assessment_item.question)
-    question, question_images = process_image_strings(question, zf, channel_id)
+    question, question_images = process_image_strings(question, zf, channel_id, assets, written_names)
 
     answer_data = json.loads(assessment_item.answers)
     for answer in answer_data:
@@ -636,14 +1434,14 @@ def write_assessment_item(assessment_item, zf, channel_id):  # noqa C901
             answer['answer'] = answer['answer'].replace(exercises.CONTENT_STORAGE_PLACEHOLDER, PERSEUS_IMG_DIR)
             answer['answer'] = process_formulas(answer['answer'])
             # In case perseus doesn't support =wxh syntax, use below code
-            answer['answer'], answer_images = process_image_strings(answer['answer'], zf, channel_id)
+            answer['answer'], answer_images = process_image_strings(answer['answer'], zf, channel_id, assets, written_names)
             answer.update({'images': answer_images})
 
     answer_data = [a for a in answer_data if a['answer'] or a['answer'] == 0]  # Filter out empty answers, but not 0
     hint_data = json.loads(assessment_item.hints)
     for hint in hint_data:
         hint['hint'] = process_formulas(hint['hint'])
-        hint['hint'], hint_images = process_image_strings(hint['hint'], zf, channel_id)
+        hint['hint'], hint_images = process_image_strings(hint['hint'], zf, channel_id, assets, written_names)
         hint.update({'images': hint_images})
 
     answers_sorted = answer_data
@@ -678,11 +1476,13 @@ def process_formulas(content):
     return content
 
 
-def process_image_strings(content, zf, channel_id):
+def process_image_strings(content, zf, channel_id, assets=None, written_names=None):
     image_list = []
+    if written_names is None:
+        written_names = set(zf.namelist())
     content = content.replace(exercises.CONTENT_STORAGE_PLACEHOLDER, PERSEUS_IMG_DIR)
-    for match in re.finditer(r'!\[(?:[^\]]*)]\(([^\)]+)\)', content):
-        img_match = re.search(r'(.+/images/[^\s]+)(?:\s=([0-9\.]+)x([0-9\.]+))*', match.group(1))
+    for match in IMAGE_MARKDOWN_REGEX.finditer(content):
+        img_match = IMAGE_PATH_REGEX.search(match.group(1))
         if img_match:
             # Add any image files that haven't been written to the zipfile
             filename = img_match.group(1).split('/')[-1]
@@ -702,9 +1502,10 @@ def process_image_strings(content, zf, channel_id):
                     raise
 
             image_name = "images/{}.{}".format(checksum, ext[1:])
-            if image_name not in zf.namelist():
-                with storage.open(ccmodels.generate_object_storage_name(checksum, filename), 'rb') as imgfile:
-                    write_to_zipfile(image_name, imgfile.read(), zf)
+            if image_name not in written_names:
+                storage_name = ccmodels.generate_object_storage_name(checksum, filename)
+                write_to_zipfile(image_name, assets.read(storage_name) if assets else read_storage_file(storage_name), zf)
+                written_names.add(image_name)
 
             # Add resizing data
             if img_match.group(2) and img_match.group(3):
@@ -718,16 +1519,30 @@ def process_image_strings(content, zf, channel_id):
 
 
 def map_prerequisites(root_node):
+    """
+    Maps the prerequisite relationships of the tree between the nodes that were exported.
+    Returns the number of prerequisite relationships that were mapped.
+    """
+    relationships = set(
+        ccmodels.PrerequisiteContentRelationship.objects.filter(prerequisite__tree_id=root_node.tree_id)
+        .values_list('target_node__node_id', 'prerequisite__node_id')
+    )
+    exported_node_ids = set(kolibrimodels.ContentNode.objects.values_list('id', flat=True))
+    mapped = [
+        (target_node_id, prerequisite_node_id) for target_node_id, prerequisite_node_id in relationships
+        if target_node_id in exported_node_ids and prerequisite_node_id in exported_node_ids
+    ]
 
-    for n in ccmodels.PrerequisiteContentRelationship.objects.filter(prerequisite__tree_id=root_node.tree_id)\
-            .values('prerequisite__node_id', 'target_node__node_id'):
-        try:
-            target_node = kolibrimodels.ContentNode.objects.get(pk=n['target_node__node_id'])
-            target_node.has_prerequisite.add(n['prerequisite__node_id'])
-        except kolibrimodels.ContentNode.DoesNotExist as e:
-            logging.error('Unable to find prerequisite {}'.format(str(e)))
-        except IntegrityError as e:
-            logging.error('Unable to find source node for prerequisite relationship {}'.format(str(e)))
+    Through = kolibrimodels.ContentNode.has_prerequisite.through
+    Through.objects.bulk_create(
+        [Through(from_contentnode_id=target_node_id, to_contentnode_id=prerequisite_node_id) for target_node_id, prerequisite_node_id in mapped],
+        batch_size=BATCH_SIZE,
+    )
+
+    dropped = len(relationships) - len(mapped)
+    if dropped:
+        logging.error('Unable to map {} prerequisite relationships of tree {} as their nodes were not exported'.format(dropped, root_node.tree_id))
+    return len(mapped)
 
 
 def map_channel_to_kolibri_channel(channel):
@@ -772,24 +1587,6 @@ def convert_channel_thumbnail(channel):
     return get_thumbnail_encoding(channel.thumbnail)
 
 
-def map_tags_to_node(kolibrinode, ccnode):
-    """ map_tags_to_node: assigns tags to nodes (creates fk relationship)
-        Args:
-            kolibrinode (kolibri.models.ContentNode): node to map tag to
-            ccnode (contentcuration.models.ContentNode): node with tags to map
-        Returns: None
-    """
-    tags_to_add = []
-
-    for tag in ccnode.tags.all():
-        t, _new = kolibrimodels.ContentTag.objects.get_or_create(pk=tag.pk, tag_name=tag.tag_name)
-        if len(t.tag_name) <= MAX_TAG_LENGTH:
-            tags_to_add.append(t)
-
-    kolibrinode.tags.set(tags_to_add)
-    kolibrinode.save()
-
-
 def raise_if_nodes_are_all_unchanged(channel):
 
     logging.debug("Checking if we have any changed nodes.")
@@ -806,27 +1603,139 @@ def raise_if_nodes_are_all_unchanged(channel):
 def mark_all_nodes_as_published(channel):
     logging.debug("Marking all nodes as published.")
 
-    channel.main_tree.get_family().update(changed=False, published=True)
+    count = channel.main_tree.get_family().update(changed=False, published=True)
+    # None of the nodes of the tree are changed anymore
+    ccmodels.ContentNodeAggregate.objects.filter(contentnode__tree_id=channel.main_tree.tree_id).update(updated_count=0, new_count=0)
+    bump_tree_revisions(channel.main_tree.tree_id)
 
     logging.info("Marked all nodes as published.")
+    return count
 
 
 def save_export_database(channel_id, version):
+    """
+    Uploads the active export database once, as the given version of the channel, and copies it
+    within the storage to the channel's latest database. A manifest is saved next to each of them,
+    so that the databases can be checked once they have been downloaded.
+    Returns the number of bytes uploaded.
+    """
     logging.debug("Saving export database")
     current_export_db_location = get_active_content_database()
-    target_paths = [
-        os.path.join(
-            settings.DB_ROOT, "{id}.sqlite3".format(id=channel_id)
-        ),
-        os.path.join(
-            settings.DB_ROOT, "{}-{}.sqlite3".format(channel_id, version)
-        ),
-    ]
+    version_export_db_location = os.path.join(settings.DB_ROOT, "{}-{}.sqlite3".format(channel_id, version))
+    latest_export_db_location = os.path.join(settings.DB_ROOT, "{id}.sqlite3".format(id=channel_id))
+
+    with open(current_export_db_location, 'rb') as currentf:
+        version_export_db_location = storage.save(version_export_db_location, currentf)
+    logging.info("Successfully copied to {}".format(version_export_db_location))
+    copy_file(version_export_db_location, latest_export_db_location)
+    logging.info("Successfully copied to {}".format(latest_export_db_location))
+
+    manifest = create_export_database_manifest(current_export_db_location, version)
+    manifest_content = json.dumps(manifest).encode("utf-8")
+    for target_export_db_location in (version_export_db_location, latest_export_db_location):
+        manifest_location = get_export_database_manifest_location(target_export_db_location)
+        if storage.exists(manifest_location):
+            storage.delete(manifest_location)
+        storage.save(manifest_location, ContentFile(manifest_content))
+    return manifest["size"] + 2 * len(manifest_content)
+
+
+def get_export_database_manifest_location(export_db_location):
+    return "{}.json".format(os.path.splitext(export_db_location)[0])
+
+
+def create_export_database_manifest(path, version):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    return {
+        "version": version,
+        "size": os.path.getsize(path),
+        "md5": md5.hexdigest(),
+        "schema_version": MIN_SCHEMA_VERSION,
+    }
+
 
-    for target_export_db_location in target_paths:
-        with open(current_export_db_location, 'rb') as currentf:
-            storage.save(target_export_db_location, currentf)
-        logging.info("Successfully copied to {}".format(target_export_db_location))
+def get_export_database_manifest(export_db_location):
+    """
+    Returns the manifest saved next to an export database in storage, or None if it has none,
+    as is the case for databases published before manifests were added
+    """
+    manifest_location = get_export_database_manifest_location(export_db_location)
+    if not storage.exists(manifest_location):
+        return None
+    with storage.open(manifest_location, "rb") as f:
+        return json.loads(f.read())
+
+
+def check_export_database(path, manifest):
+    """
+    Returns whether the downloaded export database at `path` matches its manifest
+    """
+    if manifest is None:
+        return True
+    actual = create_export_database_manifest(path, manifest["version"])
+    return actual["size"] == manifest["size"] and actual["md5"] == manifest["md5"]
+
+
+def copy_previous_export_database(channel, path):
+    """
+    Copies the export database of the currently published version of the channel to `path`.
+    Returns False if the channel has never been published, or its export database can't be found or doesn't match its manifest.
+    """
+    if not channel.version:
+        return False
+    previous_export_db_location = os.path.join(settings.DB_ROOT, "{}-{}.sqlite3".format(channel.id, channel.version))
+    if not storage.exists(previous_export_db_location):
+        return False
+    with storage.open(previous_export_db_location, "rb") as previousf, open(path, "wb") as tempf:
+        shutil.copyfileobj(previousf, tempf)
+    if not check_export_database(path, get_export_database_manifest(previous_export_db_location)):
+        logging.warning("Previous export database {} does not match its manifest".format(previous_export_db_location))
+        return False
+    logging.info("Copied previous export database from {}".format(previous_export_db_location))
+    return True
+
+
+def clear_export_database():
+    """
+    Deletes every row of the active export database
+    """
+    database = get_active_content_database()
+    with transaction.atomic(using=database):
+        for model in apps.get_app_config("content").get_models(include_auto_created=True):
+            model.objects.all()._raw_delete(database)
+
+
+def delete_export_nodes(node_ids, batch_size=BATCH_SIZE):
+    """
+    Deletes the nodes with the given ids from the active export database, along with their files,
+    assessment metadata and tag and relation rows. The rows are deleted directly as the deletion of
+    a node doesn't cascade to its descendants, which are either deleted or remapped along with it.
+    """
+    database = get_active_content_database()
+    for i in range(0, len(node_ids), batch_size):
+        chunk = node_ids[i:i + batch_size]
+        kolibrimodels.File.objects.filter(contentnode_id__in=chunk)._raw_delete(database)
+        kolibrimodels.AssessmentMetaData.objects.filter(contentnode_id__in=chunk)._raw_delete(database)
+        kolibrimodels.ContentNode.tags.through.objects.filter(contentnode_id__in=chunk)._raw_delete(database)
+        kolibrimodels.ContentNode.related.through.objects.filter(
+            Q(from_contentnode_id__in=chunk) | Q(to_contentnode_id__in=chunk)
+        )._raw_delete(database)
+        kolibrimodels.ContentNode.objects.filter(id__in=chunk)._raw_delete(database)
+
+
+def delete_unused_export_objects():
+    """
+    Deletes the local files, tags, languages and licenses that are no longer used by any node
+    of the active export database
+    """
+    database = get_active_content_database()
+    kolibrimodels.LocalFile.objects.filter(files__isnull=True)._raw_delete(database)
+    kolibrimodels.ContentTag.objects.filter(tagged_content__isnull=True)._raw_delete(database)
+    kolibrimodels.Language.objects.filter(contentnode__isnull=True, file__isnull=True)._raw_delete(database)
+    kolibrimodels.License.objects.filter(contentnode__isnull=True)._raw_delete(database)
 
 
 def add_tokens_to_channel(channel):
@@ -835,33 +1744,54 @@ def add_tokens_to_channel(channel):
         channel.make_token()
 
 
-def fill_published_fields(channel, version_notes):
-    channel.last_published = timezone.now()
-    published_nodes = channel.main_tree.get_descendants().filter(published=True).prefetch_related('files')
-    channel.total_resource_count = published_nodes.exclude(kind_id=content_kinds.TOPIC).count()
-    kind_counts = list(published_nodes.values('kind_id').annotate(count=Count('kind_id')).order_by('kind_id'))
-    channel.published_kind_count = json.dumps(kind_counts)
-    channel.published_size = published_nodes.values('files__checksum', 'files__file_size').distinct(
-    ).aggregate(resource_size=Sum('files__file_size'))['resource_size'] or 0
+def get_published_stats(channel):
+    """
+    Returns the resource count, kind counts, size and languages of the published nodes of a channel,
+    aggregated in a single pass over the nodes and their files
+    """
+    rows = channel.main_tree.get_descendants().filter(published=True).order_by('lft').values_list(
+        'id', 'kind_id', 'language_id', 'files__checksum', 'files__file_size', 'files__language_id'
+    )
+    kind_counts = Counter()
+    file_sizes = set()
+    languages = set()
+    last_node_id = None
+    # Nodes are read in tree order, so the rows of the files of a node are consecutive
+    for node_id, kind_id, language_id, checksum, file_size, file_language_id in rows.iterator(chunk_size=BATCH_SIZE):
+        if node_id != last_node_id:
+            last_node_id = node_id
+            if kind_id:
+                kind_counts[kind_id] += 1
+            if language_id:
+                languages.add(language_id)
+        # Files with the same content are only counted once towards the size of the channel
+        if file_size is not None:
+            file_sizes.add((checksum, file_size))
+        languages.add(file_language_id)
+
+    return {
+        'resource_count': sum(count for kind_id, count in kind_counts.items() if kind_id != content_kinds.TOPIC),
+        'kind_count': [{'kind_id': kind_id, 'count': kind_counts[kind_id]} for kind_id in sorted(kind_counts)],
+        'size': sum(file_size for _checksum, file_size in file_sizes),
+        'included_languages': list(languages),
+    }
 
-    node_languages = published_nodes.exclude(language=None).values_list('language', flat=True)
-    file_languages = published_nodes.values_list('files__language', flat=True)
-    language_list = list(set(chain(node_languages, file_languages)))
 
-    for lang in language_list:
-        if lang:
-            channel.included_languages.add(lang)
+def fill_published_fields(channel, version_notes):
+    channel.last_published = timezone.now()
+    stats = get_published_stats(channel)
+    channel.total_resource_count = stats['resource_count']
+    channel.published_kind_count = json.dumps(stats['kind_count'])
+    channel.published_size = stats['size']
+    channel.included_languages.add(*[lang for lang in stats['included_languages'] if lang])
 
     # TODO: Eventually, consolidate above operations to just use this field for storing historical data
     channel.published_data.update({
-        channel.version: {
-            'resource_count': channel.total_resource_count,
-            'kind_count': kind_counts,
-            'size': channel.published_size,
-            'date_published': channel.last_published.strftime(settings.DATE_TIME_FORMAT),
-            'version_notes': version_notes,
-            'included_languages': language_list
-        }
+        channel.version: dict(
+            stats,
+            date_published=channel.last_published.strftime(settings.DATE_TIME_FORMAT),
+            version_notes=version_notes,
+        )
     })
     channel.save()
 
@@ -924,14 +1854,24 @@ def publish_channel(
     channel = ccmodels.Channel.objects.get(pk=channel_id)
     kolibri_temp_db = None
     start = time.time()
+    profiler = PublishProfiler()
     try:
         set_channel_icon_encoding(channel)
-        kolibri_temp_db = create_content_database(channel, force, user_id, force_exercises, progress_tracker=progress_tracker)
+        kolibri_temp_db = create_content_database(
+            channel, force, user_id, force_exercises, progress_tracker=progress_tracker, profiler=profiler
+        )
         increment_channel_version(channel)
         add_tokens_to_channel(channel)
-        sync_contentnode_and_channel_tsvectors(channel_id=channel.id)
-        mark_all_nodes_as_published(channel)
-        fill_published_fields(channel, version_notes)
+        with profiler.stage("tsvector_sync"):
+            sync_contentnode_and_channel_tsvectors(channel_id=channel.id)
+        with profiler.stage("mark_published") as stage:
+            stage["nodes"] += mark_all_nodes_as_published(channel)
+        with profiler.stage("fill_published_fields") as stage:
+            fill_published_fields(channel, version_notes)
+            stage["nodes"] += channel.total_resource_count
+        # Keep the profile with the version, so that regressions can be spotted across the versions of a channel
+        channel.published_data[channel.version]["profile"] = profiler.get_profile()
+        channel.save(update_fields=["published_data"])
 
         # Attributes not getting set for some reason, so just save it here
         channel.main_tree.publishing = False
@@ -960,6 +1900,10 @@ def publish_channel(
             os.remove(kolibri_temp_db)
         channel.main_tree.publishing = False
         channel.main_tree.save()
+        profile = profiler.get_profile()
+        logging.info("Publish profile for channel {}: {}".format(channel_id, json.dumps(profile)))
+        if progress_tracker:
+            ccmodels.CustomTaskMetadata.objects.filter(task_id=progress_tracker.task_id).update(profile=profile)
 
     elapsed = time.time() - start
 
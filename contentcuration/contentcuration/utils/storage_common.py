@@ -5,6 +5,7 @@ from urllib.parse import urlparse
 
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.core.files.storage import FileSystemStorage
 from django_s3_storage.storage import S3Storage
 
 from .gcs_storage import GoogleCloudStorage
@@ -29,6 +30,31 @@ def is_gcs_backend():
     return "storage.googleapis.com" in host
 
 
+def copy_file(src_name, dst_name, storage=default_storage):
+    """
+    Copies a file to another name within the storage, overwriting any file already there.
+
+    The copy is made without downloading the file wherever the backend allows it: with a
+    server side copy on S3 and GCS, and a hard link on the local file system.
+
+    :param: src_name: the name of the file to copy.
+    :param: dst_name: the name to copy the file to.
+    :param: storage: the storage backend holding the file.
+    """
+    if isinstance(storage, (GoogleCloudStorage, S3Storage)):
+        storage.copy(src_name, dst_name)
+    elif isinstance(storage, FileSystemStorage):
+        if storage.exists(dst_name):
+            storage.delete(dst_name)
+        os.makedirs(os.path.dirname(storage.path(dst_name)), exist_ok=True)
+        os.link(storage.path(src_name), storage.path(dst_name))
+    else:
+        if storage.exists(dst_name):
+            storage.delete(dst_name)
+        with storage.open(src_name, "rb") as src_file:
+            storage.save(dst_name, src_file)
+
+
 def determine_content_type(filename):
     """
     Guesses the content type of a filename. Returns the mimetype of a file.
@@ -8,6 +8,7 @@ from le_utils.constants import content_kinds
 from le_utils.constants import format_presets
 
 from contentcuration.models import AssessmentItem
+from contentcuration.models import ChecksumReference
 from contentcuration.models import ContentTag
 from contentcuration.models import File
 
@@ -168,6 +169,7 @@ def sync_node_files(node, original):  # noqa C901
 
     if files_to_create:
         File.objects.bulk_create(files_to_create)
+        ChecksumReference.objects.update_files(File.objects.filter(pk__in=[f.pk for f in files_to_create]))
         node.changed = True
 
     if node.changed and is_node_uploaded_file:
@@ -242,6 +244,7 @@ def sync_node_assessment_items(node, original):  # noqa C901
 
     if files_to_create:
         File.objects.bulk_create(files_to_create)
+        ChecksumReference.objects.update_files(File.objects.filter(pk__in=[f.pk for f in files_to_create]))
         node.changed = True
 
     # Now, node and its original have same content so
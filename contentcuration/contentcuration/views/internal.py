@@ -40,6 +40,7 @@ from contentcuration.decorators import delay_user_storage_calculation
 from contentcuration.models import AssessmentItem
 from contentcuration.models import Change
 from contentcuration.models import Channel
+from contentcuration.models import ContentKind
 from contentcuration.models import ContentNode
 from contentcuration.models import ContentTag
 from contentcuration.models import License
@@ -50,11 +51,14 @@ from contentcuration.tasks import apply_channel_changes_task
 from contentcuration.tasks import generatenodediff_task
 from contentcuration.utils.files import get_file_diff
 from contentcuration.utils.garbage_collect import get_deleted_chefs_root
-from contentcuration.utils.nodes import map_files_to_assessment_item
+from contentcuration.utils.nodes import map_files_to_assessment_items
 from contentcuration.utils.nodes import map_files_to_node
+from contentcuration.utils.nodes import map_files_to_nodes
 from contentcuration.utils.nodes import map_files_to_slideshow_slide_item
 from contentcuration.utils.sentry import report_exception
 from contentcuration.viewsets.sync.constants import CHANNEL
+from contentcuration.viewsets.sync.scheduler import get_channel_lease_key
+from contentcuration.viewsets.sync.scheduler import schedule_changes
 from contentcuration.viewsets.sync.utils import generate_publish_event
 from contentcuration.viewsets.sync.utils import generate_update_event
 
@@ -326,7 +330,7 @@ def api_publish_channel(request):
 
         Change.create_change(event, created_by_id=request.user.pk)
 
-        apply_channel_changes_task.fetch_or_enqueue(request.user, channel_id=channel_id)
+        schedule_changes(apply_channel_changes_task, request.user, get_channel_lease_key(channel_id), channel_id=channel_id)
 
         return Response({
             "success": True,
@@ -547,22 +551,41 @@ class IncompleteNodeError(Exception):
         super(IncompleteNodeError, self).__init__(self.message)
 
 
+def validate_tags(node_data):
+    tag_data = node_data.get("tags") or []
+    for tag in tag_data:
+        if len(tag) > 30:
+            raise ValidationError("tag is greater than 30 characters")
+    return tag_data
+
+
 def add_tags(node, node_data):
-    tags = []
-    channel = node.get_channel()
-    if "tags" in node_data:
-        tag_data = node_data["tags"]
-        if tag_data is not None:
-            for tag in tag_data:
-                if len(tag) > 30:
-                    raise ValidationError("tag is greater than 30 characters")
-                else:
-                    tags.append(
-                        ContentTag.objects.get_or_create(tag_name=tag, channel=channel)[0]
-                    )
-
-    if len(tags) > 0:
-        node.tags.add(*tags)
+    add_nodes_tags([(node, node_data)], node.get_channel())
+
+
+def add_nodes_tags(nodes_data, channel):
+    """
+    Tags each node in `nodes_data`, a list of (node, node data) pairs, with the tags
+    of the channel named in its data, creating the tags that don't exist yet.
+    """
+    nodes_tags = [(node, set(validate_tags(node_data))) for node, node_data in nodes_data]
+    tag_names = set().union(*[tags for node, tags in nodes_tags])
+    if not tag_names:
+        return
+
+    tags = {tag.tag_name: tag for tag in ContentTag.objects.filter(tag_name__in=tag_names, channel=channel)}
+    new_tags = [ContentTag(tag_name=tag_name, channel=channel) for tag_name in tag_names if tag_name not in tags]
+    ContentTag.objects.bulk_create(new_tags)
+    tags.update({tag.tag_name: tag for tag in new_tags})
+
+    ContentNode.tags.through.objects.bulk_create(
+        [
+            ContentNode.tags.through(contentnode_id=node.id, contenttag_id=tags[tag_name].id)
+            for node, node_tags in nodes_tags
+            for tag_name in node_tags
+        ],
+        ignore_conflicts=True,
+    )
 
 
 def validate_metadata_labels(node_data):
@@ -631,8 +654,20 @@ def handle_remote_node(user, node_data, parent_node):
     return contentnode.copy_to(target=parent_node, mods=node_data, can_edit_source_channel=can_edit_source_channel)
 
 
+def report_incomplete_nodes(nodes):
+    # Wait until after files have been set on the nodes to check for node completeness
+    # as some node kinds are counted as incomplete if they lack a default file.
+    for node, completion_errors in zip(nodes, ContentNode.mark_nodes_complete(nodes)):
+        if completion_errors:
+            try:
+                # we need to raise it to get Python to fill out the stack trace.
+                raise IncompleteNodeError(node, completion_errors)
+            except IncompleteNodeError as e:
+                report_exception(e)
+
+
 @delay_user_storage_calculation
-def convert_data_to_nodes(user, content_data, parent_node):  # noqa: C901
+def convert_data_to_nodes(user, content_data, parent_node):
     """ Parse dict and create nodes accordingly """
     try:
         root_mapping = {}
@@ -645,63 +680,89 @@ def convert_data_to_nodes(user, content_data, parent_node):  # noqa: C901
             parent_id=parent_node.pk
         ).values_list("node_id", flat=True)
         with transaction.atomic():
+            # Nodes are created in batches, split by the remote nodes that are copied in between them
+            batch = []
             for node_data in content_data:
                 # Check if node id is already in the tree to avoid duplicates
-                if node_data["node_id"] not in existing_node_ids:
-                    if "source_channel_id" in node_data:
-                        new_node = handle_remote_node(user, node_data, parent_node)
-
-                        map_files_to_node(user, new_node, node_data.get("files", []))
-
-                        add_tags(new_node, node_data)
-
-                    else:
-                        # Create the node
-                        new_node = create_node(node_data, parent_node, sort_order)
-
-                        # Create files associated with node
-                        map_files_to_node(user, new_node, node_data["files"])
-
-                        # Create questions associated exercise nodes
-                        create_exercises(user, new_node, node_data["questions"])
-                        sort_order += 1
-
-                        # Create Slideshow slides (if slideshow kind)
-                        if node_data["kind"] == "slideshow":
-                            extra_fields_unicode = node_data["extra_fields"]
-
-                            # Extra Fields comes as type<unicode> - convert it to a dict and get slideshow_data
-                            extra_fields_json = extra_fields_unicode.encode(
-                                "ascii", "ignore"
-                            )
-                            extra_fields = json.loads(extra_fields_json)
-
-                            slides = create_slides(
-                                user, new_node, extra_fields.get("slideshow_data")
-                            )
-                            map_files_to_slideshow_slide_item(
-                                user, new_node, slides, node_data["files"]
-                            )
-
-                    # Wait until after files have been set on the node to check for node completeness
-                    # as some node kinds are counted as incomplete if they lack a default file.
-                    completion_errors = new_node.mark_complete()
-
-                    if completion_errors:
-                        try:
-                            # we need to raise it to get Python to fill out the stack trace.
-                            raise IncompleteNodeError(new_node, completion_errors)
-                        except IncompleteNodeError as e:
-                            report_exception(e)
-
-                    # Track mapping between newly created node and node id
-                    root_mapping.update({node_data["node_id"]: new_node.pk})
+                if node_data["node_id"] in existing_node_ids:
+                    continue
+                if "source_channel_id" not in node_data:
+                    batch.append(node_data)
+                    continue
+
+                for batch_data, new_node in zip(batch, create_nodes(user, batch, parent_node, sort_order)):
+                    root_mapping.update({batch_data["node_id"]: new_node.pk})
+                sort_order += len(batch)
+                batch = []
+
+                new_node = handle_remote_node(user, node_data, parent_node)
+
+                map_files_to_node(user, new_node, node_data.get("files", []))
+
+                add_tags(new_node, node_data)
+
+                report_incomplete_nodes([new_node])
+
+                # Track mapping between newly created node and node id
+                root_mapping.update({node_data["node_id"]: new_node.pk})
+
+            for batch_data, new_node in zip(batch, create_nodes(user, batch, parent_node, sort_order)):
+                root_mapping.update({batch_data["node_id"]: new_node.pk})
             return root_mapping
 
     except KeyError as e:
         raise ObjectDoesNotExist("Error creating node: {0}".format(e))
 
 
+def create_nodes(user, nodes_data, parent_node, sort_order):
+    """
+    Creates the nodes in `nodes_data` as the last children of `parent_node`. The whole batch
+    is validated before the nodes and their tags, files and questions are inserted in bulk.
+    """
+    if not nodes_data:
+        return []
+
+    licenses = {license.license_name.lower(): license for license in License.objects.all()}
+    kinds = {kind.kind: kind for kind in ContentKind.objects.all()}
+    nodes = []
+    for node_data in nodes_data:
+        nodes.append(build_node(node_data, sort_order, licenses, kinds))
+        validate_tags(node_data)
+        sort_order += 1
+
+    nodes = ContentNode.objects.insert_children(parent_node, nodes)
+
+    add_nodes_tags(list(zip(nodes, nodes_data)), parent_node.get_channel())
+
+    # Create files associated with nodes
+    map_files_to_nodes(user, [(node, node_data["files"]) for node, node_data in zip(nodes, nodes_data)])
+
+    # Create questions associated exercise nodes
+    create_exercises(user, [(node, node_data["questions"]) for node, node_data in zip(nodes, nodes_data)])
+
+    for node, node_data in zip(nodes, nodes_data):
+        # Create Slideshow slides (if slideshow kind)
+        if node_data["kind"] == "slideshow":
+            extra_fields_unicode = node_data["extra_fields"]
+
+            # Extra Fields comes as type<unicode> - convert it to a dict and get slideshow_data
+            extra_fields_json = extra_fields_unicode.encode(
+                "ascii", "ignore"
+            )
+            extra_fields = json.loads(extra_fields_json)
+
+            slides = create_slides(
+                user, node, extra_fields.get("slideshow_data")
+            )
+            map_files_to_slideshow_slide_item(
+                user, node, slides, node_data["files"]
+            )
+
+    report_incomplete_nodes(nodes)
+
+    return nodes
+
+
 METADATA = {
     "grade_levels": set(LEVELSLIST),
     "resource_types": set(RESOURCETYPELIST),
@@ -712,15 +773,14 @@ METADATA = {
 }
 
 
-def create_node(node_data, parent_node, sort_order):  # noqa: C901
-    """ Generate node based on node dict """
+def build_node(node_data, sort_order, licenses, kinds):
+    """ Generate an unsaved node based on node dict """
     # Make sure license is valid
     license = None
     license_name = node_data["license"]
     if license_name is not None:
-        try:
-            license = License.objects.get(license_name__iexact=license_name)
-        except ObjectDoesNotExist:
+        license = licenses.get(license_name.lower())
+        if license is None:
             raise ObjectDoesNotExist("Invalid license found")
 
     extra_fields = node_data["extra_fields"] or {}
@@ -741,9 +801,8 @@ def create_node(node_data, parent_node, sort_order):  # noqa: C901
 
     metadata_labels = validate_metadata_labels(node_data)
 
-    node = ContentNode.objects.create(
+    node = ContentNode(
         title=title,
-        tree_id=parent_node.tree_id,
         kind_id=node_data["kind"],
         node_id=node_data["node_id"],
         content_id=node_data["content_id"],
@@ -754,7 +813,6 @@ def create_node(node_data, parent_node, sort_order):  # noqa: C901
         license=license,
         license_description=license_description,
         copyright_holder=copyright_holder,
-        parent=parent_node,
         extra_fields=extra_fields,
         sort_order=sort_order,
         source_id=node_data.get("source_id"),
@@ -769,18 +827,21 @@ def create_node(node_data, parent_node, sort_order):  # noqa: C901
         suggested_duration=node_data.get("suggested_duration"),
         **metadata_labels
     )
-
-    add_tags(node, node_data)
+    if node_data["kind"] in kinds:
+        node.kind = kinds[node_data["kind"]]
+    # The nodes are inserted in bulk, without being saved, and have no files yet
+    node.changed = True
+    node.set_default_learning_activity()
 
     return node
 
 
-def create_exercises(user, node, data):
-    """ Generate exercise from data """
-    with transaction.atomic():
-        order = 0
-
-        for question in data:
+def create_exercises(user, exercises_data):
+    """ Generate the questions of each exercise in `exercises_data`, a list of (node, question data) pairs """
+    assessment_items = []
+    assessment_items_files = []
+    for node, data in exercises_data:
+        for order, question in enumerate(data):
             question_obj = AssessmentItem(
                 type=question.get("type"),
                 question=question.get("question"),
@@ -793,9 +854,11 @@ def create_exercises(user, node, data):
                 source_url=question.get("source_url"),
                 randomize=question.get("randomize") or False,
             )
-            order += 1
-            question_obj.save()
-            map_files_to_assessment_item(user, question_obj, question["files"])
+            assessment_items.append(question_obj)
+            assessment_items_files.append((question_obj, question["files"]))
+
+    AssessmentItem.objects.bulk_create(assessment_items)
+    map_files_to_assessment_items(user, assessment_items_files)
 
 
 def create_slides(user, node, slideshow_data):
@@ -1,9 +1,5 @@
 import json
-from datetime import datetime
 
-from django.conf import settings
-from django.core.cache import cache
-from django.db.models import Max
 from django.http import Http404
 from django.http import HttpResponse
 from django.http import HttpResponseNotFound
@@ -21,7 +17,7 @@ from rest_framework.response import Response
 from contentcuration.models import Channel
 from contentcuration.models import ContentNode
 from contentcuration.tasks import generatenodediff_task
-from contentcuration.tasks import getnodedetails_task
+from contentcuration.utils.cache import TreeRevisionCache
 from contentcuration.utils.nodes import get_diff
 
 
@@ -36,7 +32,7 @@ def get_channel_details(request, channel_id):
     channel = get_object_or_404(Channel.filter_view_queryset(Channel.objects.all(), request.user), id=channel_id)
     if not channel.main_tree:
         raise Http404
-    data = get_node_details_cached(request.user, channel.main_tree, channel_id=channel_id)
+    data = get_node_details_cached(channel.main_tree, channel_id=channel_id)
     return HttpResponse(json.dumps(data))
 
 
@@ -47,37 +43,14 @@ def get_node_details(request, node_id):
     channel = node.get_channel()
     if channel and not channel.public:
         return HttpResponseNotFound("No topic found for {}".format(node_id))
-    data = get_node_details_cached(request.user, node)
+    data = get_node_details_cached(node)
     return HttpResponse(json.dumps(data))
 
 
-def get_node_details_cached(user, node, channel_id=None):
-    cached_data = cache.get("details_{}".format(node.node_id))
+def get_node_details_cached(node, channel_id=None):
+    # The details are cached for the revision of the tree, so they are never stale
+    cached_data = TreeRevisionCache(node.tree_id).get("details_{}".format(node.node_id))
     if cached_data:
-        descendants = (
-            node.get_descendants()
-            .prefetch_related("children", "files", "tags")
-            .select_related("license", "language")
-        )
-        channel = node.get_channel()
-
-        # If channel is a sushi chef channel, use date created for faster query
-        # Otherwise, find the last time anything was updated in the channel
-        last_update = (
-            channel.main_tree.created
-            if channel and channel.ricecooker_version
-            else descendants.filter(changed=True)
-            .aggregate(latest_update=Max("modified"))
-            .get("latest_update")
-        )
-
-        if last_update:
-            last_cache_update = datetime.strptime(
-                json.loads(cached_data)["last_update"], settings.DATE_TIME_FORMAT
-            )
-            if not user.is_anonymous and last_update.replace(tzinfo=None) > last_cache_update:
-                # update the stats async, then return the cached value
-                getnodedetails_task.enqueue(user, node_id=node.pk)
         return json.loads(cached_data)
 
     return node.get_details(channel_id=channel_id)
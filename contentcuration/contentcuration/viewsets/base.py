@@ -5,6 +5,7 @@ from contextlib import contextmanager
 
 from celery import states
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.db.models import Q
 from django.db.utils import IntegrityError
 from django.http import Http404
@@ -30,6 +31,8 @@ from rest_framework.viewsets import GenericViewSet
 
 from contentcuration.models import Change
 from contentcuration.models import CustomTaskMetadata
+from contentcuration.utils.celery.status import remove_task_statuses
+from contentcuration.utils.celery.status import set_task_status
 from contentcuration.utils.celery.tasks import generate_task_signature
 from contentcuration.utils.celery.tasks import ProgressTracker
 from contentcuration.viewsets.common import MissingRequiredParamsException
@@ -694,12 +697,15 @@ class CreateModelMixin(object):
 
         for change in changes:
             try:
-                serializer = self.get_serializer(data=self._map_create_change(change))
-                if serializer.is_valid():
-                    self.perform_create(serializer, change=change)
-                else:
-                    change.update({"errors": serializer.errors})
-                    errors.append(change)
+                # Each change is applied in its own savepoint, so a change that fails with a database
+                # error is rolled back without rolling back the changes applied along with it
+                with transaction.atomic():
+                    serializer = self.get_serializer(data=self._map_create_change(change))
+                    if serializer.is_valid():
+                        self.perform_create(serializer, change=change)
+                    else:
+                        change.update({"errors": serializer.errors})
+                        errors.append(change)
             except Exception as e:
                 log_sync_exception(e, user=self.request.user, change=change)
                 change["errors"] = [str(e)]
@@ -741,9 +747,10 @@ class DestroyModelMixin(object):
         queryset = self.get_edit_queryset().order_by()
         for change in changes:
             try:
-                instance = queryset.get(**dict(self.values_from_key(change["key"])))
+                with transaction.atomic():
+                    instance = queryset.get(**dict(self.values_from_key(change["key"])))
 
-                self.perform_destroy(instance)
+                    self.perform_destroy(instance)
             except ObjectDoesNotExist:
                 # If the object already doesn't exist, as far as the user is concerned
                 # job done!
@@ -770,15 +777,16 @@ class UpdateModelMixin(object):
         queryset = self.get_edit_queryset().order_by()
         for change in changes:
             try:
-                instance = queryset.get(**dict(self.values_from_key(change["key"])))
-                serializer = self.get_serializer(
-                    instance, data=self._map_update_change(change), partial=True
-                )
-                if serializer.is_valid():
-                    self.perform_update(serializer)
-                else:
-                    change.update({"errors": serializer.errors})
-                    errors.append(change)
+                with transaction.atomic():
+                    instance = queryset.get(**dict(self.values_from_key(change["key"])))
+                    serializer = self.get_serializer(
+                        instance, data=self._map_update_change(change), partial=True
+                    )
+                    if serializer.is_valid():
+                        self.perform_update(serializer)
+                    else:
+                        change.update({"errors": serializer.errors})
+                        errors.append(change)
             except ObjectDoesNotExist:
                 # Should we also check object permissions here and return a different
                 # error if the user can view the object but not edit it?
@@ -822,7 +830,8 @@ class BulkCreateMixin(CreateModelMixin):
         errors = []
         if serializer.is_valid():
             try:
-                self.perform_bulk_create(serializer)
+                with transaction.atomic():
+                    self.perform_bulk_create(serializer)
             except Exception as e:
                 log_sync_exception(e, user=self.request.user, changes=changes)
                 for change in changes:
@@ -861,7 +870,8 @@ class BulkUpdateMixin(UpdateModelMixin):
 
         if serializer.is_valid():
             try:
-                self.perform_bulk_update(serializer)
+                with transaction.atomic():
+                    self.perform_bulk_update(serializer)
             except Exception as e:
                 log_sync_exception(e, user=self.request.user, changes=changes)
                 for change in changes:
@@ -917,7 +927,8 @@ class BulkDeleteMixin(DestroyModelMixin):
         ).order_by()
         errors = []
         try:
-            queryset.delete()
+            with transaction.atomic():
+                queryset.delete()
         except Exception:
             errors = [
                 {
@@ -939,6 +950,7 @@ def create_change_tracker(pk, table, channel_id, user, task_name):
     task_id_to_delete = CustomTaskMetadata.objects.filter(channel_id=channel_id, signature=signature)
     if task_id_to_delete:
         TaskResult.objects.filter(task_id=task_id_to_delete, task_name=task_name).delete()
+        remove_task_statuses(channel_id, task_id_to_delete.values_list("task_id", flat=True))
 
     task_id = uuid.uuid4().hex
 
@@ -953,17 +965,18 @@ def create_change_tracker(pk, table, channel_id, user, task_name):
         user=user,
         signature=signature
     )
+    set_task_status(task_id, task_name, channel_id, states.STARTED)
 
     def update_progress(progress=None):
         if progress:
             custom_task_metadata_object.progress = progress
-            custom_task_metadata_object.save()
+            custom_task_metadata_object.save(update_fields=["progress"])
 
     Change.create_change(
         generate_update_event(pk, table, {TASK_ID: task_object.task_id}, channel_id=channel_id), applied=True
     )
 
-    tracker = ProgressTracker(task_id, update_progress)
+    tracker = ProgressTracker(task_id, update_progress, channel_id=channel_id)
 
     try:
         yield tracker
@@ -971,6 +984,7 @@ def create_change_tracker(pk, table, channel_id, user, task_name):
         task_object.status = states.FAILURE
         task_object.traceback = traceback.format_exc()
         task_object.save()
+        set_task_status(task_id, task_name, channel_id, states.FAILURE, traceback=task_object.traceback, progress=custom_task_metadata_object.progress)
         raise
     finally:
         if task_object.status == states.STARTED:
@@ -980,3 +994,4 @@ def create_change_tracker(pk, table, channel_id, user, task_name):
             )
             task_object.delete()
             custom_task_metadata_object.delete()
+            remove_task_statuses(channel_id, [task_id])
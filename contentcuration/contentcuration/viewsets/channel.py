@@ -37,8 +37,10 @@ from contentcuration.models import File
 from contentcuration.models import generate_storage_url
 from contentcuration.models import SecretToken
 from contentcuration.models import User
+from contentcuration.utils.cache import PUBLIC_CHANNELS_REVISION
 from contentcuration.utils.garbage_collect import get_deleted_chefs_root
 from contentcuration.utils.pagination import CachedListPagination
+from contentcuration.utils.pagination import CachedValuesViewsetPaginator
 from contentcuration.utils.pagination import ValuesViewsetPageNumberPagination
 from contentcuration.utils.publish import ChannelIncompleteError
 from contentcuration.utils.publish import publish_channel
@@ -67,7 +69,13 @@ class ChannelListPagination(ValuesViewsetPageNumberPagination):
     max_page_size = 1000
 
 
+class CatalogPaginator(CachedValuesViewsetPaginator):
+    # Publishing a channel, or changing whether it is public, changes the catalog counts
+    revision_name = PUBLIC_CHANNELS_REVISION
+
+
 class CatalogListPagination(CachedListPagination):
+    django_paginator_class = CatalogPaginator
     page_size = None
     page_size_query_param = "page_size"
     max_page_size = 1000
@@ -5,7 +5,9 @@ from functools import reduce
 from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import IntegrityError
 from django.db import models
-from django.db.models import Exists
+from django.db import transaction
+from django.db.models import BooleanField as DjangoBooleanField
+from django.db.models import ExpressionWrapper
 from django.db.models import F
 from django.db.models import IntegerField as DjangoIntegerField
 from django.db.models import OuterRef
@@ -20,7 +22,6 @@ from django_filters.rest_framework import CharFilter
 from django_filters.rest_framework import UUIDFilter
 from le_utils.constants import completion_criteria
 from le_utils.constants import content_kinds
-from le_utils.constants import roles
 from le_utils.constants.labels import accessibility_categories
 from le_utils.constants.labels import learning_activities
 from le_utils.constants.labels import levels
@@ -52,6 +53,7 @@ from contentcuration.models import generate_storage_url
 from contentcuration.models import PrerequisiteContentRelationship
 from contentcuration.models import UUIDField
 from contentcuration.tasks import calculate_resource_size_task
+from contentcuration.utils.cache import mark_files_modified
 from contentcuration.utils.nodes import calculate_resource_size
 from contentcuration.utils.nodes import migrate_extra_fields
 from contentcuration.viewsets.base import BulkListSerializer
@@ -79,6 +81,9 @@ channel_query = Channel.objects.filter(main_tree__tree_id=OuterRef("tree_id"))
 
 _valid_positions = {"first-child", "last-child", "left", "right"}
 
+# Writable fields that decide which of the aggregates of its ancestors a node is counted in
+AGGREGATED_FIELDS = {"kind", "role_visibility", "complete", "changed"}
+
 
 class ContentNodeFilter(RequiredFilterSet):
     id__in = UUIDInFilter(field_name="id")
@@ -244,9 +249,19 @@ class ContentNodeListSerializer(BulkListSerializer):
         modified = now()
         for data in all_validated_data:
             data["modified"] = modified
-        all_objects = super(ContentNodeListSerializer, self).update(
-            queryset, all_validated_data
-        )
+        # The nodes are updated in bulk rather than saved, so update the aggregates of their ancestors here
+        if any(AGGREGATED_FIELDS.intersection(data) for data in all_validated_data):
+            with ContentNode.objects.maintain_aggregates(queryset):
+                all_objects = super(ContentNodeListSerializer, self).update(
+                    queryset, all_validated_data
+                )
+        else:
+            all_objects = super(ContentNodeListSerializer, self).update(
+                queryset, all_validated_data
+            )
+        if any("complete" in data for data in all_validated_data):
+            # Only the files of complete nodes count towards resource sizes
+            mark_files_modified(*queryset.order_by().values_list("tree_id", flat=True).distinct())
         if tags:
             set_tags(tags)
         return all_objects
@@ -607,7 +622,8 @@ class PrerequisitesUpdateHandler(ValuesViewset):
 
         # In Django 2.2 add ignore_conflicts to make this fool proof
         try:
-            self._execute_changes(change_type, data)
+            with transaction.atomic():
+                self._execute_changes(change_type, data)
         except IntegrityError as e:
             for change in valid_changes:
                 change.update({"errors": str(e)})
@@ -772,31 +788,6 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
     def annotate_queryset(self, queryset):
         queryset = queryset.annotate(total_count=(F("rght") - F("lft") - 1) / 2)
 
-        descendant_resources = (
-            ContentNode.objects.filter(
-                tree_id=OuterRef("tree_id"),
-                lft__gt=OuterRef("lft"),
-                rght__lt=OuterRef("rght"),
-            )
-            .exclude(kind_id=content_kinds.TOPIC)
-            .values("id", "role_visibility", "changed")
-            .order_by()
-        )
-
-        all_descendants = (
-            ContentNode.objects.filter(
-                tree_id=OuterRef("tree_id"),
-                lft__gt=OuterRef("lft"),
-                rght__lt=OuterRef("rght"),
-            )
-            .values("id", "complete", "published")
-            .order_by()
-        )
-
-        # Get count of descendant nodes with errors
-        descendant_errors = all_descendants.filter(complete=False)
-        changed_descendants = descendant_resources.filter(changed=True)
-
         thumbnails = File.objects.filter(
             contentnode=OuterRef("id"), preset__thumbnail=True
         )
@@ -826,28 +817,26 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
             .distinct()
         )
 
+        # The counts of the descendants of each node are read from its aggregate, which nodes without descendants don't have
+        queryset = queryset.annotate(
+            resource_count=Coalesce(F("aggregate__resource_count"), 0),
+            coach_count=Coalesce(F("aggregate__coach_count"), 0),
+            error_count=Coalesce(F("aggregate__error_count"), 0),
+            updated_count=Coalesce(F("aggregate__updated_count"), 0),
+            new_count=Coalesce(F("aggregate__new_count"), 0),
+        )
+
         queryset = queryset.annotate(
-            resource_count=SQCount(descendant_resources, field="id"),
-            coach_count=SQCount(
-                descendant_resources.filter(role_visibility=roles.COACH), field="id",
-            ),
             assessment_item_count=SQCount(assessment_items, field="assessment_id"),
-            error_count=SQCount(descendant_errors, field="id"),
-            has_updated_descendants=Exists(
-                changed_descendants.filter(published=True).values("id")
-            ),
-            has_new_descendants=Exists(
-                changed_descendants.filter(published=False).values("id")
-            ),
+            has_updated_descendants=ExpressionWrapper(Q(updated_count__gt=0), output_field=DjangoBooleanField()),
+            has_new_descendants=ExpressionWrapper(Q(new_count__gt=0), output_field=DjangoBooleanField()),
             thumbnail_checksum=Subquery(thumbnails.values("checksum")[:1]),
             thumbnail_extension=Subquery(
                 thumbnails.values("file_format__extension")[:1]
             ),
             original_channel_name=original_channel_name,
             original_parent_id=Subquery(original_node.values("parent_id")[:1]),
-            has_children=Exists(
-                ContentNode.objects.filter(parent=OuterRef("id")).values("pk")
-            ),
+            has_children=ExpressionWrapper(Q(rght__gt=F("lft") + 1), output_field=DjangoBooleanField()),
             root_id=Subquery(root_id),
         )
         queryset = queryset.annotate(content_tags=NotNullMapArrayAgg("tags__tag_name"))
@@ -874,14 +863,25 @@ class ContentNodeViewSet(BulkUpdateMixin, ValuesViewset):
 
     def move_from_changes(self, changes):
         errors = []
+        moves = []
+        nodes = {node.id: node for node in self.get_edit_queryset().filter(pk__in=[move["key"] for move in changes])}
         for move in changes:
             # Move change will have key, must also have target property
             # optionally can include the desired position.
-            move_error = self.move(
-                move["key"], target=move.get("target"), position=move.get("position")
-            )
+            try:
+                if move["key"] not in nodes:
+                    raise ValidationError("Specified node does not exist")
+                target, position = self.validate_targeting_args(move.get("target"), move.get("position"))
+                moves.append((move, (nodes[move["key"]], target, position)))
+            except ValidationError as e:
+                move.update({"errors": [str(e)]})
+                errors.append(move)
+
+        # All the moves are made under one lock on the trees involved
+        move_errors = ContentNode.objects.move_nodes([node_move for move, node_move in moves])
+        for (move, node_move), move_error in zip(moves, move_errors):
             if move_error:
-                move.update({"errors": [move_error]})
+                move.update({"errors": [str(move_error)]})
                 errors.append(move)
         return errors
 
@@ -9,6 +9,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from contentcuration.models import AssessmentItem
+from contentcuration.models import ChecksumReference
 from contentcuration.models import ContentNode
 from contentcuration.models import File
 from contentcuration.models import generate_object_storage_name
@@ -44,6 +45,19 @@ class FileFilter(RequiredFilterSet):
         )
 
 
+# Fields of files that change which checksum references they count towards
+CHECKSUM_REFERENCE_FIELDS = {"contentnode", "preset"}
+
+
+class FileListSerializer(BulkListSerializer):
+    def update(self, queryset, all_validated_data):
+        # The files are updated in bulk rather than saved, so update the ledger of checksum references here
+        if any(CHECKSUM_REFERENCE_FIELDS.intersection(data) for data in all_validated_data):
+            with ChecksumReference.objects.maintain_files(queryset):
+                return super(FileListSerializer, self).update(queryset, all_validated_data)
+        return super(FileListSerializer, self).update(queryset, all_validated_data)
+
+
 class FileSerializer(BulkModelSerializer):
     contentnode = UserFilteredPrimaryKeyRelatedField(
         queryset=ContentNode.objects.all(), required=False
@@ -59,8 +73,12 @@ class FileSerializer(BulkModelSerializer):
             update_node = validated_data.get("contentnode", None)
             if not update_node or update_node.id != instance.contentnode_id:
                 ResourceSizeCache.reset_modified_for_file(instance)
+                instance.mark_tree_changed()
 
         results = super(FileSerializer, self).update(instance, validated_data)
+        if "contentnode" in validated_data:
+            # files are updated in bulk rather than saved, so mark the tree of the new node here
+            instance.mark_tree_changed()
         if instance.uploaded_by_id:
             calculate_user_storage(instance.uploaded_by_id)
         return results
@@ -75,7 +93,7 @@ class FileSerializer(BulkModelSerializer):
             "preset",
             "duration"
         )
-        list_serializer_class = BulkListSerializer
+        list_serializer_class = FileListSerializer
 
 
 def retrieve_storage_url(item):
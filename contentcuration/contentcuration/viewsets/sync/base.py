@@ -1,8 +1,14 @@
+import json
 from collections import OrderedDict
 
+from django.db import transaction
+from django.db.models import Q
 from search.viewsets.savedsearch import SavedSearchViewSet
 
 from contentcuration.decorators import delay_user_storage_calculation
+from contentcuration.models import Change
+from contentcuration.models import ContentNode
+from contentcuration.utils.cache import bump_tree_revisions
 from contentcuration.viewsets.assessmentitem import AssessmentItemViewSet
 from contentcuration.viewsets.bookmark import BookmarkViewSet
 from contentcuration.viewsets.channel import ChannelViewSet
@@ -33,6 +39,7 @@ from contentcuration.viewsets.sync.constants import SYNCED
 from contentcuration.viewsets.sync.constants import UPDATED
 from contentcuration.viewsets.sync.constants import USER
 from contentcuration.viewsets.sync.constants import VIEWER_M2M
+from contentcuration.viewsets.sync.stream import publish_changes
 from contentcuration.viewsets.sync.utils import log_sync_exception
 from contentcuration.viewsets.user import ChannelUserViewSet
 from contentcuration.viewsets.user import UserViewSet
@@ -97,33 +104,173 @@ event_handlers = {
 }
 
 
-@delay_user_storage_calculation
-def apply_changes(changes_queryset):
-    changes = changes_queryset.order_by("server_rev").select_related("created_by")
+# Consecutive changes of these types are passed to their handler together,
+# as their handlers apply each of the changes they are passed in turn
+batched_change_types = {CREATED, UPDATED, DELETED, MOVED}
+
+# The most changes passed to a handler at once
+APPLY_CHANGES_BATCH_SIZE = 100
+
+
+def get_change_runs(changes):
+    """
+    Splits changes, in the order they are to be applied, into runs of consecutive changes that can
+    be applied by a single call to their handler. The changes of a run have the same table, type and
+    creator, and never include two changes to the same object, so that a change to an object is
+    always applied after the changes to it that came before.
+    """
+    run = []
+    keys = set()
     for change in changes:
-        # Assume an error, this will be updated
-        # in the case there isn't!
-        changed_fields = ("errored", "kwargs")
-        table_name = change.table
-        try:
-            viewset_class = viewset_mapping[table_name]
-            change_type = change.change_type
-            change_type = int(change_type)
-            viewset = viewset_class()
-            viewset.sync_initial(change.created_by)
-            if change_type in event_handlers:
-                event_handler = getattr(viewset, event_handlers[change_type], None)
-                if event_handler is None:
-                    raise ChangeNotAllowed(change_type, viewset_class)
-                errors = event_handler([change.serialize_to_change_dict()])
-                if errors:
-                    change.errored = True
-                    change.kwargs["errors"] = errors[0]["errors"]
-                else:
-                    change.applied = True
-                    changed_fields = ("applied",)
-        except Exception as e:
-            log_sync_exception(e, user=change.created_by, change=change.serialize_to_change_dict())
+        key = json.dumps(change.kwargs.get("key"), sort_keys=True, default=str)
+        if run and (
+            change.change_type not in batched_change_types
+            or (change.table, change.change_type, change.created_by_id) != (run[0].table, run[0].change_type, run[0].created_by_id)
+            or key in keys
+            or len(run) >= APPLY_CHANGES_BATCH_SIZE
+        ):
+            yield run
+            run = []
+            keys = set()
+        run.append(change)
+        keys.add(key)
+    if run:
+        yield run
+
+
+def _error_matches_change(viewset, error, change):
+    # Handlers return the change dicts they were passed or copies of them,
+    # otherwise the key of the change or the values mapped from it
+    if "server_rev" in error:
+        return error["server_rev"] == change["server_rev"]
+    if "key" in error:
+        return error["key"] == change.get("key")
+    if change.get("key") is None:
+        return False
+    values = viewset.values_from_key(change["key"])
+    return bool(values) and all(error.get(field) == value for field, value in values)
+
+
+class ChangeRunRolledBack(Exception):
+    """
+    Raised when a run of changes cannot be applied together and has to be rolled back,
+    so that its changes are applied one at a time instead
+    """
+
+
+def _get_errors_by_server_rev(viewset, change_dicts, errors):
+    errors_by_server_rev = {}
+    for error in errors:
+        matches = [change for change in change_dicts if _error_matches_change(viewset, error, change)]
+        if not matches:
+            if len(change_dicts) > 1:
+                raise ChangeRunRolledBack("Could not match an error to the change it is for: {}".format(error))
+            matches = change_dicts
+        for change in matches:
+            errors_by_server_rev.setdefault(change["server_rev"], error["errors"])
+    return errors_by_server_rev
+
+
+def apply_change_run(run):
+    """
+    Applies a run of changes from get_change_runs with a single call to their handler,
+    and returns the errors of the changes that failed by their server_rev, or None if
+    there is no handler for their type
+    """
+    viewset_class = viewset_mapping[run[0].table]
+    change_type = int(run[0].change_type)
+    viewset = viewset_class()
+    viewset.sync_initial(run[0].created_by)
+    if change_type not in event_handlers:
+        return None
+    event_handler = getattr(viewset, event_handlers[change_type], None)
+    if event_handler is None:
+        raise ChangeNotAllowed(change_type, viewset_class)
+    change_dicts = [change.serialize_to_change_dict() for change in run]
+    return _get_errors_by_server_rev(viewset, change_dicts, event_handler(change_dicts) or [])
+
+
+def _apply_batched_change_run(run):
+    # The run is applied in its own transaction, so that the locks taken to apply it are held only
+    # while it is applied. If a handler swallowed a database error, the transaction would be rolled
+    # back when it is left, so roll it back now and apply the changes one at a time instead.
+    with transaction.atomic():
+        errors_by_server_rev = apply_change_run(run)
+        if transaction.get_connection().needs_rollback:
+            raise ChangeRunRolledBack("A database error occurred while applying the changes")
+    return errors_by_server_rev
+
+
+def _apply_change_run(run):
+    """
+    Applies a run of changes, and marks each of them as applied or errored
+    once the transaction they were applied in has been committed
+    """
+    try:
+        if run[0].change_type in batched_change_types:
+            errors_by_server_rev = _apply_batched_change_run(run)
+        else:
+            # Other changes, such as publishing, can take long and are not applied in a transaction
+            errors_by_server_rev = apply_change_run(run)
+    except Exception as e:
+        if len(run) > 1:
+            # Fall back to applying the changes one at a time, so that only the changes that fail are marked as errored
+            for change in run:
+                _apply_change_run([change])
+            return
+        change = run[0]
+        log_sync_exception(e, user=change.created_by, change=change.serialize_to_change_dict())
+        change.errored = True
+        change.kwargs["errors"] = [str(e)]
+        return
+    if errors_by_server_rev is None:
+        # Changes of types without a handler are left as they are
+        return
+    for change in run:
+        if change.server_rev in errors_by_server_rev:
             change.errored = True
-            change.kwargs["errors"] = [str(e)]
-        change.save(update_fields=changed_fields)
+            change.kwargs["errors"] = errors_by_server_rev[change.server_rev]
+        else:
+            change.applied = True
+
+
+# The tables of the nodes of channel and clipboard trees, and of their files and assessment items
+tree_tables = {CONTENTNODE, CONTENTNODE_PREREQUISITE, ASSESSMENTITEM, FILE, CLIPBOARD}
+
+channel_tree_relations = ("channel_main", "channel_staging", "channel_chef", "channel_trash", "channel_previous", "channel_clipboard")
+
+
+def bump_changed_tree_revisions(changes):
+    """
+    The viewsets update nodes, files and assessment items in bulk rather than saving each of them,
+    so bump the revisions of the trees of the channels and clipboards that the applied changes are for
+    """
+    changes = [change for change in changes if change.applied and change.table in tree_tables]
+    channel_ids = {change.channel_id for change in changes if change.channel_id}
+    user_ids = {change.user_id for change in changes if change.user_id}
+    if not channel_ids and not user_ids:
+        return
+    query = Q(user_clipboard__in=user_ids)
+    for relation in channel_tree_relations:
+        query |= Q(**{"{}__in".format(relation): channel_ids})
+    bump_tree_revisions(*ContentNode.objects.filter(query, parent__isnull=True).values_list("tree_id", flat=True).distinct())
+
+
+@delay_user_storage_calculation
+def apply_changes(changes_queryset, before_run=None):
+    """
+    Applies the changes in order, consecutive runs of created, updated, deleted and moved changes are each
+    applied in one transaction. Other changes, such as publishing, can take long and are applied on their own.
+    If given, `before_run` is called with each run before it is applied, and the changes from the run on
+    are left unapplied when it returns False.
+    """
+    changes = changes_queryset.order_by("server_rev").select_related("created_by")
+    applied_changes = []
+    for run in get_change_runs(changes):
+        if before_run is not None and not before_run(run):
+            break
+        _apply_change_run(run)
+        Change.objects.bulk_update(run, ("applied", "errored", "kwargs"))
+        publish_changes(run)
+        applied_changes.extend(run)
+    bump_changed_tree_revisions(applied_changes)
@@ -3,7 +3,10 @@ A view that handles synchronization of changes from the frontend
 and deals with processing all the changes to make appropriate
 bulk creates, updates, and deletes.
 """
+import json
+
 from celery import states
+from django.conf import settings
 from django.db.models import Q
 from django_celery_results.models import TaskResult
 from django_cte import CTEQuerySet
@@ -11,6 +14,7 @@ from django_cte import With
 from rest_framework.authentication import SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 
 from contentcuration.models import Change
@@ -18,8 +22,15 @@ from contentcuration.models import Channel
 from contentcuration.models import CustomTaskMetadata
 from contentcuration.tasks import apply_channel_changes_task
 from contentcuration.tasks import apply_user_changes_task
+from contentcuration.utils.celery.status import get_task_statuses
+from contentcuration.utils.celery.status import populate_task_statuses
 from contentcuration.viewsets.sync.constants import CHANNEL
 from contentcuration.viewsets.sync.constants import CREATED
+from contentcuration.viewsets.sync.scheduler import get_channel_lease_key
+from contentcuration.viewsets.sync.scheduler import get_user_lease_key
+from contentcuration.viewsets.sync.scheduler import schedule_changes
+from contentcuration.viewsets.sync.stream import CHANGE_STREAM_FIELDS
+from contentcuration.viewsets.sync.stream import get_stream_changes
 
 
 class SyncView(APIView):
@@ -59,9 +70,9 @@ class SyncView(APIView):
                     disallowed_changes.append(c)
             change_models = Change.create_changes(user_only_changes + channel_changes, created_by_id=request.user.id, session_key=session_key)
             if user_only_changes:
-                apply_user_changes_task.fetch_or_enqueue(request.user, user_id=request.user.id)
+                schedule_changes(apply_user_changes_task, request.user, get_user_lease_key(request.user.id), user_id=request.user.id)
             for channel_id in allowed_ids:
-                apply_channel_changes_task.fetch_or_enqueue(request.user, channel_id=channel_id)
+                schedule_changes(apply_channel_changes_task, request.user, get_channel_lease_key(channel_id), channel_id=channel_id)
             allowed_changes = [{"rev": c.client_rev, "server_rev": c.server_rev} for c in change_models]
 
             return {"disallowed": disallowed_changes, "allowed": allowed_changes}
@@ -80,53 +91,77 @@ class SyncView(APIView):
         unapplied_revs = request.data.get("unapplied_revs", [])
         session_key = request.session.session_key
 
-        unapplied_revs_filter = Q(server_rev__in=unapplied_revs)
-
-        # Create a filter that returns all applied changes, and any errored changes made by this session
-        relevant_to_session_filter = (Q(applied=True) | Q(errored=True, session_id=session_key))
-
-        change_filter = (Q(user=request.user) & (unapplied_revs_filter | Q(server_rev__gt=user_rev)) & relevant_to_session_filter)
-
-        for channel_id, rev in channel_revs.items():
-            change_filter |= (Q(channel_id=channel_id) & (unapplied_revs_filter | Q(server_rev__gt=rev)) & relevant_to_session_filter)
-
-        changes_to_return = list(
-            Change.objects.filter(
-                change_filter
-            ).values(
-                "server_rev",
-                "session_id",
-                "channel_id",
-                "user_id",
-                "created_by_id",
-                "applied",
-                "errored",
-                "table",
-                "change_type",
-                "kwargs"
-            ).order_by("server_rev")
-        )
-
-        if not changes_to_return:
-            return {}
+        changes_to_return = get_stream_changes(request.user.id, user_rev, channel_revs, unapplied_revs)
+        if changes_to_return is None:
+            changes_to_return = self.query_changes(request, user_rev, channel_revs, unapplied_revs)
+        else:
+            # Only return the applied changes, and any errored changes made by this session, as the query does
+            changes_to_return = [c for c in changes_to_return if c["applied"] or (c["errored"] and c["session_id"] == session_key)]
 
         changes = []
         successes = []
         errors = []
+        next_rev = None
+        last_rev = None
+        count = 0
+        size = 0
 
         for c in changes_to_return:
+            # Stop once the response is full, the client continues from the last change returned
+            if count >= settings.SYNC_MAX_CHANGES_PER_RESPONSE or size >= settings.SYNC_MAX_RESPONSE_BYTES:
+                next_rev = last_rev
+                break
+            serialized = Change.serialize(c)
             if c["applied"]:
                 if c["session_id"] == session_key:
-                    successes.append(Change.serialize(c))
+                    successes.append(serialized)
                 else:
-                    changes.append(Change.serialize(c))
+                    changes.append(serialized)
             if c["errored"] and c["session_id"] == session_key:
-                errors.append(Change.serialize(c))
+                errors.append(serialized)
+            last_rev = c["server_rev"]
+            count += 1
+            size += len(json.dumps(serialized, cls=JSONEncoder))
 
-        return {"changes": changes, "errors": errors, "successes": successes}
+        if not count:
+            return {}
+
+        return {"changes": changes, "errors": errors, "successes": successes, "next_rev": next_rev}
+
+    def query_changes(self, request, user_rev, channel_revs, unapplied_revs):
+        session_key = request.session.session_key
+
+        unapplied_revs_filter = Q(server_rev__in=unapplied_revs)
+
+        # Create a filter that returns all applied changes, and any errored changes made by this session
+        relevant_to_session_filter = (Q(applied=True) | Q(errored=True, session_id=session_key))
+
+        change_filter = (Q(user=request.user) & (unapplied_revs_filter | Q(server_rev__gt=user_rev)) & relevant_to_session_filter)
+
+        for channel_id, rev in channel_revs.items():
+            change_filter |= (Q(channel_id=channel_id) & (unapplied_revs_filter | Q(server_rev__gt=rev)) & relevant_to_session_filter)
+
+        # Only fetch one more change than can be returned, to know whether the client has to continue
+        return Change.objects.filter(
+            change_filter
+        ).values(
+            *CHANGE_STREAM_FIELDS
+        ).order_by("server_rev")[:settings.SYNC_MAX_CHANGES_PER_RESPONSE + 1].iterator()
 
     def return_tasks(self, request, channel_revs):
-        custom_task_cte = With(CustomTaskMetadata.objects.filter(channel_id__in=channel_revs.keys()))
+        tasks, missing_channel_ids = get_task_statuses(channel_revs.keys())
+        if missing_channel_ids:
+            queried_tasks = list(self.query_tasks(missing_channel_ids))
+            populate_task_statuses(missing_channel_ids, queried_tasks)
+            tasks.extend(queried_tasks)
+
+        excluded_task_names = (apply_channel_changes_task.name, apply_user_changes_task.name)
+        return {
+            "tasks": [task for task in tasks if task["task_name"] not in excluded_task_names],
+        }
+
+    def query_tasks(self, channel_ids):
+        custom_task_cte = With(CustomTaskMetadata.objects.filter(channel_id__in=channel_ids))
         task_result_querySet = CTEQuerySet(model=TaskResult)
         query = custom_task_cte.join(task_result_querySet, task_id=custom_task_cte.col.task_id)\
             .with_cte(custom_task_cte)\
@@ -137,17 +172,7 @@ class SyncView(APIView):
                 progress=custom_task_cte.col.progress,
                 channel_id=custom_task_cte.col.channel_id,
         )
-
-        response_payload = {
-            "tasks": [],
-        }
-
-        if query.exists():
-            response_payload = {
-                "tasks": query.values("task_id", "task_name", "traceback", "progress", "channel_id", "status"),
-            }
-
-        return response_payload
+        return query.values("task_id", "task_name", "traceback", "progress", "channel_id", "status")
 
     def post(self, request):
         response_payload = {
@@ -157,6 +182,7 @@ class SyncView(APIView):
             "errors": [],
             "successes": [],
             "tasks": [],
+            "next_rev": None,
         }
 
         channel_revs = self.get_channel_revs(request)
@@ -0,0 +1,220 @@
+"""
+Scheduling of the tasks that apply changes.
+
+The changes of a channel, or of a user, are applied by one task at a time, which holds a lease on
+them in Redis that names its task id. A request that creates changes only enqueues a task when there
+is no lease, rather than looking up the incomplete tasks in the database on every request.
+
+A task applies the changes in batches until there are none left, then releases the lease, which it
+also does when it fails. The lease is short, and extended before each run of changes is applied, so
+that the lease of a task that died is soon given up. Once a task has run for `SYNC_APPLY_TIME_SLICE`
+seconds, it hands the lease over to a new task at the back of the queue instead, so that a busy
+channel doesn't keep a worker from the changes of other channels.
+"""
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+
+ACQUIRE_SCRIPT = """
+local holder = redis.call("get", KEYS[1])
+if not holder or holder == ARGV[1] then
+    redis.call("set", KEYS[1], ARGV[1], "PX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+TRANSFER_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    if ARGV[2] == "" then
+        return redis.call("del", KEYS[1])
+    end
+    redis.call("set", KEYS[1], ARGV[2], "PX", ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+def get_channel_lease_key(channel_id):
+    return "sync:apply:channel:{}".format(channel_id)
+
+
+def get_user_lease_key(user_id):
+    return "sync:apply:user:{}".format(user_id)
+
+
+class ChangeLease(object):
+    """
+    A lease on applying the changes of a channel or user, held by the task with the given id
+    """
+
+    def __init__(self, key, task_id):
+        self.key = key
+        self.task_id = task_id
+        self.client = get_redis_connection("default")
+
+    @property
+    def timeout(self):
+        return int(settings.SYNC_APPLY_LEASE_TIMEOUT * 1000)
+
+    @property
+    def long_timeout(self):
+        return int(settings.SYNC_APPLY_LONG_LEASE_TIMEOUT * 1000)
+
+    def get_holder(self):
+        holder = self.client.get(self.key)
+        return holder.decode() if holder is not None else None
+
+    def acquire(self, timeout=None):
+        """
+        Acquires the lease if no other task holds it, or extends it if this task does,
+        for `timeout` milliseconds or the lease timeout
+        """
+        return bool(self.client.eval(ACQUIRE_SCRIPT, 1, self.key, self.task_id, timeout or self.timeout))
+
+    def transfer(self, task_id):
+        """
+        Hands the lease over to another task, if this task still holds it
+        """
+        transferred = bool(self.client.eval(TRANSFER_SCRIPT, 1, self.key, self.task_id, task_id, self.timeout))
+        if transferred:
+            self.task_id = task_id
+        return transferred
+
+    def release(self):
+        return bool(self.client.eval(TRANSFER_SCRIPT, 1, self.key, self.task_id, "", 0))
+
+
+def release_stale_lease(lease_key, active_task_ids):
+    """
+    Releases the lease on changes when the task holding it isn't active or reserved by a worker
+    """
+    lease = ChangeLease(lease_key, None)
+    holder = lease.get_holder()
+    if holder is None or holder in active_task_ids:
+        return False
+    lease.task_id = holder
+    return lease.release()
+
+
+def schedule_changes(task, user, lease_key, **kwargs):
+    """
+    Enqueues `task` to apply changes, unless a task already holds the lease on them
+    """
+    # Eagerly executed tasks run straight away, so there is nothing to wait for
+    if task.app.conf.task_always_eager:
+        return task.enqueue(user, **kwargs)
+    task_id = uuid.uuid4().hex
+    try:
+        if not ChangeLease(lease_key, task_id).acquire():
+            return None
+    except RedisError as e:
+        logging.warning("Unable to lease changes, falling back to task lookup: {}".format(e))
+        return task.fetch_or_enqueue(user, **kwargs)
+    return task.enqueue(user, task_id=task_id, **kwargs)
+
+
+def _apply_batch(changes_queryset, previous_revs=None, lease=None):
+    """
+    Applies the next batch of changes, returns their server_revs, or None if there
+    are no changes left or the batch is the same as the previous one
+    """
+    from contentcuration.models import Change
+    from contentcuration.viewsets.sync.base import apply_changes
+    from contentcuration.viewsets.sync.base import batched_change_types
+
+    revs = list(changes_queryset.order_by("server_rev").values_list("server_rev", flat=True)[:settings.SYNC_APPLY_BATCH_SIZE])
+    # Changes of types without a handler are never marked as applied, so stop rather than retry them forever
+    if not revs or revs == previous_revs:
+        return None
+
+    def extend_lease(run):
+        # Extend the lease to outlast the run, changes that can take long are applied on their own
+        if run[0].change_type in batched_change_types:
+            return lease.acquire()
+        return lease.acquire(timeout=lease.long_timeout)
+
+    apply_changes(Change.objects.filter(server_rev__in=revs), before_run=extend_lease if lease is not None else None)
+    return revs
+
+
+def _acquire_lease(task, lease_key):
+    """
+    Returns whether the task should apply the changes, and the lease it holds on them, if any
+    """
+    if task.app.conf.task_always_eager:
+        return True, None
+    lease = ChangeLease(lease_key, task.request.id)
+    try:
+        # Otherwise another task is applying these changes
+        return lease.acquire(), lease
+    except RedisError as e:
+        logging.warning("Unable to lease changes, applying them without a lease: {}".format(e))
+        return True, None
+
+
+def drain_changes(task, changes_queryset, lease_key):
+    """
+    Applies the changes in `changes_queryset` in batches from within `task`, while it holds the lease on them
+    """
+    proceed, lease = _acquire_lease(task, lease_key)
+    if not proceed:
+        return
+
+    handed_over = False
+    try:
+        handed_over = _drain_batches(task, changes_queryset, lease)
+    finally:
+        # Release the lease when the task fails too, rather than leaving the changes until it expires
+        if lease is not None and not handed_over:
+            _release_lease(lease)
+
+
+def _drain_batches(task, changes_queryset, lease):
+    """
+    Applies batches of changes until there are none left, returns whether the lease was handed over to a new task
+    """
+    deadline = time.time() + settings.SYNC_APPLY_TIME_SLICE
+    previous_revs = None
+    while True:
+        revs = _apply_batch(changes_queryset, previous_revs=previous_revs, lease=lease)
+        if revs is None:
+            if lease is None:
+                return False
+            lease.release()
+            # Requests that created changes while the lease was held didn't enqueue a task for them,
+            # changes that were just attempted and are still not applied don't count
+            pending = changes_queryset.exclude(server_rev__in=previous_revs or [])
+            if not pending.exists() or not lease.acquire():
+                return False
+        elif time.time() > deadline and changes_queryset.exists():
+            return _hand_over(task, lease)
+        elif lease is not None and not lease.acquire():
+            # The lease expired and another task has taken over
+            return False
+        previous_revs = revs or previous_revs
+
+
+def _release_lease(lease):
+    try:
+        lease.release()
+    except RedisError as e:
+        logging.warning("Unable to release lease on changes: {}".format(e))
+
+
+def _hand_over(task, lease):
+    if lease is None:
+        task.requeue()
+        return False
+    # The lease is handed over before the new task is enqueued, so that the new task finds that it holds it
+    task_id = uuid.uuid4().hex
+    if lease.transfer(task_id):
+        task.requeue(task_id=task_id)
+        return True
+    return False
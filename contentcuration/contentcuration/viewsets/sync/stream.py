@@ -0,0 +1,267 @@
+"""
+Streams of recently applied changes for the sync endpoint.
+
+Every channel and user has a stream of its most recent changes that have been applied, or have
+errored, kept in a Redis sorted set of serialized changes scored by their server_rev and trimmed
+to the last `SYNC_CHANGE_STREAM_SIZE` changes. Sync requests whose revisions are within the
+streams are answered from them, and the Change table is only queried for clients further behind.
+
+When a stream is created, a floor marker scored with the server_rev of the latest change of its
+channel or user is added to it, as the stream covers every change after that. Once the marker has
+been trimmed, the stream covers every change after the lowest server_rev it still holds.
+"""
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.db.models import Q
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework.utils.encoders import JSONEncoder
+
+
+CHANGE_STREAM_FIELDS = (
+    "server_rev",
+    "session_id",
+    "channel_id",
+    "user_id",
+    "created_by_id",
+    "applied",
+    "errored",
+    "table",
+    "change_type",
+    "kwargs",
+)
+
+# Streams of channels and users that have not changed for this long are removed
+CHANGE_STREAM_TIMEOUT = 24 * 60 * 60
+
+FLOOR_MEMBER = "floor"
+
+HITS_KEY = "sync:stream:hits"
+MISSES_KEY = "sync:stream:misses"
+
+
+def get_channel_stream_key(channel_id):
+    return "sync:stream:channel:{}".format(channel_id)
+
+
+def get_user_stream_key(user_id):
+    return "sync:stream:user:{}".format(user_id)
+
+
+def _get_channel_id(channel_id):
+    # Channel ids are compared as they are returned by the database, as hex strings
+    return uuid.UUID(str(channel_id)).hex if channel_id else None
+
+
+def _get_streams(channel_ids=(), user_ids=()):
+    # Maps the key of each stream to the filter for the changes it holds
+    streams = {}
+    for channel_id in channel_ids:
+        if channel_id:
+            channel_id = _get_channel_id(channel_id)
+            streams[get_channel_stream_key(channel_id)] = {"channel_id": channel_id}
+    for user_id in user_ids:
+        if user_id:
+            streams[get_user_stream_key(user_id)] = {"user_id": user_id}
+    return streams
+
+
+def serialize_change(change):
+    """
+    Serializes a change with the fields that SyncView.return_changes reads from the Change table
+    """
+    datum = {field: getattr(change, field) for field in CHANGE_STREAM_FIELDS}
+    datum["channel_id"] = _get_channel_id(change.channel_id)
+    return json.dumps(datum, cls=JSONEncoder)
+
+
+def _get_stream_floor(stream_filter, exclude_revs=()):
+    from contentcuration.models import Change
+
+    changes = Change.objects.filter(Q(applied=True) | Q(errored=True), **stream_filter).exclude(server_rev__in=exclude_revs)
+    return changes.aggregate(max_rev=Max("server_rev"))["max_rev"] or 0
+
+
+def _create_streams(client, streams, entries_by_key=None):
+    """
+    Creates the streams with the floor marker of their channel or user, unless they have been created since.
+    The changes about to be added to a stream are left out of its floor.
+    """
+    entries_by_key = entries_by_key or {}
+    pipeline = client.pipeline(transaction=False)
+    for key, stream_filter in streams.items():
+        floor = _get_stream_floor(stream_filter, exclude_revs=entries_by_key.get(key, {}).values())
+        pipeline.zadd(key, {FLOOR_MEMBER: floor}, nx=True)
+        pipeline.expire(key, CHANGE_STREAM_TIMEOUT)
+    pipeline.execute()
+
+
+def _get_stream_entries(changes):
+    streams = {}
+    entries_by_key = {}
+    for change in changes:
+        if change.applied or change.errored:
+            serialized = serialize_change(change)
+            change_streams = _get_streams(channel_ids=[change.channel_id], user_ids=[change.user_id])
+            for key in change_streams:
+                entries_by_key.setdefault(key, {})[serialized] = change.server_rev
+            streams.update(change_streams)
+    return streams, entries_by_key
+
+
+def add_changes_to_streams(changes):
+    """
+    Adds the changes that have been applied or have errored to the streams of their channels and users
+    """
+    size = settings.SYNC_CHANGE_STREAM_SIZE
+    if not size:
+        return
+
+    streams, entries_by_key = _get_stream_entries(changes)
+    if not streams:
+        return
+
+    keys = list(streams)
+    try:
+        client = get_redis_connection("default")
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.exists(key)
+        _create_streams(client, {key: streams[key] for key, exists in zip(keys, pipeline.execute()) if not exists}, entries_by_key)
+
+        pipeline = client.pipeline(transaction=True)
+        for key in keys:
+            pipeline.zadd(key, entries_by_key[key])
+            # Keep the floor marker as well as the most recent changes
+            pipeline.zremrangebyrank(key, 0, -(size + 2))
+            pipeline.expire(key, CHANGE_STREAM_TIMEOUT)
+        pipeline.execute()
+    except RedisError as e:
+        logging.warning("Unable to add changes to sync streams: {}".format(e))
+        # Remove the streams rather than leave gaps in them, so that they are rebuilt from this point on
+        try:
+            get_redis_connection("default").delete(*keys)
+        except RedisError:
+            pass
+
+
+def publish_changes(changes):
+    """
+    Adds the changes to the streams of their channels and users, once the current
+    transaction has been committed and the changes can be read
+    """
+    changes = list(changes)
+    transaction.on_commit(lambda: add_changes_to_streams(changes))
+
+
+def _count_request(client, hit):
+    try:
+        client.incr(HITS_KEY if hit else MISSES_KEY)
+    except RedisError:
+        pass
+
+
+def _is_covered(since, floor, lowest):
+    # Whether a stream holds every change after the `since` revision
+    if floor is not None:
+        return since >= floor
+    return bool(lowest) and since >= lowest[0][1] - 1
+
+
+def _load_members(members):
+    return [json.loads(member) for member in members if member != FLOOR_MEMBER.encode()]
+
+
+def _read_streams(client, streams, stream_filters, create=True):
+    """
+    Reads the floor marker, the lowest entry, and the entries after the `since` revision of each stream,
+    streams that don't exist yet are created and read again
+    """
+    pipeline = client.pipeline(transaction=True)
+    for key, since in streams:
+        pipeline.zscore(key, FLOOR_MEMBER)
+        pipeline.zrange(key, 0, 0, withscores=True)
+        pipeline.zrangebyscore(key, "({}".format(since), "+inf")
+    results = pipeline.execute()
+    results = [results[i:i + 3] for i in range(0, len(results), 3)]
+
+    missing = [key for (key, since), (floor, lowest, members) in zip(streams, results) if floor is None and not lowest]
+    if missing and create:
+        _create_streams(client, {key: stream_filters[key] for key in missing})
+        return _read_streams(client, streams, stream_filters, create=False)
+    return results
+
+
+def get_stream_changes(user_id, user_rev, channel_revs, unapplied_revs=()):
+    """
+    Returns the changes for the user and the channels after their revisions, and the changes with the
+    unapplied revisions, ordered by server_rev, or None if the streams don't go back far enough
+    """
+    if not settings.SYNC_CHANGE_STREAM_SIZE:
+        return None
+
+    try:
+        unapplied_revs = set(int(rev) for rev in unapplied_revs)
+        revs = [(get_user_stream_key(user_id), int(user_rev))]
+        revs.extend((get_channel_stream_key(channel_id), int(rev)) for channel_id, rev in channel_revs.items())
+    except (TypeError, ValueError):
+        return None
+
+    # The streams have to cover the unapplied revisions too
+    streams = [(key, min([rev] + [unapplied_rev - 1 for unapplied_rev in unapplied_revs])) for key, rev in revs]
+
+    try:
+        client = get_redis_connection("default")
+        results = _read_streams(client, streams, _get_streams(channel_ids=channel_revs.keys(), user_ids=[user_id]))
+    except RedisError as e:
+        logging.warning("Unable to read sync streams: {}".format(e))
+        return None
+
+    changes = {}
+    for (key, rev), (key, since), (floor, lowest, members) in zip(revs, streams, results):
+        if not _is_covered(since, floor, lowest):
+            _count_request(client, False)
+            return None
+        for change in _load_members(members):
+            if change["server_rev"] > rev or change["server_rev"] in unapplied_revs:
+                changes[change["server_rev"]] = change
+
+    _count_request(client, True)
+    return [changes[server_rev] for server_rev in sorted(changes)]
+
+
+def get_change_stream_stats(channel_ids=(), user_ids=()):
+    """
+    Returns the size setting and hit rate of the streams, and the window of revisions covered
+    by the streams of the given channels and users
+    """
+    client = get_redis_connection("default")
+    hits, misses = (int(value or 0) for value in client.mget(HITS_KEY, MISSES_KEY))
+    keys = list(_get_streams(channel_ids=channel_ids, user_ids=user_ids))
+
+    pipeline = client.pipeline(transaction=False)
+    for key in keys:
+        pipeline.zrange(key, 0, -1, withscores=True)
+    streams = {}
+    for key, members in zip(keys, pipeline.execute()):
+        revs = [score for member, score in members if member != FLOOR_MEMBER.encode()]
+        floor = next((score for member, score in members if member == FLOOR_MEMBER.encode()), None)
+        streams[key] = {
+            "length": len(revs),
+            "min_rev": int(min(revs)) if revs else None,
+            "max_rev": int(max(revs)) if revs else None,
+            "floor": int(floor) if floor is not None else None,
+        }
+
+    return {
+        "size": settings.SYNC_CHANGE_STREAM_SIZE,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": float(hits) / (hits + misses) if hits + misses else None,
+        "streams": streams,
+    }
@@ -1,6 +1,7 @@
 from functools import reduce
 
 from django.db import IntegrityError
+from django.db import transaction
 from django.db.models import BooleanField
 from django.db.models import CharField
 from django.db.models import Exists
@@ -248,7 +249,8 @@ class ChannelUserViewSet(ReadOnlyValuesViewset):
 
         # In Django 2.2 add ignore_conflicts to make this fool proof
         try:
-            self._execute_changes(table, change_type, data)
+            with transaction.atomic():
+                self._execute_changes(table, change_type, data)
         except IntegrityError as e:
             for change in valid_changes:
                 change.update({"errors": str(e)})
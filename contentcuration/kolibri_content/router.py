@@ -9,9 +9,12 @@ database to be specified for a block of code, as follows:
 
 Thanks to https://github.com/ambitioninc/django-dynamic-db-router for inspiration behind the approach taken here.
 """
+import hashlib
 import os
+import sqlite3
 import threading
 from builtins import object
+from contextlib import closing
 from functools import wraps
 
 from django.apps import apps
@@ -82,6 +85,35 @@ def cleanup_content_database_connection(alias):
         pass
 
 
+def open_in_memory_content_database(path):
+    """
+    Loads the SQLite content database at `path` into a shared in-memory database, and routes the `path`
+    alias to it. Returns a connection to the in-memory database, which keeps it alive until it is closed.
+    """
+    uri = "file:{}?mode=memory&cache=shared".format(hashlib.md5(path.encode("utf-8")).hexdigest())
+    memory_connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    with closing(sqlite3.connect(path)) as disk_connection:
+        disk_connection.backup(memory_connection)
+    connections.databases[path] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": uri,
+    }
+    return memory_connection
+
+
+def save_in_memory_content_database(memory_connection, path):
+    """
+    Vacuums and analyzes an in-memory content database, then writes it to `path` with a single backup
+    """
+    memory_connection.execute("ANALYZE")
+    memory_connection.execute("VACUUM")
+    with closing(sqlite3.connect(path)) as disk_connection:
+        # The file is overwritten in full, so there is nothing for a journal or syncs to protect
+        disk_connection.execute("PRAGMA journal_mode=OFF")
+        disk_connection.execute("PRAGMA synchronous=OFF")
+        memory_connection.backup(disk_connection)
+
+
 class ContentDBRouter(object):
     """A router that decides what content database to read from based on a thread-local variable."""
 
@@ -135,6 +167,10 @@ class using_content_database(object):
 
     :type alias: str
     :param alias: The alias for the content database to run queries on.
+    :type in_memory: bool
+    :param in_memory: Whether to run the queries on an in-memory copy of the content database, which must
+        be a SQLite file, and write it back to the file in a single backup once the block completes without
+        errors. Use this when building a database with many writes.
 
     Usage as a context manager:
 
@@ -158,17 +194,34 @@ class using_content_database(object):
 
     """
 
-    def __init__(self, alias):
+    def __init__(self, alias, in_memory=False):
         self.alias = alias
+        self.in_memory = in_memory
+        self.memory_connection = None
 
     def __enter__(self):
         self.previous_alias = getattr(THREAD_LOCAL, "ACTIVE_CONTENT_DB_ALIAS", None)
+        if self.in_memory:
+            self.memory_connection = open_in_memory_content_database(self.alias)
         set_active_content_database(self.alias)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         set_active_content_database(self.previous_alias)
         cleanup_content_database_connection(self.alias)
+        if self.memory_connection is not None:
+            # Drop this thread's connection to the in-memory database, so that the alias is routed
+            # to the file again the next time it is used
+            try:
+                del connections[self.alias]
+            except AttributeError:
+                pass
+            try:
+                if exc_type is None:
+                    save_in_memory_content_database(self.memory_connection, self.alias)
+            finally:
+                self.memory_connection.close()
+                self.memory_connection = None
 
     def __call__(self, querying_func):
         # allow using the context manager as a decorator
@@ -0,0 +1,88 @@
+"""
+Helpers for setting up the SQLite content databases that channels are exported to.
+
+Running the content migrations on an empty database adds a fixed cost to every export, so each
+process migrates a template database once, and new content databases are created as copies of it.
+The template is rebuilt whenever the migrations of the content app change.
+"""
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from django.core.management import call_command
+from django.db import connections
+from django.db.migrations.executor import MigrationExecutor
+from kolibri_content import migrations
+from kolibri_content.apps import KolibriContentConfig
+from kolibri_content.router import get_active_content_database
+from kolibri_content.router import using_content_database
+
+# Paths of the template databases of this process, keyed by the migration state they were built from
+_template_databases = {}
+_template_lock = threading.Lock()
+
+
+def get_migration_state():
+    """
+    Returns a hash of the migration files of the content app, which changes whenever they do
+    """
+    migrations_dir = os.path.dirname(migrations.__file__)
+    state = hashlib.md5()
+    for filename in sorted(os.listdir(migrations_dir)):
+        if filename.endswith(".py"):
+            stat = os.stat(os.path.join(migrations_dir, filename))
+            state.update("{}:{}:{}".format(filename, stat.st_size, stat.st_mtime_ns).encode("utf-8"))
+    return state.hexdigest()
+
+
+def get_template_database():
+    """
+    Returns the path of an empty content database with all of the content migrations applied,
+    building it if this process doesn't have one for the current migration state
+    """
+    state = get_migration_state()
+    with _template_lock:
+        template = _template_databases.get(state)
+        if template is None or not os.path.exists(template):
+            fd, template = tempfile.mkstemp(suffix=".sqlite3")
+            os.close(fd)
+            with using_content_database(template):
+                call_command("migrate", KolibriContentConfig.label, database=get_active_content_database(), no_input=True)
+            # Templates for previous migration states will never be used again
+            for previous_template in _template_databases.values():
+                _remove_template_database(previous_template)
+            _template_databases.clear()
+            _template_databases[state] = template
+        return template
+
+
+def copy_template_database(path):
+    """
+    Creates an empty, migrated content database at `path`
+    """
+    shutil.copyfile(get_template_database(), path)
+
+
+def migrate_content_database(alias):
+    """
+    Applies any content migrations that are missing from the content database `alias`, without
+    the overhead of running the migrate command when the database is already up to date
+    """
+    executor = MigrationExecutor(connections[alias])
+    targets = [key for key in executor.loader.graph.leaf_nodes() if key[0] == KolibriContentConfig.label]
+    if executor.migration_plan(targets):
+        call_command("migrate", KolibriContentConfig.label, database=alias, no_input=True)
+
+
+def _remove_template_database(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@atexit.register
+def _remove_template_databases():
+    for template in _template_databases.values():
+        _remove_template_database(template)
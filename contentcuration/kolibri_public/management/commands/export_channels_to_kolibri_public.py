@@ -7,21 +7,22 @@ from datetime import timedelta
 
 from django.conf import settings
 from django.core.files.storage import default_storage as storage
-from django.core.management import call_command
 from django.core.management.base import BaseCommand
 from django.db.models import F
 from django.db.models import Q
 from django.utils import timezone
-from kolibri_content.apps import KolibriContentConfig
 from kolibri_content.models import ChannelMetadata as ExportedChannelMetadata
 from kolibri_content.router import get_active_content_database
 from kolibri_content.router import using_content_database
+from kolibri_content.utils import migrate_content_database
 from kolibri_public.models import ChannelMetadata
 from kolibri_public.utils.mapper import ChannelMapper
 
 from contentcuration.models import Channel
 from contentcuration.models import User
+from contentcuration.utils.publish import check_export_database
 from contentcuration.utils.publish import create_content_database
+from contentcuration.utils.publish import get_export_database_manifest
 
 logger = logging.getLogger(__file__)
 
@@ -60,13 +61,17 @@ class Command(BaseCommand):
     def _export_channel(self, channel_id):
         logger.info("Putting channel {} into kolibri_public".format(channel_id))
         db_location = os.path.join(settings.DB_ROOT, "{id}.sqlite3".format(id=channel_id))
+        manifest = get_export_database_manifest(db_location)
         with storage.open(db_location) as storage_file:
             with tempfile.NamedTemporaryFile(suffix=".sqlite3") as db_file:
                 shutil.copyfileobj(storage_file, db_file)
+                db_file.flush()
+                if not check_export_database(db_file.name, manifest):
+                    raise ValueError("Published channel database for {} does not match its manifest".format(channel_id))
                 db_file.seek(0)
                 with using_content_database(db_file.name):
                     # Run migration to handle old content databases published prior to current fields being added.
-                    call_command("migrate", app_label=KolibriContentConfig.label, database=get_active_content_database())
+                    migrate_content_database(get_active_content_database())
                     channel = ExportedChannelMetadata.objects.get(id=channel_id)
                     logger.info("Found channel {} for id: {} mapping now".format(channel.name, channel_id))
                     mapper = ChannelMapper(channel)